@@ -1,5 +1,6 @@
 from flask import Flask, request, jsonify
 import insightface
+from insightface.utils import face_align
 import numpy as np
 import cv2
 import base64
@@ -10,6 +11,7 @@ app = Flask(__name__)
 # Load InsightFace model
 model = insightface.app.FaceAnalysis(providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
 model.prepare(ctx_id=0, det_size=(640, 640))
+recognition_model = model.models['recognition']
 
 @app.route('/api/detect', methods=['POST'])
 def detect_faces():
@@ -55,6 +57,51 @@ def extract_embeddings():
         "status": "SUCCESS"
     })
 
+@app.route('/api/extract_embeddings_batch', methods=['POST'])
+def extract_embeddings_batch():
+    """
+    Extract the embedding of the largest face in each of several images.
+    Detection runs per image, recognition runs once for all aligned faces.
+    Results are in input order; failed images get an "error" entry.
+    """
+    data = request.json
+    images = data.get('images', [])
+    
+    results = [None] * len(images)
+    crops = []
+    crop_indexes = []
+    
+    for index, image_b64 in enumerate(images):
+        try:
+            img_data = base64.b64decode(image_b64)
+            img = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
+        except Exception:
+            img = None
+        if img is None:
+            results[index] = {"error": "Could not decode image"}
+            continue
+        
+        bboxes, kpss = model.det_model.detect(img, max_num=0, metric='default')
+        if bboxes is None or bboxes.shape[0] == 0 or kpss is None:
+            results[index] = {"error": "No face detected"}
+            continue
+        
+        # Get the largest face
+        areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+        largest = int(np.argmax(areas))
+        crops.append(face_align.norm_crop(img, landmark=kpss[largest], image_size=recognition_model.input_size[0]))
+        crop_indexes.append(index)
+    
+    if crops:
+        embeddings = recognition_model.get_feat(crops)
+        for index, embedding in zip(crop_indexes, embeddings):
+            results[index] = {
+                "embeddings": base64.b64encode(embedding.astype(np.float32).tobytes()).decode('utf-8'),
+                "status": "SUCCESS"
+            }
+    
+    return jsonify({"results": results, "status": "SUCCESS"})
+
 @app.route('/api/compare', methods=['POST'])
 def compare_embeddings():
     data = request.json
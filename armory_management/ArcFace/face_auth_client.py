@@ -12,7 +12,10 @@ from PIL import Image, ImageTk
 import configparser
 from datetime import datetime
 import threading
+import time
 import queue
+import struct
+import uuid
 import math
 from pyzbar.pyzbar import decode as decode_qr
 
@@ -72,6 +75,7 @@ class FaceAuthClientApp:
         
         # Status variables
         self.personnel_id = None
+        self.prefetch_token = None
         self.verified = False
         self.qr_scanned = False
         self.qr_data = None
@@ -819,25 +823,54 @@ class FaceAuthClientApp:
                 if self.api_token:
                     headers['Authorization'] = f'Token {self.api_token}'
                 
-                # Get list of personnel with face records
-                url = f"{self.api_base_url.rstrip('/')}/list_faces/"
-                response = requests.get(url, headers=headers, timeout=30)
+                # Only fetch what changed since the last sync
+                cursor = self.local_processor.load_sync_cursor()
+                if cursor is not None:
+                    result = self.download_face_changes(headers, cursor)
+                    if result is not None:
+                        return result
                 
-                if response.status_code != 200:
+                # Download every embedding in one request when the server supports it
+                export = self.download_embedding_export(headers)
+                if export is not None:
+                    embeddings, cursor = export
+                    self.local_processor.embeddings_db.update(embeddings)
+                    self.local_processor.save_embeddings_db()
+                    if cursor is not None:
+                        self.local_processor.save_sync_cursor(cursor)
                     return {
-                        'success': False,
-                        'error': f"Failed to retrieve face list: {response.text}",
-                        'status': "Sync failed"
+                        'success': True,
+                        'message': f"Sync complete. {len(embeddings)} records synchronized.",
+                        'status': "Sync complete"
                     }
                 
-                personnel_list = response.json()
+                # Get list of personnel with face records, one page at a time
+                url = f"{self.api_base_url.rstrip('/')}/list_faces/"
+                records = []
+                list_cursor = None
+                while True:
+                    params = {'cursor': list_cursor} if list_cursor else {}
+                    response = requests.get(url, headers=headers, params=params, timeout=30)
+                    
+                    if response.status_code != 200:
+                        return {
+                            'success': False,
+                            'error': f"Failed to retrieve face list: {response.text}",
+                            'status': "Sync failed"
+                        }
+                    
+                    personnel_list = response.json()
+                    records.extend(personnel_list.get('records', []))
+                    list_cursor = personnel_list.get('next_cursor')
+                    if not list_cursor:
+                        break
                 
                 # Track success and failures
                 success_count = 0
                 fail_count = 0
                 
                 # Download each face record
-                for person in personnel_list.get('records', []):
+                for person in records:
                     personnel_id = person.get('personnel_id')
                     
                     if not personnel_id:
@@ -887,6 +920,88 @@ class FaceAuthClientApp:
         # Queue the task
         self.task_queue.put((sync_task, self.handle_sync_result))
     
+    def download_face_changes(self, headers, cursor):
+        """
+        Apply the server's face changes since the saved cursor.
+        Returns the sync result, or None if a full sync is needed instead.
+        """
+        url = f"{self.api_base_url.rstrip('/')}/changes/"
+        upserted = 0
+        deleted = 0
+        
+        while True:
+            response = requests.get(url, headers=headers, params={'since': cursor, 'limit': 500}, timeout=30)
+            if response.status_code in (400, 404, 410):
+                # Old server or unusable cursor
+                return None
+            if response.status_code != 200:
+                raise Exception(f"Failed to retrieve face changes: {response.text}")
+            
+            page = response.json()
+            changes = []
+            for change in page.get('changes', []):
+                if change.get('action') == 'upsert':
+                    change['embedding'] = np.frombuffer(base64.b64decode(change['embedding']), dtype=np.float32)
+                changes.append(change)
+            
+            page_upserted, page_deleted = self.local_processor.apply_changes(changes)
+            upserted += page_upserted
+            deleted += page_deleted
+            cursor = page.get('cursor', cursor)
+            
+            if not page.get('has_more'):
+                break
+        
+        # Save the embeddings before the cursor, a crash in between only repeats changes
+        self.local_processor.save_embeddings_db()
+        self.local_processor.save_sync_cursor(cursor)
+        
+        return {
+            'success': True,
+            'message': f"Sync complete. {upserted} records updated, {deleted} removed.",
+            'status': "Sync complete"
+        }
+    
+    def download_embedding_export(self, headers):
+        """
+        Download all embeddings from the bulk export endpoint.
+        Returns (personnel_id -> embedding dict, change cursor), or None if the server has no export endpoint.
+        """
+        url = f"{self.api_base_url.rstrip('/')}/export/embeddings/"
+        response = requests.get(url, headers=headers, params={'compression': 'gzip'}, timeout=120)
+        
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise Exception(f"Failed to export embeddings: {response.text}")
+        
+        # requests has already undone the gzip Content-Encoding
+        data = response.content
+        magic, version, flags, count, dimension, generated_at = struct.unpack_from('<4sHHIIQ', data, 0)
+        if magic != b'FEMB' or version != 1:
+            raise Exception("Unexpected embedding export format")
+        
+        # Id table: u8 length + UTF-8 id per record, padded to 4 bytes
+        header_size = struct.calcsize('<4sHHIIQ')
+        offset = header_size
+        ids = []
+        for _ in range(count):
+            length = data[offset]
+            ids.append(data[offset + 1:offset + 1 + length].decode('utf-8'))
+            offset += 1 + length
+        offset += -(offset - header_size) % 4
+        
+        # Packed float32 matrix, one row per id
+        matrix = np.frombuffer(data, dtype='<f4', count=count * dimension, offset=offset).reshape(count, dimension)
+        
+        # Older servers send no cursor, the next sync is then a full one again
+        cursor = response.headers.get('X-Change-Cursor')
+        cursor = int(cursor) if cursor is not None else None
+        
+        # All-zero rows were deleted while the server streamed the export
+        embeddings = {personnel_id: matrix[row].copy() for row, personnel_id in enumerate(ids) if np.any(matrix[row])}
+        return embeddings, cursor
+    
     def handle_sync_result(self, result):
         """Handle the sync result"""
         if result['success']:
@@ -934,6 +1049,7 @@ class FaceAuthClientApp:
             self.qr_scanned = False
             self.qr_data = None
             self.personnel_id = None
+            self.prefetch_token = None
             self.transaction_completed = False
             self.qr_status_label.config(text="Step 1: Scan Weapon QR Code", foreground="black")
             self.face_status_label.config(text="Step 2: Face Verification (waiting)", foreground="gray")
@@ -1391,10 +1507,10 @@ class FaceAuthClientApp:
                 location = weapon_info.get('location', 'unknown')
                 recommended_action = result.get('recommended_action')
 
-                if location == 'armory':
+                if location == 'in':
                     self.transaction_type.set('check_out')
                     self.transaction_mode_label.config(text="CHECK OUT (In Armory)", foreground="blue")
-                elif location == 'field':
+                elif location == 'out':
                     self.transaction_type.set('check_in')
                     self.transaction_mode_label.config(text="CHECK IN (In Field)", foreground="green")
                 else:
@@ -1403,6 +1519,8 @@ class FaceAuthClientApp:
                 
                 # Store and display personnel info
                 self.personnel_id = result.get('personnel_id')
+                # Lets the transaction skip the lookups the server already did
+                self.prefetch_token = result.get('prefetch_token')
                 personnel_info = result.get('personnel_info', {})
                 
                 if self.personnel_id:
@@ -1533,7 +1651,8 @@ class FaceAuthClientApp:
                 'personnel_id': personnel_id,
                 'face_image': img_base64,
                 'qr_code': qr_data,
-                'transaction_type': self.transaction_type.get()
+                'transaction_type': self.transaction_type.get(),
+                'prefetch_token': self.prefetch_token
             }
 
             # Set headers
@@ -1549,7 +1668,7 @@ class FaceAuthClientApp:
             self.status_label.config(text="Processing transaction...")
             self.face_status_label.config(text="Step 2: Verifying face...", foreground="blue")
 
-            response = requests.post(url, json=data, headers=headers, timeout=10)
+            response = self.post_idempotent(url, data, headers)
 
             if response.status_code == 200:
                 result = response.json()
@@ -1602,6 +1721,7 @@ class FaceAuthClientApp:
         self.qr_scanned = False
         self.qr_data = None
         self.personnel_id = None
+        self.prefetch_token = None
         self.transaction_completed = False
         
         self.qr_status_label.config(text="Step 1: Scan Weapon QR Code", foreground="black")
@@ -1693,6 +1813,28 @@ class FaceAuthClientApp:
                 'status': "Local registration failed"
             }
     
+    def post_idempotent(self, url, data, headers, timeout=10, attempts=3):
+        """
+        POST with an Idempotency-Key, retrying timeouts and dropped connections
+        with the same key so the server never runs the request twice
+        """
+        headers = dict(headers, **{'Idempotency-Key': str(uuid.uuid4())})
+        
+        for attempt in range(attempts):
+            try:
+                response = requests.post(url, json=data, headers=headers, timeout=timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                if attempt == attempts - 1:
+                    raise
+                print(f"Request to {url} timed out, retrying ({attempt + 1}/{attempts - 1})")
+                continue
+            
+            # The first attempt is still running on the server
+            if response.status_code == 409 and attempt < attempts - 1:
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+                continue
+            return response
+    
     def register_face_online(self, personnel_id, frame):
         """Register face using server API"""
         try:
@@ -1702,10 +1844,11 @@ class FaceAuthClientApp:
             # Convert to base64
             img_base64 = base64.b64encode(buffer).decode('utf-8')
             
-            # Prepare data for API
+            # Prepare data for API, the server queues the registration
             data = {
                 'personnel_id': personnel_id,
-                'face_image': img_base64
+                'face_image': img_base64,
+                'async': True
             }
             
             # Set headers
@@ -1715,7 +1858,11 @@ class FaceAuthClientApp:
             
             # Send request
             url = f"{self.api_base_url.rstrip('/')}/register/"
-            response = requests.post(url, json=data, headers=headers, timeout=10)
+            response = self.post_idempotent(url, data, headers)
+            
+            if response.status_code == 202:
+                # Poll the job until the server has processed the image
+                response = self.wait_for_registration_job(response.json(), headers)
             
             if response.status_code in [200, 201]:
                 # Success
@@ -1750,6 +1897,30 @@ class FaceAuthClientApp:
                 'status': "Registration failed - connection error"
             }
         
+    def wait_for_registration_job(self, job, headers, timeout=60, interval=0.5):
+        """Poll a queued registration and return the final status response"""
+        status_url = job.get('status_url') or f"{self.api_base_url.rstrip('/')}/register/jobs/{job['job_id']}/"
+        deadline = time.time() + timeout
+        
+        while True:
+            response = requests.get(status_url, headers=headers, timeout=10)
+            if response.status_code != 200:
+                return response
+            
+            job_status = response.json().get('status')
+            if job_status == 'succeeded':
+                return response
+            if job_status == 'failed':
+                # Report the job error like a failed synchronous registration
+                response.status_code = 400
+                return response
+            
+            if time.time() > deadline:
+                raise TimeoutError(f"Registration job {job.get('job_id')} is still {job_status}")
+            
+            self.root.after(0, lambda s=job_status: self.status_label.config(text=f"Registering face... ({s})"))
+            time.sleep(interval)
+    
     def handle_verification_result(self, result):
         """Handle the verification result and update UI"""
         # Re-enable button if needed
@@ -1810,7 +1981,8 @@ class FaceAuthClientApp:
                 'personnel_id': personnel_id,
                 'face_image': img_base64,
                 'qr_code': qr_data,
-                'transaction_type': self.transaction_type.get()
+                'transaction_type': self.transaction_type.get(),
+                'prefetch_token': self.prefetch_token
             }
 
             # Set headers
@@ -1825,7 +1997,7 @@ class FaceAuthClientApp:
             self.status_label.config(text="Processing transaction...")
             self.face_status_label.config(text="Step 2: Verifying face...", foreground="blue")
 
-            response = requests.post(url, json=data, headers=headers, timeout=10)
+            response = self.post_idempotent(url, data, headers)
 
             if response.status_code == 200:
                 result = response.json()
@@ -3,6 +3,7 @@ import cv2
 import numpy as np
 import dlib
 import pickle
+import json
 from pathlib import Path
 
 class LocalArcFaceProcessor:
@@ -40,6 +41,7 @@ class LocalArcFaceProcessor:
         
         # Database for face embeddings
         self.embeddings_db_path = self.models_dir / 'face_embeddings.pkl'
+        self.sync_cursor_path = self.models_dir / 'sync_cursor.json'
         self.load_embeddings_db()
     
     def load_embeddings_db(self):
@@ -55,6 +57,42 @@ class LocalArcFaceProcessor:
         with open(self.embeddings_db_path, 'wb') as f:
             pickle.dump(self.embeddings_db, f)
     
+    def load_sync_cursor(self):
+        """Server change cursor of the last sync, None if never synced"""
+        if not self.sync_cursor_path.exists():
+            return None
+        try:
+            with open(self.sync_cursor_path, 'r') as f:
+                return json.load(f).get('cursor')
+        except (OSError, ValueError):
+            return None
+    
+    def save_sync_cursor(self, cursor):
+        """Remember the server change cursor, call after save_embeddings_db"""
+        with open(self.sync_cursor_path, 'w') as f:
+            json.dump({'cursor': cursor}, f)
+    
+    def apply_changes(self, changes):
+        """
+        Apply server face changes to the embeddings database (not saved).
+        
+        Args:
+            changes (list): Change dicts with personnel_id, action and, for
+                upserts, the float32 embedding as a numpy array
+        
+        Returns:
+            tuple: (upserted, deleted) counts
+        """
+        upserted = 0
+        deleted = 0
+        for change in changes:
+            if change['action'] == 'upsert':
+                self.embeddings_db[change['personnel_id']] = change['embedding']
+                upserted += 1
+            elif self.embeddings_db.pop(change['personnel_id'], None) is not None:
+                deleted += 1
+        return upserted, deleted
+    
     def detect_face(self, image):
         """
         Detect faces in an image
@@ -1,4 +1,20 @@
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection
 from django.utils import translation
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+accept_encoding_re = re.compile(r'\s*([^\s;,]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?')
 
 class ForceAdminLanguageMiddleware:
     def __init__(self, get_response):
@@ -11,4 +27,106 @@ class ForceAdminLanguageMiddleware:
         response = self.get_response(request)
         translation.deactivate()
         return response
-    
\ No newline at end of file
+    
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'application/x-ndjson',
+)
+
+class CompressionMiddleware:
+    """
+    Compress large text responses with Brotli or gzip, whichever the client
+    prefers (Brotli on a tie). Streaming responses and responses that
+    already carry a Content-Encoding are passed through unchanged.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_length = getattr(settings, 'COMPRESSION_MIN_LENGTH', 1024)
+        self.brotli_quality = getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if response.status_code != 200 or len(response.content) < self.min_length:
+            return response
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        # The body depends on Accept-Encoding from here on, even if not compressed
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = self.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding == 'br':
+            compressed = brotli.compress(response.content, quality=self.brotli_quality)
+        elif encoding == 'gzip':
+            compressed = compress_string(response.content, max_random_bytes=100)
+        else:
+            return response
+
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+
+        # The compressed body is no longer byte-identical to what the ETag described
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+
+        return response
+
+    def negotiate(self, accept_encoding):
+        """Preferred supported encoding of an Accept-Encoding header, or None"""
+        weights = {}
+        for coding, q in accept_encoding_re.findall(accept_encoding.lower()):
+            try:
+                weights[coding] = float(q) if q else 1.0
+            except ValueError:
+                continue
+
+        candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+        best = None
+        for coding in candidates:
+            weight = weights.get(coding, weights.get('*', 0.0))
+            if weight > 0 and (best is None or weight > best[1]):
+                best = (coding, weight)
+        return best[0] if best else None
+
+
+class QueryCounter:
+    """Counts the queries run on a database connection"""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QueryCountMiddleware:
+    """
+    Report the number of database queries of each request in an
+    X-DB-Queries header and a debug log line. Queries of streaming bodies
+    run after the header is sent and are not counted.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, 'QUERY_COUNT_HEADER', True)
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+
+        if self.header:
+            response['X-DB-Queries'] = str(counter.count)
+        logger.debug(f"{request.method} {request.path}: {counter.count} queries")
+        return response
@@ -69,6 +69,8 @@ ARCFACE_API_KEY = ""
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'armory_management.middleware.CompressionMiddleware',
+    'armory_management.middleware.QueryCountMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
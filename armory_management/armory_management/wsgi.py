@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'armory_management.settings')
 
 application = get_wsgi_application()
+
+# Load the face gallery as soon as the worker starts
+from face_authentication.gallery import gallery
+gallery.warm()
+
+# Pick up registrations queued before the last restart
+from face_authentication.registration import registration_worker
+registration_worker.resume()
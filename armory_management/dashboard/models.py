@@ -1,3 +1,42 @@
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 
-# Create your models here.
+
+class DataVersion(models.Model):
+    """
+    Change counter per data set, bumped whenever its rows change.
+    Dashboard views derive their ETag/Last-Modified from it, so polls of
+    unchanged data are answered with 304 before any heavy query runs.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+    @classmethod
+    def bump(cls, name):
+        """Increment the version of a data set"""
+        now = timezone.now()
+        if not cls.objects.filter(name=name).update(version=F('version') + 1, updated_at=now):
+            cls.objects.get_or_create(name=name, defaults={'version': 1, 'updated_at': now})
+
+    @classmethod
+    def stamp(cls, *names):
+        """
+        Combined version of several data sets, in one query.
+
+        Returns:
+            tuple: (version string, last modified datetime or None)
+        """
+        rows = dict((name, (version, updated_at)) for name, version, updated_at in
+                    cls.objects.filter(name__in=names).values_list('name', 'version', 'updated_at'))
+        version = '.'.join(str(rows.get(name, (0, None))[0]) for name in names)
+        updated = [updated_at for _, updated_at in rows.values()]
+        return version, max(updated) if updated else None
+
+    class Meta:
+        verbose_name = 'Өгөгдлийн хувилбар'
+        verbose_name_plural = 'Өгөгдлийн хувилбарууд'
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from inventory.models import Personnel, Weapon
+from face_authentication.models import FaceRecord, WeaponTransaction
+from face_authentication.transactions import transactions_committed
+from .models import DataVersion
+from .stats import stats_snapshot
+
+# Data set each model belongs to
+VERSIONED_MODELS = {
+    Personnel: 'personnel',
+    Weapon: 'weapons',
+    WeaponTransaction: 'transactions',
+}
+
+@receiver(post_save, sender=Personnel)
+@receiver(post_delete, sender=Personnel)
+@receiver(post_save, sender=Weapon)
+@receiver(post_delete, sender=Weapon)
+@receiver(post_save, sender=WeaponTransaction)
+@receiver(post_delete, sender=WeaponTransaction)
+def bump_data_version(sender, **kwargs):
+    """Bump the data set version once the change is committed"""
+    name = VERSIONED_MODELS[sender]
+    # After commit, so a client never caches old data under the new version
+    transaction.on_commit(lambda: DataVersion.bump(name))
+
+@receiver(transactions_committed)
+def bump_batch_data_versions(sender, **kwargs):
+    """Batch transactions are bulk-written and send no post_save"""
+    DataVersion.bump('transactions')
+    DataVersion.bump('weapons')
+    stats_snapshot.invalidate()
+
+@receiver(post_save, sender=Personnel)
+@receiver(post_delete, sender=Personnel)
+@receiver(post_save, sender=Weapon)
+@receiver(post_delete, sender=Weapon)
+@receiver(post_save, sender=FaceRecord)
+@receiver(post_delete, sender=FaceRecord)
+@receiver(post_save, sender=WeaponTransaction)
+@receiver(post_delete, sender=WeaponTransaction)
+def invalidate_stats(sender, **kwargs):
+    """Recount the dashboard numbers once the change is committed"""
+    transaction.on_commit(stats_snapshot.invalidate)
+
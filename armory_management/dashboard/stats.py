@@ -0,0 +1,123 @@
+# dashboard/stats.py
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from face_authentication.counters import daily_key
+from face_authentication.models import StatCounter
+
+# version is a hash of the numbers, the same in every process;
+# generated_at is when the numbers last changed
+Stats = namedtuple('Stats', ['version', 'generated_at', 'data'])
+
+
+def collect_stats():
+    """
+    Every dashboard number, read from the incrementally maintained
+    counters table in one query.
+
+    Returns:
+        dict: personnel, weapons, face_records, transactions and
+        auth_failures counts
+    """
+    transactions_today = daily_key('transactions')
+    auth_failures_today = daily_key('auth_failures')
+    values = StatCounter.read(
+        'personnel.total', 'personnel.active',
+        'weapons.total', 'weapons.status.available', 'weapons.status.assigned',
+        'weapons.status.maintenance', 'weapons.status.decommissioned',
+        'weapons.location.out', 'weapons.location.in',
+        'face_records.total', 'face_records.active',
+        transactions_today, auth_failures_today
+    )
+    return {
+        'personnel': {
+            'count': values['personnel.total'],
+            'active_count': values['personnel.active'],
+        },
+        'weapons': {
+            'count': values['weapons.total'],
+            'available_count': values['weapons.status.available'],
+            'assigned_count': values['weapons.status.assigned'],
+            'maintenance_count': values['weapons.status.maintenance'],
+            'decommissioned_count': values['weapons.status.decommissioned'],
+            'field_count': values['weapons.location.out'],
+            'armory_count': values['weapons.location.in'],
+        },
+        'face_records': {
+            'count': values['face_records.total'],
+            'active_count': values['face_records.active'],
+        },
+        'transactions': {
+            'today_count': values[transactions_today],
+        },
+        'auth_failures': {
+            'today_count': values[auth_failures_today],
+        },
+    }
+
+
+class StatsSnapshot:
+    """
+    Dashboard numbers shared by every client of the process.
+
+    The snapshot is recomputed when it is older than DASHBOARD_STATS_TTL
+    seconds, or after invalidate() was called on a committed change, but
+    never more often than every DASHBOARD_STATS_MIN_INTERVAL seconds. One
+    request recomputes it while the others keep getting the previous
+    snapshot, so the counter reads do not grow with the number of open
+    dashboards.
+    """
+
+    def __init__(self, ttl=None, min_interval=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'DASHBOARD_STATS_TTL', 10)
+        self.min_interval = min_interval if min_interval is not None else getattr(settings, 'DASHBOARD_STATS_MIN_INTERVAL', 1)
+        self._stats = None
+        self._computed_at = 0.0
+        self._stale = False
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    def get(self):
+        """
+        Returns:
+            Stats: Current snapshot
+        """
+        if self._stats is not None and not self._needs_refresh():
+            return self._stats
+
+        # Only one request refreshes, the others use the previous snapshot
+        if not self._lock.acquire(blocking=self._stats is None):
+            return self._stats
+        try:
+            if self._stats is None or self._needs_refresh():
+                self._refresh()
+            return self._stats
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        """Recompute on the next request, e.g. after a committed change"""
+        self._stale = True
+
+    def _needs_refresh(self):
+        age = time.monotonic() - self._computed_at
+        return age >= self.ttl or (self._stale and age >= self.min_interval)
+
+    def _refresh(self):
+        self._stale = False
+        data = collect_stats()
+        self._computed_at = time.monotonic()
+        self.refreshes += 1
+        if self._stats is None or self._stats.data != data:
+            version = hashlib.md5(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+            self._stats = Stats(version, timezone.now(), data)
+
+
+# Shared snapshot for the Django process
+stats_snapshot = StatsSnapshot()
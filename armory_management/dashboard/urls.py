@@ -17,6 +17,7 @@ urlpatterns = [
     path('reports/', views.reports, name='reports'),
 
     path('charts/weapon-status/', views.weapon_status_chart, name='weapon_status_chart'),
+    path('stats/', views.dashboard_stats, name='stats'),
     path('weapon-charts/', views.weapon_charts, name='weapon_charts'),
     path('widgets/chart-refresher/', views.chart_refresher, name='chart_refresher'),
 ]
\ No newline at end of file
@@ -2,52 +2,43 @@ from django.shortcuts import render
 from django.http import HttpResponse, StreamingHttpResponse, JsonResponse
 import json
 import time
-from inventory.models import Personnel, Weapon
-from face_authentication.models import WeaponTransaction, FaceRecord
+from face_authentication.models import WeaponTransaction
+from armory_management.conditional import versioned
 from .export import export_transactions_csv, export_transactions_excel, export_transactions_pdf
+from .models import DataVersion
+from .stats import stats_snapshot
+
+def data_stamp(*names):
+    """Version stamp function over DataVersion data sets"""
+    def stamp(request, *args, **kwargs):
+        return DataVersion.stamp(*names)
+    return stamp
+
+def stats_stamp(request, *args, **kwargs):
+    """Views rendering the stats snapshot are versioned by its content"""
+    stats = stats_snapshot.get()
+    return stats.version, stats.generated_at
 
 def index(request):
     """Main dashboard view"""
     return render(request, 'dashboard/index.html')
 
+@versioned(stats_stamp)
 def personnel_count(request):
     """Widget for personnel count"""
-    count = Personnel.objects.count()
-    active_count = Personnel.objects.filter(active_status=True).count()
-    
-    return render(request, 'dashboard/widgets/personnel_count.html', {
-        'count': count,
-        'active_count': active_count
-    })
+    return render(request, 'dashboard/widgets/personnel_count.html', stats_snapshot.get().data['personnel'])
 
+@versioned(stats_stamp)
 def weapons_count(request):
     """Widget for weapons count"""
-    count = Weapon.objects.count()
-    available_count = Weapon.objects.filter(status='available').count()
-    assigned_count = Weapon.objects.filter(status='assigned').count()
-    
-    # Count based on location (if field exists)
-    field_count = Weapon.objects.filter(location='out').count()
-    armory_count = Weapon.objects.filter(location='in').count()
-    
-    return render(request, 'dashboard/widgets/weapons_count.html', {
-        'count': count,
-        'available_count': available_count,
-        'assigned_count': assigned_count,
-        'field_count': field_count,
-        'armory_count': armory_count
-    })
+    return render(request, 'dashboard/widgets/weapons_count.html', stats_snapshot.get().data['weapons'])
 
+@versioned(stats_stamp)
 def face_records_count(request):
     """Widget for face records count"""
-    count = FaceRecord.objects.count()
-    active_count = FaceRecord.objects.filter(is_active=True).count()
-    
-    return render(request, 'dashboard/widgets/face_records_count.html', {
-        'count': count,
-        'active_count': active_count
-    })
+    return render(request, 'dashboard/widgets/face_records_count.html', stats_snapshot.get().data['face_records'])
 
+@versioned(data_stamp('transactions', 'weapons', 'personnel'))
 def transaction_logs(request):
     """Widget for transaction logs"""
     transactions = WeaponTransaction.objects.select_related('weapon', 'personnel').order_by('-timestamp')
@@ -101,6 +92,7 @@ def transaction_sse(request):
     response['X-Accel-Buffering'] = 'no'  # Disable buffering for Nginx
     return response
 
+@versioned(data_stamp('transactions', 'weapons', 'personnel'))
 def reports(request):
     # Transaction report page filtertei bas exporttoi hamt
     transactions = WeaponTransaction.objects.select_related('weapon', 'personnel').order_by('-timestamp')
@@ -129,23 +121,14 @@ def reports(request):
         'transaction_type': transaction_type
     })
 
-def weapon_status_chart(request):
-    # Get counts for different weapon statuses
-    total_weapons = Weapon.objects.count()
-    available_count = Weapon.objects.filter(status='available').count()
-    assigned_count = Weapon.objects.filter(status='assigned').count()
-    maintenance_count = Weapon.objects.filter(status='maintenance').count()
-    decommissioned_count = Weapon.objects.filter(status='decommissioned').count()
-
-    # Get counts for weapon locations
-    in_armory = Weapon.objects.filter(location='in').count()
-    in_field = Weapon.objects.filter(location='out').count()
-
+def weapon_chart_data(weapons):
+    """Chart.js datasets for the weapon status and location charts"""
     # Prepare data for the charts
     status_data = {
         'labels': ['Бэлэн байгаа', 'Хуваарилагдсан', 'Засварт', 'Актлагдсан'],
         'datasets': [{
-            'data': [available_count, assigned_count, maintenance_count, decommissioned_count],
+            'data': [weapons['available_count'], weapons['assigned_count'],
+                     weapons['maintenance_count'], weapons['decommissioned_count']],
             'backgroundColor': ['#10B981', '#3B82F6', '#F59E0B', '#EF4444']
         }]
     }
@@ -153,14 +136,28 @@ def weapon_status_chart(request):
     location_data = {
         'labels': ['Хадгалагдсан', 'Гарсан'],
         'datasets': [{
-            'data': [in_armory, in_field],
+            'data': [weapons['armory_count'], weapons['field_count']],
             'backgroundColor': ['#6366F1', '#F97316']
         }]
     }
 
-    return JsonResponse({
+    return {
         'status_data': status_data,
         'location_data': location_data
+    }
+
+@versioned(stats_stamp)
+def weapon_status_chart(request):
+    return JsonResponse(weapon_chart_data(stats_snapshot.get().data['weapons']))
+
+@versioned(stats_stamp)
+def dashboard_stats(request):
+    """Every widget's and chart's numbers in one response, for one poll per dashboard"""
+    stats = stats_snapshot.get()
+    return JsonResponse({
+        **stats.data,
+        **weapon_chart_data(stats.data['weapons']),
+        'generated_at': stats.generated_at.isoformat()
     })
 
 def weapon_charts(request):
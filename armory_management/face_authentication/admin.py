@@ -4,24 +4,58 @@ from django.shortcuts import render, redirect
 from django.urls import path
 from django.http import JsonResponse
 from django.utils import timezone
-from .models import FaceRecord, AuthenticationLog, WeaponTransaction, FaceRegistrationLog
+from .models import FaceRecord, FaceTemplate, AuthenticationLog, WeaponTransaction, WeaponState, FaceRegistrationLog
 from inventory.models import Weapon, Personnel
 from .face_utils import FaceRecognition
 from django.utils.html import format_html
+from django.conf import settings
+from .image_store import ensure_thumbnail
 import cv2
 import numpy as np
 import logging
-from unfold.admin import ModelAdmin
+from unfold.admin import ModelAdmin, TabularInline
 
 logger = logging.getLogger(__name__)
 face_recognition = FaceRecognition()
 
+def face_thumbnail_html(image_path):
+    """Thumbnail linking to the full-size face image"""
+    if not image_path:
+        return "No image"
+    return format_html(
+        '<a href="{}{}" target="_blank"><img src="{}{}" width="100" height="100" style="object-fit: cover" /></a>',
+        settings.MEDIA_URL, image_path, settings.MEDIA_URL, ensure_thumbnail(image_path)
+    )
+
+class FaceTemplateInline(TabularInline):
+    model = FaceTemplate
+    extra = 0
+    fields = ('captured_at', 'source', 'device_info', 'metadata', 'face_image_display')
+    readonly_fields = fields
+    can_delete = True
+
+    def has_add_permission(self, request, obj=None):
+        """Templates are only created by enrollment"""
+        return False
+
+    def face_image_display(self, obj):
+        return face_thumbnail_html(obj.face_image_path)
+
+    face_image_display.short_description = 'Face Image'
+
 @admin.register(FaceRecord)
 class FaceRecordAdmin(ModelAdmin):
     list_display = ('personnel_id', 'has_embedding', 'face_image_display', 'registration_date', 'is_active')
     list_filter = ('is_active', 'registration_date')
     search_fields = ('personnel_id',)
     readonly_fields = ('id', 'registration_date', 'last_updated', 'face_image_display')
+    inlines = [FaceTemplateInline]
+
+    def save_related(self, request, form, formsets, change):
+        """Recompute the centroid after templates were removed"""
+        super().save_related(request, form, formsets, change)
+        if any(formset.has_changed() for formset in formsets):
+            form.instance.update_centroid()
 
     def has_embedding(self, obj):
         """Indicate if embedding data exists"""
@@ -32,9 +66,7 @@ class FaceRecordAdmin(ModelAdmin):
 
     def face_image_display(self, obj):
         """Display the face image in the admin interface"""
-        if obj.face_image_path:
-            return format_html('<img src="/media/{}" widht="100" height="100" />', obj.face_image_path)
-        return "No image"
+        return face_thumbnail_html(obj.face_image_path)
 
     face_image_display.short_description = 'Face Image'
 
@@ -70,6 +102,20 @@ class WeaponTransactionAdmin(ModelAdmin):
         }),
     )
 
+@admin.register(WeaponState)
+class WeaponStateAdmin(ModelAdmin):
+    list_display = ('weapon', 'location', 'holder', 'transaction_type', 'timestamp')
+    list_filter = ('location', 'transaction_type')
+    search_fields = ('weapon__serial_number', 'holder__id_number', 'holder__last_name')
+    list_select_related = ('weapon', 'holder')
+
+    def has_add_permission(self, request):
+        """Derived from the transaction ledger"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # @admin.register(FaceRegistrationLog)
 # class FaceRegistrationLogAdmin(ModelAdmin):
 #     list_display = ('personnel', 'timestamp', 'registered_by', 'successful')
@@ -0,0 +1,179 @@
+# face_authentication/admission.py
+import functools
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted"""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Concurrency limiter for views that wait on the inference server.
+
+    At most ``max_in_flight`` requests run at once. Up to ``max_waiting``
+    more wait for a slot for at most ``wait_timeout`` seconds; everything
+    beyond that is rejected right away with 429, and a request whose wait
+    times out gets 503. Both carry a Retry-After estimated from recent
+    service times, so the worker pool stays free for other pages while the
+    inference server catches up.
+
+    Limits are per worker process.
+    """
+
+    def __init__(self, name, max_in_flight=None, max_waiting=None, wait_timeout=None, sample_size=1000):
+        self.name = name
+        self.max_in_flight = max_in_flight or getattr(settings, 'FACE_INFERENCE_MAX_IN_FLIGHT', 4)
+        self.max_waiting = max_waiting if max_waiting is not None else getattr(settings, 'FACE_INFERENCE_MAX_WAITING', 8)
+        self.wait_timeout = wait_timeout if wait_timeout is not None else getattr(settings, 'FACE_INFERENCE_WAIT_TIMEOUT', 2.0)
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._wait_times = deque(maxlen=sample_size)
+        self._service_times = deque(maxlen=sample_size)
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+
+    def acquire(self):
+        """
+        Take a slot, waiting briefly if all are busy.
+
+        Returns:
+            float: Seconds spent waiting
+
+        Raises:
+            AdmissionRejected: If the wait queue is full or the wait timed out
+        """
+        start = time.monotonic()
+        with self._condition:
+            if self._in_flight >= self.max_in_flight:
+                if self._waiting >= self.max_waiting:
+                    self.rejected_full += 1
+                    raise AdmissionRejected(
+                        'Server is busy, please retry shortly',
+                        status.HTTP_429_TOO_MANY_REQUESTS,
+                        self.retry_after()
+                    )
+
+                self._waiting += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self._in_flight < self.max_in_flight, self.wait_timeout)
+                finally:
+                    self._waiting -= 1
+
+                if not admitted:
+                    self.rejected_timeout += 1
+                    self._wait_times.append(time.monotonic() - start)
+                    raise AdmissionRejected(
+                        'Face recognition service is overloaded, please retry shortly',
+                        status.HTTP_503_SERVICE_UNAVAILABLE,
+                        self.retry_after()
+                    )
+
+            self._in_flight += 1
+            self.admitted += 1
+            waited = time.monotonic() - start
+            self._wait_times.append(waited)
+            return waited
+
+    def release(self, service_time=None):
+        with self._condition:
+            self._in_flight -= 1
+            if service_time is not None:
+                self._service_times.append(service_time)
+            self._condition.notify()
+
+    @contextmanager
+    def admit(self):
+        """Hold a slot for the duration of the block, yields the wait time"""
+        waited = self.acquire()
+        start = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - start)
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained"""
+        if not self._service_times:
+            return 1
+        average = sum(self._service_times) / len(self._service_times)
+        backlog = self._in_flight + self._waiting
+        return max(1, math.ceil(average * backlog / self.max_in_flight))
+
+    def stats(self):
+        with self._condition:
+            wait_times = np.array(self._wait_times) * 1000.0
+            service_times = np.array(self._service_times) * 1000.0
+            return {
+                'name': self.name,
+                'max_in_flight': self.max_in_flight,
+                'max_waiting': self.max_waiting,
+                'wait_timeout': self.wait_timeout,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'admitted': self.admitted,
+                'rejected_full': self.rejected_full,
+                'rejected_timeout': self.rejected_timeout,
+                'wait_ms': {
+                    'p50': float(np.percentile(wait_times, 50)) if wait_times.size else 0.0,
+                    'p95': float(np.percentile(wait_times, 95)) if wait_times.size else 0.0,
+                    'max': float(wait_times.max()) if wait_times.size else 0.0,
+                },
+                'service_ms': {
+                    'mean': float(service_times.mean()) if service_times.size else 0.0,
+                    'p95': float(np.percentile(service_times, 95)) if service_times.size else 0.0,
+                },
+                'retry_after': self.retry_after(),
+            }
+
+
+def rejected_response(error):
+    """API response for a request that was not admitted"""
+    response = Response({'error': error.message, 'retry_after': error.retry_after}, status=error.status_code)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def admission_control(controller):
+    """
+    View decorator that runs the view inside one of the controller's slots.
+    Apply it below @api_view so the rejection is rendered by DRF.
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            try:
+                with controller.admit() as waited:
+                    response = view_func(request, *args, **kwargs)
+            except AdmissionRejected as e:
+                logger.warning(f"{controller.name}: rejected {request.path} with {e.status_code}")
+                return rejected_response(e)
+
+            response['X-Queue-Wait-Ms'] = f"{waited * 1000.0:.1f}"
+            return response
+        return wrapper
+    return decorator
+
+
+# Shared by every view that calls the inference server
+inference_admission = AdmissionController('inference')
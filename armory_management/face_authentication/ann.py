@@ -0,0 +1,271 @@
+# face_authentication/ann.py
+import logging
+import os
+import threading
+
+import numpy as np
+
+from .embeddings import normalize_embedding
+
+logger = logging.getLogger(__name__)
+
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbour index (inverted file) over normalized
+    embeddings.
+
+    The embedding space is split into ``n_lists`` cells by spherical k-means.
+    Every vector is stored in the list of its nearest centroid, and a query
+    only scores the vectors in its ``n_probe`` closest lists. Raising
+    ``n_probe`` trades latency for recall; ``n_probe == n_lists`` is an
+    exact search.
+    """
+
+    def __init__(self, n_lists=64, n_probe=8, train_iterations=20, seed=0):
+        self.n_lists = int(n_lists)
+        self.n_probe = int(n_probe)
+        self.train_iterations = int(train_iterations)
+        self.seed = seed
+
+        self.centroids = None
+        self._lock = threading.RLock()
+        self._reset_lists()
+
+    def __len__(self):
+        return len(self._locations)
+
+    def __contains__(self, key):
+        return key in self._locations
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    @property
+    def dimension(self):
+        return None if self.centroids is None else self.centroids.shape[1]
+
+    def train(self, matrix, max_samples=100000):
+        """
+        Learn the list centroids with spherical k-means.
+
+        Args:
+            matrix (numpy.ndarray): Normalized training vectors, one per row
+            max_samples (int): Upper bound on the vectors used for training
+        """
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] == 0:
+            raise ValueError("Cannot train an IVF index without vectors")
+
+        rng = np.random.default_rng(self.seed)
+        if matrix.shape[0] > max_samples:
+            matrix = matrix[rng.choice(matrix.shape[0], max_samples, replace=False)]
+
+        n_lists = min(self.n_lists, matrix.shape[0])
+        centroids = matrix[rng.choice(matrix.shape[0], n_lists, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            assignments = self._nearest_centroids(matrix, centroids)
+
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, matrix)
+            counts = np.bincount(assignments, minlength=n_lists)
+
+            # Reseed empty lists with random training vectors
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = matrix[rng.choice(matrix.shape[0], len(empty), replace=False)]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        with self._lock:
+            self.n_lists = n_lists
+            self.centroids = centroids
+            self._reset_lists()
+
+    def build(self, keys, matrix, retrain=True):
+        """
+        Replace the index contents with the given vectors.
+
+        Args:
+            keys (list): Identifier for every row of ``matrix``
+            matrix (numpy.ndarray): Normalized vectors, one per row
+            retrain (bool): Learn new centroids instead of reusing loaded ones
+        """
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if retrain or not self.trained or self.dimension != matrix.shape[1]:
+            self.train(matrix)
+
+        with self._lock:
+            self._reset_lists()
+            assignments = self._nearest_centroids(matrix, self.centroids)
+            for list_no in range(self.n_lists):
+                rows = np.flatnonzero(assignments == list_no)
+                if not len(rows):
+                    continue
+                self._vectors[list_no] = matrix[rows].copy()
+                self._keys[list_no] = [keys[row] for row in rows]
+                self._sizes[list_no] = len(rows)
+                for position, row in enumerate(rows):
+                    self._locations[keys[row]] = (list_no, position)
+
+    def add(self, key, vector):
+        """Add or replace a single vector."""
+        vector = normalize_embedding(vector)
+        if vector is None or not self.trained:
+            return
+
+        with self._lock:
+            self.remove(key)
+            list_no = int(np.argmax(self.centroids @ vector))
+            size = self._sizes[list_no]
+
+            vectors = self._vectors[list_no]
+            if vectors is None or size == vectors.shape[0]:
+                grown = np.empty((max(8, size * 2), vector.shape[0]), dtype=np.float32)
+                if size:
+                    grown[:size] = vectors[:size]
+                self._vectors[list_no] = vectors = grown
+
+            vectors[size] = vector
+            self._keys[list_no].append(key)
+            self._sizes[list_no] = size + 1
+            self._locations[key] = (list_no, size)
+
+    def remove(self, key):
+        """Remove a vector, if present."""
+        with self._lock:
+            location = self._locations.pop(key, None)
+            if location is None:
+                return
+
+            list_no, position = location
+            last = self._sizes[list_no] - 1
+            keys = self._keys[list_no]
+            if position != last:
+                moved_key = keys[last]
+                self._vectors[list_no][position] = self._vectors[list_no][last]
+                keys[position] = moved_key
+                self._locations[moved_key] = (list_no, position)
+
+            keys.pop()
+            self._sizes[list_no] = last
+
+    def search(self, probe, k=5, threshold=None, n_probe=None):
+        """
+        Approximate 1:N lookup with the same result format as
+        GalleryIndex.search.
+
+        Args:
+            probe (bytes or numpy.ndarray): Query embedding
+            k (int): Maximum number of matches to return
+            threshold (float, optional): Minimum similarity for a match
+            n_probe (int, optional): Lists to scan, overrides ``self.n_probe``
+
+        Returns:
+            list: Matches as {'id', 'similarity'} dicts, best first
+        """
+        from .gallery import GalleryIndex
+
+        probe = normalize_embedding(probe)
+        if probe is None or not self.trained or probe.shape[0] != self.dimension:
+            return []
+
+        n_probe = min(max(int(n_probe or self.n_probe), 1), self.n_lists)
+
+        with self._lock:
+            centroid_scores = self.centroids @ probe
+            if n_probe < self.n_lists:
+                lists = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+            else:
+                lists = range(self.n_lists)
+
+            scores = []
+            keys = []
+            for list_no in lists:
+                size = self._sizes[list_no]
+                if not size:
+                    continue
+                scores.append(self._vectors[list_no][:size] @ probe)
+                keys.extend(self._keys[list_no])
+
+        if not keys:
+            return []
+
+        return GalleryIndex.top_k(np.concatenate(scores), keys, k, threshold)
+
+    def save(self, path):
+        """Persist centroids and list contents to an ``.npz`` file."""
+        with self._lock:
+            if not self.trained:
+                raise ValueError("Cannot save an untrained IVF index")
+
+            keys = []
+            assignments = []
+            vectors = []
+            for list_no in range(self.n_lists):
+                size = self._sizes[list_no]
+                if size:
+                    keys.extend(self._keys[list_no])
+                    assignments.append(np.full(size, list_no, dtype=np.int32))
+                    vectors.append(self._vectors[list_no][:size])
+
+            dimension = self.dimension
+            data = {
+                'centroids': self.centroids,
+                'keys': np.array(keys, dtype=str),
+                'assignments': np.concatenate(assignments) if assignments else np.empty(0, dtype=np.int32),
+                'vectors': np.vstack(vectors) if vectors else np.empty((0, dimension), dtype=np.float32),
+                'params': np.array([self.n_lists, self.n_probe, self.train_iterations], dtype=np.int64),
+            }
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial index
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by save()."""
+        with np.load(path) as data:
+            n_lists, n_probe, train_iterations = (int(value) for value in data['params'])
+            index = cls(n_lists=n_lists, n_probe=n_probe, train_iterations=train_iterations)
+            index.centroids = data['centroids'].astype(np.float32)
+
+            keys = data['keys'].tolist()
+            assignments = data['assignments']
+            vectors = data['vectors'].astype(np.float32)
+
+        for list_no in range(index.n_lists):
+            rows = np.flatnonzero(assignments == list_no)
+            if not len(rows):
+                continue
+            index._vectors[list_no] = vectors[rows]
+            index._keys[list_no] = [keys[row] for row in rows]
+            index._sizes[list_no] = len(rows)
+            for position, row in enumerate(rows):
+                index._locations[keys[row]] = (list_no, position)
+
+        return index
+
+    def _reset_lists(self):
+        self._vectors = [None] * self.n_lists
+        self._keys = [[] for _ in range(self.n_lists)]
+        self._sizes = [0] * self.n_lists
+        self._locations = {}
+
+    @staticmethod
+    def _nearest_centroids(matrix, centroids, chunk_size=65536):
+        assignments = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], chunk_size):
+            chunk = matrix[start:start + chunk_size]
+            assignments[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        return assignments
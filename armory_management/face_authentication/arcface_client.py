@@ -6,6 +6,7 @@ import base64
 from io import BytesIO
 from django.conf import settings
 import logging
+from .embeddings import normalize_embedding, score_templates
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +33,9 @@ class ArcFaceClient:
 
         # Use session for connection pooling
         self.session = requests.Session()
+        
+        # Cleared once the server turns out to have no batch endpoint
+        self.batch_supported = True
     
     def detect_face(self, image_data):
         """
@@ -105,6 +109,59 @@ class ArcFaceClient:
             logger.error(f"Embedding extraction error: {str(e)}")
             return {'error': str(e), 'status': 'ERROR'}
     
+    def extract_embeddings_batch(self, images):
+        """
+        Extract face embeddings from several images in one request.
+        Falls back to one extract_embeddings call per image when the
+        inference server has no batch endpoint.
+        
+        Args:
+            images (list): Raw image data, one bytes object per image
+            
+        Returns:
+            list: One result per image, in input order, shaped like the
+            result of extract_embeddings
+        """
+        if not images:
+            return []
+        
+        if not self.batch_supported:
+            return [self.extract_embeddings(image_data) for image_data in images]
+        
+        try:
+            endpoint = f"{self.api_url}/extract_embeddings_batch"
+            
+            payload = {
+                'images': [base64.b64encode(image_data).decode('utf-8') for image_data in images]
+            }
+            
+            response = requests.post(endpoint, json=payload, headers=self.headers, timeout=30 + 2 * len(images))
+            if response.status_code == 404:
+                logger.info("Inference server has no batch endpoint, extracting one image at a time")
+                self.batch_supported = False
+                return [self.extract_embeddings(image_data) for image_data in images]
+            response.raise_for_status()
+            
+            results = []
+            for result in response.json().get('results', []):
+                if result and result.get('embeddings'):
+                    embedding_bytes = base64.b64decode(result['embeddings'])
+                    results.append({
+                        'status': 'SUCCESS',
+                        'embedding_array': np.frombuffer(embedding_bytes, dtype=np.float32),
+                        'embedding_bytes': embedding_bytes
+                    })
+                else:
+                    results.append({'error': (result or {}).get('error', 'No embeddings extracted'), 'status': 'ERROR'})
+            
+            if len(results) != len(images):
+                raise ValueError(f"Expected {len(images)} results, got {len(results)}")
+            return results
+            
+        except Exception as e:
+            logger.error(f"Batch embedding extraction error: {str(e)}")
+            return [{'error': str(e), 'status': 'ERROR'} for _ in images]
+    
     def compare_faces(self, source_embedding, target_embedding):
         """
         Compare two face embeddings and return similarity score.
@@ -201,6 +258,67 @@ class ArcFaceClient:
             'confidence': 0.0
         }
     
+    def verify_templates(self, image_data, templates, threshold=0.6, policy='max'):
+        """
+        Verify a face against all enrollment templates of one person.
+        Scoring is done locally in one vectorized step instead of one
+        compare request per template.
+        
+        Args:
+            image_data (bytes): Raw image data
+            templates (numpy.ndarray): Normalized template embeddings, one per row
+            threshold (float): Similarity threshold for authentication (0-1)
+            policy (str): 'max', 'mean' or 'centroid'
+            
+        Returns:
+            dict: Verification results
+        """
+        if templates is None or not len(templates):
+            return {
+                'verified': False,
+                'status': 'ERROR',
+                'error': 'Face record has no embedding data',
+                'confidence': 0.0
+            }
+        
+        extraction_result = self.extract_embeddings(image_data)
+        
+        if 'error' in extraction_result or extraction_result.get('status') == 'ERROR':
+            return {
+                'verified': False,
+                'status': 'ERROR',
+                'error': extraction_result.get('error', 'Failed to extract embeddings'),
+                'confidence': 0.0
+            }
+        
+        probe = normalize_embedding(extraction_result.get('embedding_array'))
+        
+        if probe is None:
+            return {
+                'verified': False,
+                'status': 'ERROR',
+                'error': 'No embeddings extracted',
+                'confidence': 0.0
+            }
+        
+        if probe.shape[0] != templates.shape[1]:
+            return {
+                'verified': False,
+                'status': 'ERROR',
+                'error': f'Embedding size mismatch ({probe.shape[0]} vs {templates.shape[1]})',
+                'confidence': 0.0
+            }
+        
+        similarity, template_scores = score_templates(templates, probe, policy)
+        is_verified = similarity >= threshold
+        
+        return {
+            'verified': is_verified,
+            'status': 'SUCCESS' if is_verified else 'FAILURE',
+            'confidence': similarity,
+            'template_scores': [float(score) for score in template_scores]
+        }
+    
     def extract_and_save_embedding(self, image_data, save_path=None):
         """
         Extract face embedding and optionally save it to a file.
@@ -233,14 +351,16 @@ class ArcFaceClient:
         
         return result
     
-    def search_face(self, image_data, embeddings_dict, threshold=0.6):
+    def search_face(self, image_data, embeddings_dict, threshold=0.6, k=None):
         """
-        Search for a face in a dictionary of embeddings.
+        Search for a face in a dictionary of embeddings or a face index.
         
         Args:
             image_data (bytes): Raw image data
-            embeddings_dict (dict): Dictionary mapping IDs to embeddings
+            embeddings_dict (dict, GalleryIndex or IVFIndex): Dictionary mapping
+                IDs to embeddings, or an index object with a ``search`` method
             threshold (float): Similarity threshold
+            k (int, optional): Maximum number of matches to return
             
         Returns:
             dict: Search results with best matches
@@ -266,25 +386,36 @@ class ArcFaceClient:
         
         query_embedding = extraction_result['embedding_bytes']
         
-        # Compare with all stored embeddings
-        matches = []
-        
-        for person_id, stored_embedding in embeddings_dict.items():
-            comparison = self.compare_faces(query_embedding, stored_embedding)
-            
-            if 'error' in comparison:
-                continue
-            
-            similarity = comparison.get('similarity', 0.0)
-            
-            if similarity >= threshold:
-                matches.append({
-                    'id': person_id,
-                    'similarity': similarity
-                })
-        
-        # Sort matches by similarity (highest first)
-        matches.sort(key=lambda x: x['similarity'], reverse=True)
+        if hasattr(embeddings_dict, 'search'):
+            # Indexes score the whole gallery locally in one vectorized step
+            matches = embeddings_dict.search(
+                query_embedding,
+                k=k or len(embeddings_dict) or 1,
+                threshold=threshold
+            )
+        else:
+            # Compare with all stored embeddings
+            matches = []
+            
+            for person_id, stored_embedding in embeddings_dict.items():
+                comparison = self.compare_faces(query_embedding, stored_embedding)
+                
+                if 'error' in comparison:
+                    continue
+                
+                similarity = comparison.get('similarity', 0.0)
+                
+                if similarity >= threshold:
+                    matches.append({
+                        'id': person_id,
+                        'similarity': similarity
+                    })
+            
+            # Sort matches by similarity (highest first)
+            matches.sort(key=lambda x: x['similarity'], reverse=True)
+            
+            if k:
+                matches = matches[:k]
         
         return {
             'found': len(matches) > 0,
@@ -307,6 +438,8 @@ class ArcFaceClient:
         client.extract_embeddings = cls._mock_extract_embeddings
         client.compare_faces = cls._mock_compare_faces
         client.verify_identity = cls._mock_verify_identity
+        # Batches go through the mocked single-image extraction
+        client.batch_supported = False
         
         return client
     
@@ -0,0 +1,160 @@
+# face_authentication/auth_log.py
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .counters import count_bulk
+
+logger = logging.getLogger(__name__)
+
+
+class AuthenticationLogWriter:
+    """
+    Buffered writer for AuthenticationLog rows.
+
+    log() puts the row on a bounded in-process queue and returns at once;
+    a background thread inserts queued rows with bulk_create once
+    ``batch_size`` rows are waiting or ``flush_interval`` seconds have
+    passed. When the queue is full, or FACE_AUTH_LOG_ASYNC is off, the row
+    is written synchronously instead, so nothing is dropped.
+
+    Logs that other rows reference (e.g. WeaponTransaction.auth_log) must
+    exist before the referencing insert; use log_now() for those.
+    """
+
+    def __init__(self, max_queue=None, batch_size=None, flush_interval=None):
+        self.max_queue = max_queue or getattr(settings, 'FACE_AUTH_LOG_QUEUE_SIZE', 10000)
+        self.batch_size = batch_size or getattr(settings, 'FACE_AUTH_LOG_BATCH_SIZE', 200)
+        self.flush_interval = flush_interval or getattr(settings, 'FACE_AUTH_LOG_FLUSH_INTERVAL', 1.0)
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self.written = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'FACE_AUTH_LOG_ASYNC', True)
+
+    def log(self, **fields):
+        """
+        Queue an AuthenticationLog row.
+
+        Returns:
+            AuthenticationLog: The unsaved instance; its id is already set
+        """
+        from .models import AuthenticationLog
+
+        entry = AuthenticationLog(**fields)
+        if not self.enabled or self._stopping.is_set():
+            entry.save()
+            return entry
+
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            # Back-pressure: write on the request thread rather than drop the row
+            self.fallbacks += 1
+            logger.warning("Authentication log queue is full, writing synchronously")
+            entry.save()
+            return entry
+
+        self._ensure_thread()
+        return entry
+
+    def log_now(self, **fields):
+        """Write an AuthenticationLog row synchronously and return it"""
+        from .models import AuthenticationLog
+        return AuthenticationLog.objects.create(**fields)
+
+    def flush(self):
+        """Write every queued row from the calling thread"""
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self, timeout=5.0):
+        """Stop the flush thread and write what is left, e.g. at shutdown"""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='auth-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                entry = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = [entry]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            finally:
+                close_old_connections()
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        from .models import AuthenticationLog
+
+        try:
+            with transaction.atomic():
+                AuthenticationLog.objects.bulk_create(batch)
+                count_bulk(batch, created=True)
+            self.written += len(batch)
+        except Exception as e:
+            # One bad row must not lose the whole batch
+            logger.error(f"Error writing {len(batch)} authentication logs: {str(e)}")
+            for entry in batch:
+                try:
+                    entry.save(force_insert=True)
+                    self.written += 1
+                except Exception as row_error:
+                    logger.error(f"Dropping authentication log for {entry.personnel_id}: {str(row_error)}")
+
+
+# Shared writer for the Django process
+auth_log_writer = AuthenticationLogWriter()
+atexit.register(auth_log_writer.close)
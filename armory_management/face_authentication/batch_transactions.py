@@ -0,0 +1,285 @@
+# face_authentication/batch_transactions.py
+import base64
+import binascii
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .auth_log import auth_log_writer
+from .counters import count_bulk
+from .embedding_cache import embedding_cache
+from .embeddings import normalize_embedding, score_templates
+from .registration import decode_face_image
+from .transactions import (
+    LOCATION_AFTER,
+    TransactionRejected,
+    normalize_transaction_type,
+    transactions_committed,
+    validate_transaction,
+)
+
+logger = logging.getLogger(__name__)
+
+SUCCESS_MESSAGES = {
+    'checkin': 'Weapon checked in successfully',
+    'checkout': 'Weapon checked out successfully',
+}
+
+
+class BatchTransaction:
+    """
+    Verify and record many weapon transactions in one pass, e.g. at
+    morning issue.
+
+    Weapons and personnel are resolved with in_bulk, the templates of
+    everybody in the batch are loaded together, and all probe images go to
+    the inference server in one batched extraction call. The logs,
+    transactions and location changes are then written with
+    bulk_create/bulk_update in one atomic block, with every involved
+    weapon row locked. Items are applied in order, so the same weapon can
+    be checked out and back in within one batch.
+    """
+
+    def __init__(self, client=None, verified_by='System', notes='', ip_address=None, device_info=''):
+        from .arcface_client import ArcFaceClient
+
+        self.client = client or ArcFaceClient()
+        self.threshold = getattr(settings, 'FACE_SIMILARITY_THRESHOLD', 0.6)
+        self.policy = getattr(settings, 'FACE_TEMPLATE_POLICY', 'max')
+        self.verified_by = verified_by
+        self.notes = notes
+        self.ip_address = ip_address
+        self.device_info = device_info
+
+    def run(self, items):
+        """
+        Process a batch of transactions.
+
+        Args:
+            items (list): Dicts with qr_code, personnel_id, transaction_type
+                and either face_image (base64 image) or embedding (base64
+                float32 probe embedding)
+
+        Returns:
+            list: One result dict per item, in input order, with index,
+            qr_code, personnel_id, transaction_type, verified, confidence,
+            transaction_success, message, transaction_id and
+            weapon_location
+        """
+        from inventory.models import Personnel, Weapon
+
+        results = [self._result(index, item) for index, item in enumerate(items)]
+        pending = [result for result in results if not result['message']]
+
+        weapons = Weapon.objects.in_bulk({result['qr_code'] for result in pending}, field_name='qr_code')
+        personnel = Personnel.objects.in_bulk({result['personnel_id'] for result in pending}, field_name='id_number')
+        faces = embedding_cache.lookup_many(personnel.values())
+
+        logs = []
+        probes = []
+        for result in pending:
+            result['_weapon'] = weapons.get(result['qr_code'])
+            if result['_weapon'] is None:
+                result['message'] = 'Weapon not found with the provided QR code'
+                continue
+
+            cached_face = faces.get(result['personnel_id'])
+            if cached_face is None:
+                result['message'] = 'Personnel not found with the provided ID'
+                logs.append(self._log(result, 'FAILURE', error_message='Personnel not found'))
+                continue
+
+            result['_face'] = cached_face
+            if cached_face.face_record_id is None:
+                result['message'] = 'No face record found for this personnel'
+                logs.append(self._log(result, 'FAILURE', error_message='No face record found'))
+                continue
+
+            probes.append(result)
+
+        self._extract([result for result in probes if result['_probe'] is None])
+
+        verified = []
+        for result in probes:
+            if result['_probe'] is None:
+                result['message'] = result['message'] or 'Failed to extract face embeddings'
+                result['_log'] = self._log(result, 'ERROR', error_message=result['message'])
+                logs.append(result['_log'])
+                continue
+
+            self._verify(result)
+            result['_log'] = self._log(result, 'SUCCESS' if result['verified'] else 'FAILURE', confidence_score=result['confidence'],
+                                       error_message=result.pop('_error', ''))
+            logs.append(result['_log'])
+            if result['verified']:
+                verified.append(result)
+            else:
+                result['message'] = result['message'] or 'Face verification failed'
+
+        try:
+            self._commit(verified, logs)
+        except Exception as e:
+            logger.error(f"Batch transaction commit failed: {str(e)}")
+            for result in verified:
+                result.update(transaction_success=False, transaction_id=None, weapon_location=None,
+                              message=f'Transaction processing error: {str(e)}')
+            # The verification attempts are logged regardless
+            for log in logs:
+                auth_log_writer.log(**{field: getattr(log, field) for field in (
+                    'personnel_id', 'result', 'confidence_score', 'ip_address', 'device_info', 'error_message'
+                )})
+
+        for result in results:
+            for key in [key for key in result if key.startswith('_')]:
+                del result[key]
+
+        logger.info(
+            f"Batch transaction: {sum(r['transaction_success'] for r in results)} of {len(results)} items recorded"
+        )
+        return results
+
+    def _result(self, index, item):
+        item = item if isinstance(item, dict) else {}
+        result = {
+            'index': index,
+            'qr_code': item.get('qr_code'),
+            'personnel_id': item.get('personnel_id'),
+            'transaction_type': item.get('transaction_type', 'checkin'),
+            'verified': False,
+            'confidence': 0.0,
+            'transaction_success': False,
+            'message': '',
+            'transaction_id': None,
+            'weapon_location': None,
+            '_type': normalize_transaction_type(item.get('transaction_type', 'checkin')),
+            '_image': item.get('face_image'),
+            '_probe': None,
+        }
+
+        if not result['qr_code'] or not result['personnel_id'] or not (item.get('face_image') or item.get('embedding')):
+            result['message'] = 'Personnel ID, QR code and a face image or embedding are all required'
+        elif result['_type'] not in SUCCESS_MESSAGES:
+            result['message'] = f"Transaction type '{result['transaction_type']}' is not supported in batches"
+        elif item.get('embedding'):
+            try:
+                embedding_bytes = base64.b64decode(item['embedding'], validate=True)
+                if not embedding_bytes or len(embedding_bytes) % 4:
+                    raise ValueError
+            except (binascii.Error, ValueError, TypeError):
+                result['message'] = 'Embedding must be base64 encoded float32 values'
+            else:
+                result['_probe'] = normalize_embedding(np.frombuffer(embedding_bytes, dtype=np.float32))
+                if result['_probe'] is None:
+                    result['message'] = 'Embedding is empty or invalid'
+        return result
+
+    def _extract(self, results):
+        """Extract the probe embeddings of all image items in one call"""
+        images = []
+        extracting = []
+        for result in results:
+            try:
+                images.append(decode_face_image(result['_image']))
+                extracting.append(result)
+            except (binascii.Error, ValueError, TypeError):
+                result['message'] = 'Face image is not valid base64'
+
+        for result, extraction in zip(extracting, self.client.extract_embeddings_batch(images)):
+            if 'error' in extraction or extraction.get('status') == 'ERROR':
+                result['message'] = extraction.get('error', 'Failed to extract face embeddings')
+                continue
+            result['_probe'] = normalize_embedding(extraction.get('embedding_array'))
+
+    def _verify(self, result):
+        templates = result['_face'].templates
+        probe = result['_probe']
+        if templates is None or not len(templates):
+            result['_error'] = 'Face record has no embedding data'
+            result['message'] = result['_error']
+            return
+        if probe.shape[0] != templates.shape[1]:
+            result['_error'] = f'Embedding size mismatch ({probe.shape[0]} vs {templates.shape[1]})'
+            result['message'] = result['_error']
+            return
+
+        similarity, _ = score_templates(templates, probe, self.policy)
+        result['confidence'] = similarity
+        result['verified'] = similarity >= self.threshold
+
+    def _log(self, result, status, confidence_score=None, error_message=''):
+        from .models import AuthenticationLog
+
+        return AuthenticationLog(
+            personnel_id=result['personnel_id'],
+            result=status,
+            confidence_score=confidence_score,
+            ip_address=self.ip_address,
+            device_info=self.device_info,
+            error_message=error_message
+        )
+
+    def _commit(self, verified, logs):
+        from inventory.models import Weapon
+        from .models import AuthenticationLog, WeaponState, WeaponTransaction
+
+        with transaction.atomic():
+            # Locked in primary key order, so concurrent batches cannot deadlock
+            weapons = {
+                weapon.pk: weapon
+                for weapon in Weapon.objects.select_for_update().filter(
+                    pk__in={result['_weapon'].pk for result in verified}
+                ).order_by('pk')
+            }
+
+            transactions = []
+            changed = {}
+            for result in verified:
+                weapon = weapons.get(result['_weapon'].pk)
+                if weapon is None:
+                    result['message'] = 'Weapon not found with the provided QR code'
+                    continue
+
+                try:
+                    validate_transaction(weapon, result['_face'].personnel, result['_type'])
+                except TransactionRejected as e:
+                    result['message'] = e.message
+                    continue
+
+                weapon_transaction = WeaponTransaction(
+                    weapon_id=weapon.pk,
+                    personnel_id=result['_face'].personnel.pk,
+                    transaction_type=result['_type'],
+                    face_confidence_score=result['confidence'],
+                    verified_by=self.verified_by,
+                    notes=self.notes,
+                    auth_log=result['_log']
+                )
+                transactions.append(weapon_transaction)
+
+                # Later items in the batch see the new location
+                weapon.location = LOCATION_AFTER[result['_type']]
+                changed[weapon.pk] = weapon
+
+                result.update(
+                    transaction_success=True,
+                    transaction_id=str(weapon_transaction.id),
+                    weapon_location=weapon.location,
+                    message=SUCCESS_MESSAGES[result['_type']]
+                )
+
+            AuthenticationLog.objects.bulk_create(logs)
+            WeaponTransaction.objects.bulk_create(transactions)
+            # bulk_create sends no post_save
+            WeaponState.record(transactions)
+            if changed:
+                Weapon.objects.bulk_update(list(changed.values()), ['location'])
+            count_bulk(logs, created=True)
+            count_bulk(transactions, created=True)
+            count_bulk(changed.values())
+
+            committed_weapons = list(changed.values())
+            transaction.on_commit(lambda: transactions_committed.send(
+                sender=WeaponTransaction, transactions=transactions, weapons=committed_weapons
+            ))
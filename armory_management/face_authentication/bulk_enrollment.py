@@ -0,0 +1,295 @@
+# face_authentication/bulk_enrollment.py
+import logging
+import os
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .counters import count_bulk
+from .embedding_cache import embedding_cache
+from .embeddings import centroid_embedding, encode_embedding
+from .gallery import gallery
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def personnel_id_from_filename(filename):
+    """
+    Personnel id_number encoded in an image file name.
+    "123.jpg" and "123_2.jpg" both belong to personnel 123.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return stem.split('_')[0].strip()
+
+
+def is_image_name(filename):
+    name = os.path.basename(filename)
+    return not name.startswith('.') and name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_directory(directory, recursive=False):
+    """Yield (file name, path) for the images in a directory"""
+    if recursive:
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                if is_image_name(name):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, directory), path
+    else:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and is_image_name(name):
+                yield name, path
+
+
+class ArchiveTooLarge(ValueError):
+    """Raised for an archive over the file count or size limits"""
+
+
+def iter_archive(archive, max_files=None, max_image_bytes=None, max_total_bytes=None):
+    """
+    Yield (file name, image bytes) for the images in a zip archive.
+
+    The limits are checked against the archive directory before anything
+    is decompressed, and every read is capped, so a zip bomb cannot exhaust
+    memory even if its directory lies about the sizes.
+
+    Args:
+        archive: Path or file object of the zip archive
+        max_files (int, optional): Maximum number of images, unlimited if None
+        max_image_bytes (int, optional): Maximum uncompressed size of one
+            image, FACE_BULK_ENROLL_MAX_IMAGE_BYTES by default
+        max_total_bytes (int, optional): Maximum uncompressed size of all
+            images, FACE_BULK_ENROLL_MAX_TOTAL_BYTES by default
+
+    Raises:
+        ArchiveTooLarge: If the archive exceeds a limit
+        zipfile.BadZipFile: If the archive is not a zip file
+    """
+    if max_image_bytes is None:
+        max_image_bytes = getattr(settings, 'FACE_BULK_ENROLL_MAX_IMAGE_BYTES', 10 * 1024 * 1024)
+    if max_total_bytes is None:
+        max_total_bytes = getattr(settings, 'FACE_BULK_ENROLL_MAX_TOTAL_BYTES', 500 * 1024 * 1024)
+
+    with zipfile.ZipFile(archive) as zf:
+        images = [
+            info for info in zf.infolist()
+            if not info.is_dir() and not info.filename.startswith('__MACOSX/') and is_image_name(info.filename)
+        ]
+        if max_files is not None and len(images) > max_files:
+            raise ArchiveTooLarge(f'At most {max_files} images can be enrolled at once')
+        for info in images:
+            if info.file_size > max_image_bytes:
+                raise ArchiveTooLarge(f'{info.filename} is larger than {max_image_bytes} bytes')
+        if sum(info.file_size for info in images) > max_total_bytes:
+            raise ArchiveTooLarge(f'The archive holds more than {max_total_bytes} bytes of images')
+
+        for info in images:
+            with zf.open(info) as f:
+                data = f.read(max_image_bytes + 1)
+            if len(data) > max_image_bytes:
+                raise ArchiveTooLarge(f'{info.filename} is larger than {max_image_bytes} bytes')
+            yield info.filename, data
+
+
+class BulkEnrollment:
+    """
+    Enroll many face images in one pass.
+
+    Images are decoded and sent to the inference server from a thread
+    pool. The database work is done afterwards in one transaction with
+    bulk_create/bulk_update, so a whole unit costs a handful of queries
+    instead of a full registration per person.
+    """
+
+    def __init__(self, client=None, workers=None, source='bulk', device_info='', max_templates=None):
+        from .arcface_client import ArcFaceClient
+
+        self.client = client or ArcFaceClient()
+        self.workers = workers or getattr(settings, 'FACE_BULK_ENROLL_WORKERS', 4)
+        self.source = source
+        self.device_info = device_info[:255]
+        self.max_templates = max_templates or getattr(settings, 'FACE_MAX_TEMPLATES', 5)
+
+    def run(self, items):
+        """
+        Enroll a batch of images.
+
+        Args:
+            items (iterable): (file name, image bytes or file path) pairs
+
+        Returns:
+            list: One report dict per file, in input order, with file,
+            personnel_id, status ('enrolled' or 'failed'), error,
+            face_id and template_id
+        """
+        from inventory.models import Personnel
+
+        reports = []
+        for filename, source in items:
+            reports.append({
+                'file': filename,
+                'personnel_id': personnel_id_from_filename(filename),
+                'status': 'failed',
+                'error': '',
+                'face_id': None,
+                'template_id': None,
+                '_source': source,
+            })
+
+        known_ids = set(Personnel.objects.filter(
+            id_number__in={report['personnel_id'] for report in reports}
+        ).values_list('id_number', flat=True))
+
+        pending = []
+        for report in reports:
+            if report['personnel_id'] not in known_ids:
+                report['error'] = 'Personnel ID not found in the system'
+            else:
+                pending.append(report)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='face-bulk-enroll') as executor:
+            extracted = list(executor.map(self._extract, pending))
+
+        enrolled = [(report, embedding, image_path) for report, (embedding, image_path) in zip(pending, extracted)
+                    if embedding is not None]
+
+        if enrolled:
+            try:
+                self._store(enrolled)
+            except Exception as e:
+                logger.error(f"Bulk enrollment failed to store {len(enrolled)} faces: {str(e)}")
+                for report, _, _ in enrolled:
+                    report['status'] = 'failed'
+                    report['error'] = f'Failed to store face record: {str(e)}'
+                    report['face_id'] = report['template_id'] = None
+
+        for report in reports:
+            del report['_source']
+
+        logger.info(
+            f"Bulk enrollment: {sum(r['status'] == 'enrolled' for r in reports)} of {len(reports)} images enrolled"
+        )
+        return reports
+
+    def _extract(self, report):
+        """Read, decode and embed one image, returns (embedding bytes, image path)"""
+        from .models import FaceRecord
+
+        try:
+            source = report['_source']
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                image_data = bytes(source)
+            else:
+                with open(source, 'rb') as f:
+                    image_data = f.read()
+
+            # Reject unreadable files before they reach the inference server
+            if cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR) is None:
+                report['error'] = 'Could not decode image'
+                return None, None
+
+            result = self.client.extract_embeddings(image_data)
+            if 'error' in result or result.get('status') == 'ERROR':
+                report['error'] = result.get('error', 'Failed to extract face embeddings')
+                return None, None
+
+            embedding_bytes = result.get('embedding_bytes')
+            if not embedding_bytes:
+                report['error'] = 'No face embedding generated'
+                return None, None
+
+            image_path = FaceRecord(personnel_id=report['personnel_id']).write_face_image(image_data)
+            return embedding_bytes, image_path
+
+        except Exception as e:
+            logger.error(f"Bulk enrollment error for {report['file']}: {str(e)}")
+            report['error'] = str(e)
+            return None, None
+
+    def _store(self, enrolled):
+        from .models import FaceChange, FaceRecord, FaceTemplate
+
+        personnel_ids = {report['personnel_id'] for report, _, _ in enrolled}
+
+        with transaction.atomic():
+            records = {record.personnel_id: record for record in FaceRecord.objects.filter(personnel_id__in=personnel_ids)}
+            new_records = [FaceRecord(personnel_id=personnel_id, is_active=True)
+                           for personnel_id in personnel_ids if personnel_id not in records]
+            FaceRecord.objects.bulk_create(new_records)
+            count_bulk(new_records, created=True)
+            records.update((record.personnel_id, record) for record in new_records)
+
+            templates = []
+            for report, embedding, image_path in enrolled:
+                record = records[report['personnel_id']]
+                template = FaceTemplate(
+                    face_record=record,
+                    embedding=encode_embedding(embedding),
+                    face_image_path=image_path,
+                    source=self.source,
+                    device_info=self.device_info,
+                    metadata={'filename': report['file']}
+                )
+                templates.append(template)
+                report['face_id'] = str(record.id)
+                report['template_id'] = str(template.id)
+            FaceTemplate.objects.bulk_create(templates, batch_size=500)
+
+            # Trim to the newest max_templates and recompute every centroid
+            embeddings = defaultdict(list)
+            stale_ids = []
+            rows = FaceTemplate.objects.filter(
+                face_record_id__in=[record.id for record in records.values()]
+            ).order_by('face_record_id', '-captured_at').values_list('face_record_id', 'id', 'embedding', 'face_image_path')
+            latest_image = {}
+            for face_record_id, template_id, embedding, image_path in rows:
+                if len(embeddings[face_record_id]) >= self.max_templates:
+                    stale_ids.append(template_id)
+                    continue
+                embeddings[face_record_id].append(embedding)
+                latest_image.setdefault(face_record_id, image_path)
+            if stale_ids:
+                FaceTemplate.objects.filter(id__in=stale_ids).delete()
+
+            now = timezone.now()
+            for record in records.values():
+                centroid = centroid_embedding(embeddings[record.id])
+                if centroid is not None:
+                    record.face_embedding = encode_embedding(centroid)
+                record.face_image_path = latest_image.get(record.id) or record.face_image_path
+                record.is_active = True
+                record.last_updated = now
+            FaceRecord.objects.bulk_update(
+                list(records.values()),
+                ['face_embedding', 'face_image_path', 'is_active', 'last_updated'],
+                batch_size=500
+            )
+            count_bulk(records.values())
+
+            # bulk_update sends no post_save, log the changes for kiosk sync here
+            FaceChange.objects.bulk_create([
+                FaceChange(personnel_id=record.personnel_id, action=FaceChange.action_for(record))
+                for record in records.values()
+            ])
+
+            for report, _, _ in enrolled:
+                report['status'] = 'enrolled'
+
+            # bulk_create/bulk_update send no signals, so sync caches explicitly
+            saved_records = list(records.values())
+            transaction.on_commit(lambda: self._sync(saved_records))
+
+    @staticmethod
+    def _sync(records):
+        for record in records:
+            embedding_cache.invalidate(record.personnel_id)
+        gallery.sync_records(records)
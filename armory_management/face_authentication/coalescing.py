@@ -0,0 +1,184 @@
+# face_authentication/coalescing.py
+import functools
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+
+from .admission import AdmissionRejected, rejected_response
+
+logger = logging.getLogger(__name__)
+
+
+class FlightTimeout(Exception):
+    """Raised to a follower whose leader is still running after ``wait_timeout``"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.expires_at = None
+
+
+class SingleFlight:
+    """
+    Runs a function once per key for all concurrent callers.
+
+    The first caller with a key (the leader) runs the function; callers
+    that arrive while it runs, or up to ``window`` seconds after it
+    finished, get the leader's result instead of running it again. This
+    catches double clicks and repeated auto-captures within one worker
+    process.
+
+    Followers hold a worker thread while they wait, so they wait no longer
+    than a request waits for an inference slot (FACE_INFERENCE_WAIT_TIMEOUT)
+    and then give up with FlightTimeout.
+    """
+
+    def __init__(self, window=None, wait_timeout=None):
+        self.window = window if window is not None else getattr(settings, 'FACE_COALESCE_WINDOW', 2.0)
+        self.wait_timeout = wait_timeout or getattr(
+            settings, 'FACE_COALESCE_WAIT_TIMEOUT', getattr(settings, 'FACE_INFERENCE_WAIT_TIMEOUT', 2.0)
+        )
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+        self.timed_out = 0
+
+    def do(self, key, func, keep=None):
+        """
+        Args:
+            key: Hashable call key
+            func: Function to run
+            keep (callable, optional): Decides whether a finished result may
+                still be handed out during the window; concurrent callers
+                always share it
+
+        Returns:
+            tuple: (result, shared) where shared is True if the result came
+            from another caller
+
+        Raises:
+            FlightTimeout: If the leader is still running after wait_timeout
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                self.timed_out += 1
+                raise FlightTimeout(f'Gave up waiting for {key} after {self.wait_timeout}s')
+            if call.result is not None:
+                self.coalesced += 1
+                return call.result, True
+            # The leader failed, do the work ourselves
+            return func(), False
+
+        try:
+            call.result = func()
+            return call.result, False
+        finally:
+            with self._lock:
+                if call.result is None or (keep is not None and not keep(call.result)):
+                    # Failed calls are not reused
+                    self._calls.pop(key, None)
+                else:
+                    call.expires_at = time.monotonic() + self.window
+            call.done.set()
+
+    def _expire(self, now):
+        expired = [key for key, call in self._calls.items() if call.expires_at is not None and call.expires_at <= now]
+        for key in expired:
+            del self._calls[key]
+
+
+# Response headers copied from the leader's response to followers
+SHARED_HEADERS = ('Retry-After', 'X-Queue-Wait-Ms')
+
+
+def image_digest(face_image_b64):
+    """Hash of a base64 image, identical captures hash the same"""
+    return hashlib.sha256((face_image_b64 or '').encode('utf-8')).hexdigest()
+
+
+def request_key(*fields, defaults=None):
+    """
+    Key function for coalesce_requests: the given request.data fields plus
+    the hash of the face image. Requests without an image are not coalesced.
+    """
+    defaults = defaults or {}
+
+    def key_func(request):
+        face_image_b64 = request.data.get('face_image')
+        if not face_image_b64:
+            return None
+        values = tuple(request.data.get(field, defaults.get(field)) for field in fields)
+        return values + (image_digest(face_image_b64),)
+    return key_func
+
+
+def coalesce_requests(flight, key_func, controller=None):
+    """
+    View decorator that shares one response between identical concurrent
+    requests.
+
+    key_func(request) returns the coalescing key, or None to run the view
+    normally. Only requests from the same user with the same payload share
+    a response; a client-supplied Idempotency-Key header is one more part
+    of the key, never a replacement for the payload.
+    Apply it below @api_view and above @admission_control, so duplicates
+    do not take inference slots. A duplicate whose leader is still running
+    after the flight's wait_timeout gets the same 503 as a request that
+    waited too long for a slot, with Retry-After from ``controller``.
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            payload_key = key_func(request)
+            if payload_key is None:
+                return view_func(request, *args, **kwargs)
+
+            idempotency_key = request.headers.get('Idempotency-Key')
+            scope = str(request.user.pk) if request.user.is_authenticated else ''
+            key = (view_func.__name__, scope, idempotency_key) + tuple(payload_key)
+            try:
+                leader_response, shared = flight.do(
+                    key,
+                    lambda: view_func(request, *args, **kwargs),
+                    # Let clients retry right away after an overload or server error
+                    keep=lambda response: response.status_code < 500 and response.status_code != 429
+                )
+            except FlightTimeout:
+                logger.warning(f"Duplicate {view_func.__name__} request timed out waiting for {idempotency_key or payload_key[0]}")
+                return rejected_response(AdmissionRejected(
+                    'Face recognition service is overloaded, please retry shortly',
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    controller.retry_after() if controller is not None else 1
+                ))
+            if not shared:
+                return leader_response
+
+            # Each follower gets its own copy, responses are rendered per request
+            logger.info(f"Coalesced duplicate {view_func.__name__} request for {idempotency_key or payload_key[0]}")
+            response = Response(leader_response.data, status=leader_response.status_code)
+            for header in SHARED_HEADERS:
+                if leader_response.has_header(header):
+                    response[header] = leader_response[header]
+            response['X-Coalesced'] = 'true'
+            return response
+        return wrapper
+    return decorator
+
+
+# Shared by the verification endpoints of the Django process
+verification_flight = SingleFlight()
@@ -0,0 +1,194 @@
+# face_authentication/counters.py
+import logging
+from collections import defaultdict
+from types import SimpleNamespace
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def daily_key(prefix, timestamp=None):
+    """Name of a per-day counter, by local date"""
+    return f'{prefix}.{timezone.localdate(timestamp).isoformat()}'
+
+
+def _weapon_keys(weapon):
+    return ('weapons.total', f'weapons.status.{weapon.status}', f'weapons.location.{weapon.location}')
+
+
+def _personnel_keys(personnel):
+    return ('personnel.total',) + (('personnel.active',) if personnel.active_status else ())
+
+
+def _face_record_keys(face_record):
+    return ('face_records.total',) + (('face_records.active',) if face_record.is_active else ())
+
+
+def _transaction_keys(weapon_transaction):
+    return (daily_key('transactions', weapon_transaction.timestamp),)
+
+
+def _auth_log_keys(authentication_log):
+    # Rejected faces only, not server errors
+    return (daily_key('auth_failures', authentication_log.timestamp),) if authentication_log.result == 'FAILURE' else ()
+
+
+# Model label: (counters an instance adds to, fields they depend on)
+COUNTED_MODELS = {
+    'inventory.Weapon': (_weapon_keys, ('status', 'location')),
+    'inventory.Personnel': (_personnel_keys, ('active_status',)),
+    'face_authentication.FaceRecord': (_face_record_keys, ('is_active',)),
+    'face_authentication.WeaponTransaction': (_transaction_keys, ('timestamp',)),
+    'face_authentication.AuthenticationLog': (_auth_log_keys, ('result', 'timestamp')),
+}
+
+
+def counter_keys(instance):
+    keys, _ = COUNTED_MODELS[instance._meta.label]
+    return keys(instance)
+
+
+def track(instance):
+    """
+    Remember which counters an instance is counted in, as loaded. Left
+    unknown when a field it depends on was deferred.
+    """
+    _, fields = COUNTED_MODELS[instance._meta.label]
+    if all(field in instance.__dict__ for field in fields):
+        instance._counter_keys = counter_keys(instance)
+    else:
+        instance._counter_keys = None
+
+
+def load_tracked(instance):
+    """Read the stored counted fields of an instance tracked as unknown"""
+    if instance._state.adding or getattr(instance, '_counter_keys', None) is not None:
+        return
+
+    keys, fields = COUNTED_MODELS[instance._meta.label]
+    row = type(instance)._default_manager.filter(pk=instance.pk).values(*fields).first()
+    instance._counter_keys = keys(SimpleNamespace(**row)) if row else ()
+
+
+def _deltas(old, new):
+    deltas = defaultdict(int)
+    for name in new:
+        deltas[name] += 1
+    for name in old:
+        deltas[name] -= 1
+    return deltas
+
+
+def count_saved(instance, created=False):
+    """Move a saved instance between counters; call it inside the saving transaction"""
+    from .models import StatCounter
+
+    old = () if created else getattr(instance, '_counter_keys', None)
+    new = counter_keys(instance)
+    if old is None:
+        # Neither tracked nor loaded, e.g. saved from a deferred copy
+        logger.warning(f"Untracked {instance._meta.label} {instance.pk} saved, counters need a reconcile")
+    else:
+        StatCounter.add(_deltas(old, new))
+    instance._counter_keys = new
+
+
+def count_deleted(instance):
+    from .models import StatCounter
+
+    old = getattr(instance, '_counter_keys', None)
+    StatCounter.add(_deltas(counter_keys(instance) if old is None else old, ()))
+    instance._counter_keys = ()
+
+
+def count_bulk(instances, created=False):
+    """
+    Count instances written with bulk_create (created) or bulk_update,
+    which send no signals. Call it inside the writing transaction.
+    """
+    from .models import StatCounter
+
+    deltas = defaultdict(int)
+    for instance in instances:
+        old = () if created else getattr(instance, '_counter_keys', None)
+        new = counter_keys(instance)
+        if old is None:
+            logger.warning(f"Untracked {instance._meta.label} {instance.pk} bulk updated, counters need a reconcile")
+        else:
+            for name, delta in _deltas(old, new).items():
+                deltas[name] += delta
+        instance._counter_keys = new
+    StatCounter.add(deltas)
+
+
+def compute_counters():
+    """
+    Every counter, recomputed from the tables.
+
+    Returns:
+        dict: Counter name to value
+    """
+    from inventory.models import Personnel, Weapon
+    from .models import AuthenticationLog, FaceRecord, WeaponTransaction
+
+    values = defaultdict(int)
+    for status, location, count in Weapon.objects.values_list('status', 'location').annotate(count=Count('pk')).order_by():
+        values['weapons.total'] += count
+        values[f'weapons.status.{status}'] += count
+        values[f'weapons.location.{location}'] += count
+
+    for active, count in Personnel.objects.values_list('active_status').annotate(count=Count('pk')).order_by():
+        values['personnel.total'] += count
+        if active:
+            values['personnel.active'] += count
+
+    for active, count in FaceRecord.objects.values_list('is_active').annotate(count=Count('pk')).order_by():
+        values['face_records.total'] += count
+        if active:
+            values['face_records.active'] += count
+
+    # TruncDate works in the current time zone, like daily_key
+    daily = (
+        ('transactions', WeaponTransaction.objects.all()),
+        ('auth_failures', AuthenticationLog.objects.filter(result='FAILURE')),
+    )
+    for prefix, queryset in daily:
+        for day, count in queryset.annotate(day=TruncDate('timestamp')).values_list('day').annotate(count=Count('pk')).order_by():
+            values[f'{prefix}.{day.isoformat()}'] = count
+
+    return dict(values)
+
+
+def reconcile():
+    """
+    Recompute the counters table from scratch. The existing counter rows
+    are locked first, so writes committing meanwhile are counted once.
+
+    Returns:
+        dict: Corrected counter name to (stored value, actual value)
+    """
+    from .models import StatCounter
+
+    with transaction.atomic():
+        stored = dict(StatCounter.objects.select_for_update().order_by('name').values_list('name', 'value'))
+        actual = compute_counters()
+
+        corrections = {
+            name: (stored.get(name, 0), actual.get(name, 0))
+            for name in stored.keys() | actual.keys()
+            if stored.get(name, 0) != actual.get(name, 0)
+        }
+        StatCounter.objects.bulk_create(
+            [StatCounter(name=name, value=value) for name, (_, value) in corrections.items()],
+            update_conflicts=True,
+            unique_fields=['name'],
+            update_fields=['value']
+        )
+
+    if corrections:
+        logger.warning(f"Reconciled {len(corrections)} counters: {corrections}")
+    return corrections
@@ -0,0 +1,216 @@
+# face_authentication/embedding_cache.py
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+
+import numpy as np
+from django.conf import settings
+
+from .embeddings import normalize_embedding
+
+logger = logging.getLogger(__name__)
+
+PersonnelSnapshot = namedtuple('PersonnelSnapshot', ['pk', 'id_number', 'first_name', 'last_name', 'rank'])
+
+# personnel is None when the id_number is unknown, templates is None when
+# there is no active face record
+CachedFace = namedtuple('CachedFace', ['personnel_id', 'personnel', 'face_record_id', 'templates', 'expires_at'])
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of decoded, normalized face templates keyed by
+    personnel_id, with a small Personnel snapshot next to them.
+
+    Entries expire after ``ttl`` seconds and are invalidated by the
+    FaceRecord, FaceTemplate and Personnel signals in signals.py. The
+    signals only reach the worker that made the change, so the TTL bounds
+    how long other workers can serve a replaced template.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or getattr(settings, 'FACE_EMBEDDING_CACHE_SIZE', 1024)
+        self.ttl = ttl if ttl is not None else getattr(settings, 'FACE_EMBEDDING_CACHE_TTL', 300)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, personnel_id):
+        """Return the cached entry, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(personnel_id)
+            if entry is None:
+                return None
+            if entry.expires_at < time.monotonic():
+                del self._entries[personnel_id]
+                return None
+            self._entries.move_to_end(personnel_id)
+            return entry
+
+    def lookup(self, personnel_id):
+        """
+        Return the entry for a personnel, loading it from the database on a miss.
+
+        Returns:
+            CachedFace: Cached personnel snapshot and templates
+        """
+        entry = self.get(personnel_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = self._load(personnel_id)
+        self.put(entry)
+        return entry
+
+    def prefetch(self, personnel):
+        """
+        Load the entry of a Personnel ahead of its verification, e.g. when
+        the kiosk scans a weapon assigned to them. The Personnel instance
+        replaces the snapshot query.
+
+        Returns:
+            CachedFace: Cached personnel snapshot and templates
+        """
+        entry = self.get(personnel.id_number)
+        if entry is not None:
+            return entry
+
+        self.prefetches += 1
+        entry = self._load(personnel.id_number, snapshot(personnel))
+        self.put(entry)
+        return entry
+
+    def lookup_many(self, personnel):
+        """
+        Entries for several Personnel at once. All misses are loaded
+        together with two queries, the Personnel instances replace the
+        snapshot queries.
+
+        Args:
+            personnel (iterable): Personnel instances
+
+        Returns:
+            dict: id_number -> CachedFace
+        """
+        entries = {}
+        missing = {}
+        for person in personnel:
+            entry = self.get(person.id_number)
+            if entry is not None:
+                self.hits += 1
+                entries[person.id_number] = entry
+            else:
+                missing[person.id_number] = person
+
+        if missing:
+            self.misses += len(missing)
+            for entry in self._load_many(missing):
+                self.put(entry)
+                entries[entry.personnel_id] = entry
+        return entries
+
+    def put(self, entry):
+        with self._lock:
+            self._entries[entry.personnel_id] = entry
+            self._entries.move_to_end(entry.personnel_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, personnel_id):
+        with self._lock:
+            self._entries.pop(personnel_id, None)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry the predicate matches."""
+        with self._lock:
+            for personnel_id in [key for key, entry in self._entries.items() if predicate(entry)]:
+                del self._entries[personnel_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _load(self, personnel_id, personnel=None):
+        from inventory.models import Personnel
+        from .models import FaceRecord
+
+        if personnel is None:
+            personnel = Personnel.objects.filter(id_number=personnel_id).values_list(
+                'pk', 'id_number', 'first_name', 'last_name', 'rank'
+            ).first()
+
+        face_record = FaceRecord.objects.filter(
+            personnel_id=personnel_id,
+            is_active=True
+        ).only('id', 'personnel_id', 'face_embedding').first()
+
+        templates = face_record.template_embeddings() if face_record else None
+        if templates is not None:
+            # Entries are shared between request threads
+            templates.setflags(write=False)
+
+        return CachedFace(
+            personnel_id=personnel_id,
+            personnel=PersonnelSnapshot(*personnel) if personnel else None,
+            face_record_id=face_record.id if face_record else None,
+            templates=templates,
+            expires_at=time.monotonic() + self.ttl
+        )
+
+    def _load_many(self, personnel):
+        from .models import FaceRecord, FaceTemplate
+
+        face_records = {
+            face_record.personnel_id: face_record
+            for face_record in FaceRecord.objects.filter(
+                personnel_id__in=personnel.keys(),
+                is_active=True
+            ).only('id', 'personnel_id', 'face_embedding')
+        }
+
+        embeddings = defaultdict(list)
+        rows = FaceTemplate.objects.filter(
+            face_record_id__in=[face_record.id for face_record in face_records.values()]
+        ).values_list('face_record_id', 'embedding')
+        for face_record_id, embedding in rows:
+            embedding = normalize_embedding(embedding)
+            if embedding is not None:
+                embeddings[face_record_id].append(embedding)
+
+        expires_at = time.monotonic() + self.ttl
+        for personnel_id, person in personnel.items():
+            face_record = face_records.get(personnel_id)
+            templates = None
+            if face_record is not None:
+                rows = embeddings.get(face_record.id)
+                # Records enrolled before templates existed only have the single embedding
+                if not rows and face_record.face_embedding:
+                    rows = [embedding for embedding in [normalize_embedding(face_record.face_embedding)] if embedding is not None]
+                if rows:
+                    templates = np.vstack(rows)
+                    templates.setflags(write=False)
+
+            yield CachedFace(
+                personnel_id=personnel_id,
+                personnel=snapshot(person),
+                face_record_id=face_record.id if face_record else None,
+                templates=templates,
+                expires_at=expires_at
+            )
+
+
+def snapshot(personnel):
+    """PersonnelSnapshot of a Personnel instance"""
+    return PersonnelSnapshot(personnel.pk, personnel.id_number, personnel.first_name, personnel.last_name, personnel.rank)
+
+
+# Shared cache for the Django process
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,97 @@
+# face_authentication/embedding_export.py
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from .embeddings import decode_embedding
+
+# Binary export layout (all little-endian):
+#   header     magic 'FEMB', version u16, flags u16, count u32, dimension u32,
+#              generated_at u64 (unix milliseconds)
+#   id table   count entries of u8 length + UTF-8 personnel_id, zero padded
+#              to a multiple of 4 bytes
+#   matrix     count x dimension float32, row i belongs to id i; an all-zero
+#              row means the record disappeared while the export ran
+MAGIC = b'FEMB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIQ')
+
+CONTENT_TYPE = 'application/x-face-embeddings'
+
+
+def export_records(records, chunk_size=500):
+    """
+    Stream the active face embeddings in the binary export format.
+
+    Only the ids are read up front; embeddings are fetched and decoded
+    chunk by chunk, so memory stays flat however large the gallery is.
+
+    Args:
+        records (QuerySet): FaceRecords to export
+        chunk_size (int): Records fetched per query
+
+    Yields:
+        bytes: Consecutive pieces of the export
+    """
+    records = records.filter(face_embedding__isnull=False)
+    ids = list(records.order_by('personnel_id').values_list('personnel_id', flat=True))
+
+    dimension = 0
+    first = records.values_list('face_embedding', flat=True).first()
+    if first is not None:
+        dimension = decode_embedding(first).shape[0]
+
+    yield HEADER.pack(MAGIC, VERSION, 0, len(ids), dimension, int(time.time() * 1000))
+
+    id_table = bytearray()
+    for personnel_id in ids:
+        encoded = personnel_id.encode('utf-8')
+        id_table += bytes([len(encoded)]) + encoded
+    id_table += b'\0' * (-len(id_table) % 4)
+    yield bytes(id_table)
+
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        embeddings = dict(records.filter(personnel_id__in=chunk).values_list('personnel_id', 'face_embedding'))
+
+        matrix = np.zeros((len(chunk), dimension), dtype='<f4')
+        for row, personnel_id in enumerate(chunk):
+            vector = decode_embedding(embeddings.get(personnel_id))
+            if vector is not None and vector.shape[0] == dimension:
+                matrix[row] = vector
+        yield matrix.tobytes()
+
+
+def gzip_stream(chunks, level=6):
+    """Compress a byte stream into a gzip member on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def parse_export(data):
+    """
+    Decode a binary export.
+
+    Returns:
+        dict: personnel_id -> float32 embedding, without all-zero rows
+    """
+    magic, version, flags, count, dimension, generated_at = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a face embedding export')
+
+    offset = HEADER.size
+    ids = []
+    for _ in range(count):
+        length = data[offset]
+        ids.append(bytes(data[offset + 1:offset + 1 + length]).decode('utf-8'))
+        offset += 1 + length
+    offset += -(offset - HEADER.size) % 4
+
+    matrix = np.frombuffer(data, dtype='<f4', count=count * dimension, offset=offset).reshape(count, dimension)
+    return {personnel_id: matrix[row].copy() for row, personnel_id in enumerate(ids) if np.any(matrix[row])}
@@ -0,0 +1,282 @@
+# face_authentication/embedding_store.py
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from .embeddings import normalize_embedding
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+StoreSnapshot = namedtuple('StoreSnapshot', ['version', 'generation', 'ids', 'matrix'])
+
+
+class EmbeddingStore:
+    """
+    On-disk embedding matrix shared read-only by all worker processes.
+
+    The directory holds:
+      - ``embeddings-<generation>.f32``: contiguous float32 rows (row-major,
+        normalized), only ever appended to within a generation
+      - ``ids-<version>.json``: personnel_id of every row, ``null`` for rows
+        that were replaced or deleted
+      - ``manifest.json``: current version, generation, row count and
+        dimension
+
+    Readers ``mmap`` the data file and only map the row count named by the
+    manifest, so appends never disturb them. Writers append rows, write a
+    new ids file and then atomically replace the manifest; readers see the
+    new version on their next ``open()``. Once too many rows are dead the
+    writer compacts into a new generation.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, directory, compact_ratio=0.25):
+        self.directory = str(directory)
+        self.compact_ratio = compact_ratio
+        self._thread_lock = threading.Lock()
+        self._stat_key = None
+        self._manifest = None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, self.MANIFEST)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def read_manifest(self):
+        """Return the current manifest, re-reading it only when the file changed."""
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            self._stat_key = None
+            self._manifest = None
+            return None
+
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stat_key != self._stat_key:
+            with open(self.manifest_path, 'r') as f:
+                self._manifest = json.load(f)
+            self._stat_key = stat_key
+
+        return self._manifest
+
+    def version(self):
+        manifest = self.read_manifest()
+        return manifest['version'] if manifest else 0
+
+    def open(self):
+        """
+        Map the current version read-only.
+
+        Returns:
+            StoreSnapshot: version, generation, row ids (None for dead rows)
+            and a read-only memmap of shape (rows, dimension)
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            return StoreSnapshot(0, 0, [], np.empty((0, 0), dtype=np.float32))
+
+        with open(self._path(manifest['ids']), 'r') as f:
+            ids = json.load(f)
+
+        rows = manifest['rows']
+        if rows:
+            matrix = np.memmap(self._path(manifest['data']), dtype=np.float32, mode='r',
+                               shape=(rows, manifest['dimension']))
+        else:
+            matrix = np.empty((0, manifest['dimension'] or 0), dtype=np.float32)
+
+        return StoreSnapshot(manifest['version'], manifest['generation'], ids, matrix)
+
+    def rebuild(self, records=None):
+        """
+        Write a fresh, compacted generation.
+
+        Args:
+            records (iterable, optional): (personnel_id, embedding) pairs,
+                defaults to all active FaceRecords
+        """
+        if records is None:
+            from .models import FaceRecord
+            records = FaceRecord.objects.filter(
+                is_active=True,
+                face_embedding__isnull=False
+            ).values_list('personnel_id', 'face_embedding').iterator()
+
+        ids = []
+        vectors = []
+        for personnel_id, embedding in records:
+            vector = normalize_embedding(embedding)
+            if vector is None:
+                continue
+            if vectors and vector.shape[0] != vectors[0].shape[0]:
+                logger.warning(f"Skipping embedding for {personnel_id}: dimension {vector.shape[0]} does not match the store")
+                continue
+            ids.append(personnel_id)
+            vectors.append(vector)
+
+        matrix = np.vstack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+        with self._write_lock():
+            manifest = self.read_manifest()
+            self._write_generation(manifest, ids, matrix)
+
+        logger.info(f"Embedding store rebuilt with {len(ids)} embeddings")
+
+    def upsert(self, personnel_id, embedding):
+        self.apply(upserts={personnel_id: embedding})
+
+    def remove(self, personnel_id):
+        self.apply(removals=[personnel_id])
+
+    def apply(self, upserts=None, removals=()):
+        """
+        Append new or changed embeddings and tombstone removed ones.
+
+        Args:
+            upserts (dict): personnel_id -> embedding
+            removals (iterable): personnel_ids to remove
+        """
+        upserts = upserts or {}
+
+        with self._write_lock():
+            manifest = self.read_manifest()
+            if manifest is None:
+                # Nothing to update yet; the first rebuild reads the database
+                return
+
+            with open(self._path(manifest['ids']), 'r') as f:
+                ids = json.load(f)
+            rows = {personnel_id: row for row, personnel_id in enumerate(ids) if personnel_id is not None}
+
+            changed = False
+            for personnel_id in list(removals) + list(upserts):
+                row = rows.pop(personnel_id, None)
+                if row is not None:
+                    ids[row] = None
+                    changed = True
+
+            new_ids = []
+            new_vectors = []
+            dimension = manifest['dimension']
+            for personnel_id, embedding in upserts.items():
+                vector = normalize_embedding(embedding)
+                if vector is None:
+                    continue
+                if dimension and vector.shape[0] != dimension:
+                    logger.warning(f"Skipping embedding for {personnel_id}: dimension {vector.shape[0]} does not match the store")
+                    continue
+                dimension = vector.shape[0]
+                new_ids.append(personnel_id)
+                new_vectors.append(vector)
+
+            if not changed and not new_vectors:
+                return
+
+            dead = ids.count(None)
+            if dead and dead > self.compact_ratio * (len(ids) + len(new_ids)):
+                # Too many dead rows: rewrite live rows into a new generation
+                live = [row for row, personnel_id in enumerate(ids) if personnel_id is not None]
+                old = self.open().matrix
+                parts = [np.asarray(old[live])] if live else []
+                parts.extend(vector[np.newaxis, :] for vector in new_vectors)
+                matrix = np.vstack(parts) if parts else np.empty((0, 0), dtype=np.float32)
+                self._write_generation(manifest, [ids[row] for row in live] + new_ids, matrix)
+                return
+
+            data_path = self._path(manifest['data'])
+            if new_vectors:
+                offset = manifest['rows'] * dimension * 4
+                mode = 'r+b' if os.path.exists(data_path) else 'wb'
+                with open(data_path, mode) as f:
+                    # Overwrite anything a crashed writer left past the last committed row
+                    f.seek(offset)
+                    f.write(np.vstack(new_vectors).astype(np.float32).tobytes())
+                    f.truncate()
+
+            ids.extend(new_ids)
+            self._commit(manifest['version'] + 1, manifest['generation'], ids, dimension, manifest['data'])
+
+    def _write_generation(self, manifest, ids, matrix):
+        version = (manifest['version'] if manifest else 0) + 1
+        generation = (manifest['generation'] if manifest else 0) + 1
+        os.makedirs(self.directory, exist_ok=True)
+
+        data_name = f"embeddings-{generation}.f32"
+        tmp_path = self._path(f"{data_name}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        os.replace(tmp_path, self._path(data_name))
+
+        dimension = matrix.shape[1] if matrix.ndim == 2 and matrix.shape[0] else (manifest or {}).get('dimension', 0)
+        self._commit(version, generation, ids, dimension, data_name)
+
+    def _commit(self, version, generation, ids, dimension, data_name):
+        ids_name = f"ids-{version}.json"
+        self._write_json(ids_name, ids)
+        self._write_json(self.MANIFEST, {
+            'version': version,
+            'generation': generation,
+            'rows': len(ids),
+            'dimension': dimension,
+            'data': data_name,
+            'ids': ids_name,
+        })
+        self._cleanup(version, generation)
+
+    def _cleanup(self, version, generation):
+        # Keep the previous version around for readers that are mid-open
+        for name in os.listdir(self.directory):
+            try:
+                if name.startswith('ids-') and name.endswith('.json'):
+                    if int(name[4:-5]) < version - 1:
+                        os.remove(self._path(name))
+                elif name.startswith('embeddings-') and name.endswith('.f32'):
+                    if int(name[11:-4]) < generation - 1:
+                        os.remove(self._path(name))
+            except (ValueError, OSError):
+                continue
+
+    def _write_json(self, name, data):
+        tmp_path = self._path(f"{name}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path(name))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize writers across threads and worker processes."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._thread_lock:
+            with open(self._path('.lock'), 'a+') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_embedding_store():
+    """Return the configured EmbeddingStore, or None if the store is disabled."""
+    directory = getattr(settings, 'FACE_EMBEDDING_STORE_DIR', None)
+    if not directory:
+        return None
+    return EmbeddingStore(directory)
@@ -0,0 +1,212 @@
+# face_authentication/embeddings.py
+import numpy as np
+from django.conf import settings
+
+ENCODINGS = ('float32', 'float16', 'int8')
+TEMPLATE_POLICIES = ('max', 'mean', 'centroid')
+
+# Compact blobs start with a 4-byte header that reads as a float32 NaN, so
+# it can never be confused with the first value of a raw float32 embedding
+_HEADERS = {
+    'float16': b'F\x10\xff\xff',
+    'int8': b'I\x08\xff\xff',
+}
+
+
+def embedding_encoding(embedding):
+    """Return the storage encoding ('float32', 'float16' or 'int8') of a blob."""
+    header = bytes(embedding[:4])
+    for encoding, encoding_header in _HEADERS.items():
+        if header == encoding_header:
+            return encoding
+    return 'float32'
+
+
+def decode_embedding(embedding):
+    """
+    Convert a stored embedding into a float32 numpy array.
+
+    Raw float32 blobs and the compact float16/int8 blobs written by
+    encode_embedding are both accepted.
+
+    Args:
+        embedding (bytes, memoryview or numpy.ndarray): Raw embedding data
+
+    Returns:
+        numpy.ndarray: 1-D float32 array, or None if there is no data
+    """
+    if embedding is None:
+        return None
+
+    if isinstance(embedding, np.ndarray):
+        return embedding.astype(np.float32, copy=False).ravel()
+
+    embedding = bytes(embedding)
+    if not embedding:
+        return None
+
+    encoding = embedding_encoding(embedding)
+    if encoding == 'float16':
+        return np.frombuffer(embedding, dtype='<f2', offset=4).astype(np.float32)
+    if encoding == 'int8':
+        scale = np.frombuffer(embedding, dtype='<f4', count=1, offset=4)[0]
+        return np.frombuffer(embedding, dtype=np.int8, offset=8).astype(np.float32) * scale
+
+    return np.frombuffer(embedding, dtype=np.float32)
+
+
+def encode_embedding(embedding, encoding=None):
+    """
+    Serialize an embedding for storage in a BinaryField.
+
+    Args:
+        embedding (bytes or numpy.ndarray): Embedding in any supported form
+        encoding (str, optional): 'float32', 'float16' or 'int8', defaults
+            to settings.FACE_EMBEDDING_ENCODING
+
+    Returns:
+        bytes: Encoded embedding, or None if there is no data
+    """
+    vector = decode_embedding(embedding)
+    if vector is None:
+        return None
+
+    encoding = encoding or getattr(settings, 'FACE_EMBEDDING_ENCODING', 'float32')
+    values, scale = quantize_vector(vector, encoding)
+
+    if encoding == 'float16':
+        return _HEADERS['float16'] + values.astype('<f2').tobytes()
+    if encoding == 'int8':
+        return _HEADERS['int8'] + np.float32(scale).astype('<f4').tobytes() + values.tobytes()
+
+    return values.astype('<f4').tobytes()
+
+
+def normalize_embedding(embedding):
+    """
+    Decode an embedding and scale it to unit length, so that cosine
+    similarity becomes a plain dot product.
+
+    Returns:
+        numpy.ndarray: Normalized float32 array, or None if the embedding
+        is empty or has zero norm
+    """
+    vector = decode_embedding(embedding)
+    if vector is None:
+        return None
+
+    norm = np.linalg.norm(vector)
+    if not np.isfinite(norm) or norm == 0:
+        return None
+
+    return (vector / norm).astype(np.float32)
+
+
+def centroid_embedding(embeddings):
+    """
+    Normalized mean of several stored embeddings.
+
+    Returns:
+        numpy.ndarray: Normalized float32 centroid, or None if none of the
+        embeddings is usable
+    """
+    vectors = [normalize_embedding(e) for e in embeddings]
+    vectors = [v for v in vectors if v is not None]
+    if not vectors:
+        return None
+
+    return normalize_embedding(np.mean(np.vstack(vectors), axis=0))
+
+
+def matrix_dtype(encoding):
+    """numpy dtype used to hold embeddings of the given encoding in memory."""
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown embedding encoding: {encoding}")
+    return {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}[encoding]
+
+
+def quantize_vector(vector, encoding):
+    """
+    Quantize a float32 vector.
+
+    int8 uses a symmetric per-vector scale (max |x| maps to 127).
+
+    Returns:
+        tuple: (values, scale) where ``values * scale`` approximates the input
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+
+    if encoding == 'float32':
+        return vector, 1.0
+    if encoding == 'float16':
+        return vector.astype(np.float16), 1.0
+    if encoding == 'int8':
+        peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        return np.clip(np.rint(vector / scale), -127, 127).astype(np.int8), scale
+
+    raise ValueError(f"Unknown embedding encoding: {encoding}")
+
+
+def score_matrix(matrix, probe, scales=None, chunk_rows=4096):
+    """
+    Dot product of every row of a (possibly compact) matrix with a probe.
+
+    float16/int8 rows are widened to float32 one chunk at a time, so the
+    full matrix is never expanded in memory.
+
+    Args:
+        matrix (numpy.ndarray): float32, float16 or int8 rows
+        probe (numpy.ndarray): float32 query vector
+        scales (numpy.ndarray, optional): Per-row scales for int8 rows
+
+    Returns:
+        numpy.ndarray: float32 scores, one per row
+    """
+    if matrix.dtype == np.float32:
+        scores = matrix @ probe
+    else:
+        scores = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], chunk_rows):
+            chunk = matrix[start:start + chunk_rows].astype(np.float32)
+            scores[start:start + chunk_rows] = chunk @ probe
+
+    if scales is not None:
+        scores *= scales
+
+    return scores
+
+
+def dequantize_matrix(matrix, scales=None):
+    """Expand compact rows back to a float32 matrix."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if scales is not None:
+        matrix = matrix * scales[:, np.newaxis]
+    return matrix
+
+
+def score_templates(templates, probe, policy='max'):
+    """
+    Score a probe against all enrollment templates of one person at once.
+
+    Args:
+        templates (numpy.ndarray): Normalized templates, one per row
+        probe (numpy.ndarray): Normalized probe embedding
+        policy (str): 'max' (best template), 'mean' (average template score)
+            or 'centroid' (score against the normalized mean template)
+
+    Returns:
+        tuple: (score, per-template scores)
+    """
+    scores = templates @ probe
+
+    if policy == 'max':
+        return float(scores.max()), scores
+    if policy == 'mean':
+        return float(scores.mean()), scores
+    if policy == 'centroid':
+        centroid = templates.mean(axis=0)
+        norm = np.linalg.norm(centroid)
+        return (float(centroid @ probe / norm) if norm else 0.0), scores
+
+    raise ValueError(f"Unknown template policy: {policy}")
@@ -0,0 +1,514 @@
+# face_authentication/gallery.py
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from .ann import IVFIndex
+from .embedding_store import get_embedding_store
+from .embeddings import dequantize_matrix, matrix_dtype, normalize_embedding, quantize_vector, score_matrix
+
+logger = logging.getLogger(__name__)
+
+
+class GalleryIndex:
+    """
+    In-memory index of all active face embeddings.
+
+    Embeddings are kept as rows of a normalized float32 matrix with a
+    personnel_id <-> row map next to it, so a 1:1 check is a single dot
+    product and a 1:N search is a single matrix-vector product. The index
+    is loaded once from FaceRecord and then kept up to date by the
+    FaceRecord signals in signals.py. Signals only reach the process that
+    made the change, so every lookup first compares the latest FaceChange
+    sequence number and applies what other workers changed since.
+
+    With FACE_INDEX_BACKEND = 'ivf' large galleries are additionally kept
+    in an IVFIndex and 1:N searches go through it instead of scoring every
+    row. The IVF index is built once the gallery reaches FACE_IVF_MIN_SIZE
+    and retrained whenever it has doubled since, so enrollments keep the
+    lists balanced without a restart.
+
+    With an EmbeddingStore the matrix is not held per process: it is a
+    read-only memmap of the shared store file. Writes go to the store and
+    every query first checks the store manifest, so a change made by one
+    worker is picked up by the others without a restart.
+
+    FACE_GALLERY_ENCODING = 'float16' or 'int8' keeps the in-process matrix
+    in compact form (int8 with a per-row scale) and scores it directly.
+    The shared store is always float32.
+    """
+
+    def __init__(self, store=None, encoding=None):
+        self._store = store
+        self._encoding = encoding or getattr(settings, 'FACE_GALLERY_ENCODING', 'float32')
+        self._scales = None
+        self._store_version = None
+        self._store_generation = None
+        self._alive = None
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._size = 0
+        self._ids = []
+        self._rows = {}
+        self._loaded = False
+        self._ann = None
+        self._ann_size = 0
+        self._change_cursor = 0
+        self._applied_changes = set()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, personnel_id):
+        return personnel_id in self._rows
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def dimension(self):
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    @property
+    def store(self):
+        return self._store
+
+    def load(self):
+        """(Re)build the index from all active FaceRecords."""
+        if self._store is not None:
+            self._load_store()
+            return
+
+        from .models import FaceChange, FaceRecord
+
+        # Taken before the records are read, later changes are applied by refresh()
+        change_cursor = FaceChange.cursor()
+        records = FaceRecord.objects.filter(
+            is_active=True,
+            face_embedding__isnull=False
+        ).values_list('personnel_id', 'face_embedding')
+
+        with self._lock:
+            self._matrix = None
+            self._scales = None
+            self._size = 0
+            self._ids = []
+            self._rows = {}
+            self._ann = None
+
+            for personnel_id, embedding in records.iterator():
+                self._upsert(personnel_id, embedding)
+
+            self._ann = self._build_ann()
+            self._change_cursor = change_cursor
+            self._applied_changes = set()
+            self._loaded = True
+
+        logger.info(f"Face gallery loaded with {self._size} embeddings")
+
+    def refresh(self):
+        """Pick up changes made by other processes: a newer store version, or new FaceChanges."""
+        if not self._loaded:
+            return
+
+        if self._store is None:
+            self._apply_changes()
+        elif self._store.version() != self._store_version:
+            self._load_store()
+
+    def _apply_changes(self):
+        from .models import FaceChange, FaceRecord
+
+        # One indexed MAX(seq) while nothing changed
+        latest = FaceChange.latest_seq()
+        if latest == self._change_cursor:
+            return
+        if latest < self._change_cursor:
+            # The log is older than the index, e.g. after a database restore
+            self.load()
+            return
+
+        # Everything up to the new cursor has committed; changes above it are
+        # applied now and looked at again until the cursor passes them
+        cursor = FaceChange.cursor()
+        changes = FaceChange.objects.filter(seq__gt=self._change_cursor).values_list('seq', 'personnel_id')
+        changes = [(seq, personnel_id) for seq, personnel_id in changes if seq not in self._applied_changes]
+        personnel_ids = {personnel_id for _, personnel_id in changes}
+
+        if len(personnel_ids) > getattr(settings, 'FACE_GALLERY_MAX_CHANGES', 1000):
+            self.load()
+            return
+
+        records = dict(FaceRecord.objects.filter(
+            personnel_id__in=personnel_ids,
+            is_active=True,
+            face_embedding__isnull=False
+        ).values_list('personnel_id', 'face_embedding')) if personnel_ids else {}
+
+        with self._lock:
+            for personnel_id in personnel_ids:
+                if personnel_id in records:
+                    self._upsert(personnel_id, records[personnel_id])
+                else:
+                    self.remove(personnel_id)
+            self._update_ann()
+
+            self._change_cursor = max(self._change_cursor, cursor)
+            self._applied_changes = {
+                seq for seq in self._applied_changes.union(seq for seq, _ in changes) if seq > self._change_cursor
+            }
+
+        if personnel_ids:
+            logger.info(f"Face gallery applied {len(personnel_ids)} changes from other processes")
+
+    def _load_store(self):
+        if not self._store.exists():
+            self._store.rebuild()
+
+        with self._lock:
+            snapshot = self._store.open()
+            if snapshot.version == self._store_version:
+                return
+
+            old_rows = self._rows
+            old_size = self._size
+            same_generation = snapshot.generation == self._store_generation
+
+            self._matrix = snapshot.matrix if snapshot.matrix.size else None
+            self._scales = None
+            self._size = len(snapshot.ids)
+            self._ids = snapshot.ids
+            self._rows = {personnel_id: row for row, personnel_id in enumerate(snapshot.ids) if personnel_id is not None}
+            self._alive = None
+            if len(self._rows) < self._size:
+                self._alive = np.array([personnel_id is not None for personnel_id in snapshot.ids])
+
+            if self._ann is not None and same_generation:
+                # The store only appends within a generation, so replay the difference
+                for personnel_id in old_rows.keys() - self._rows.keys():
+                    self._ann.remove(personnel_id)
+                for row in range(old_size, self._size):
+                    if self._ids[row] is not None:
+                        self._ann.add(self._ids[row], self._matrix[row])
+                self._update_ann()
+            else:
+                self._ann = self._build_ann()
+
+            self._store_version = snapshot.version
+            self._store_generation = snapshot.generation
+            self._loaded = True
+
+        logger.info(f"Face gallery mapped store version {snapshot.version} with {len(self._rows)} embeddings")
+
+    def ensure_loaded(self):
+        """Load the index on first use."""
+        if self._loaded:
+            return
+
+        with self._lock:
+            if not self._loaded:
+                self.load()
+
+    def warm(self):
+        """Load the index in a background thread, e.g. at worker startup."""
+        def load_task():
+            try:
+                self.ensure_loaded()
+            except Exception as e:
+                logger.error(f"Error loading face gallery: {str(e)}")
+            finally:
+                close_old_connections()
+
+        threading.Thread(target=load_task, name='face-gallery-warmup', daemon=True).start()
+
+    def sync_record(self, face_record):
+        """Apply a saved FaceRecord to the index."""
+        if not self._loaded and self._store is None:
+            # Records saved before the first load are picked up by load()
+            return
+
+        if face_record.is_active and face_record.face_embedding:
+            self.upsert(face_record.personnel_id, face_record.face_embedding)
+        else:
+            self.remove(face_record.personnel_id)
+
+    def sync_records(self, face_records):
+        """Apply several saved FaceRecords at once, e.g. after a bulk_update."""
+        if not self._loaded and self._store is None:
+            return
+
+        upserts = {}
+        removals = []
+        for face_record in face_records:
+            if face_record.is_active and face_record.face_embedding:
+                upserts[face_record.personnel_id] = face_record.face_embedding
+            else:
+                removals.append(face_record.personnel_id)
+
+        if self._store is not None:
+            # One append and one manifest version for the whole batch
+            self._store.apply(upserts=upserts, removals=removals)
+            self.refresh()
+            return
+
+        with self._lock:
+            for personnel_id, embedding in upserts.items():
+                self._upsert(personnel_id, embedding)
+            for personnel_id in removals:
+                self.remove(personnel_id)
+            self._update_ann()
+
+    def upsert(self, personnel_id, embedding):
+        """Add or replace the embedding for a personnel."""
+        if self._store is not None:
+            self._store.upsert(personnel_id, embedding)
+            self.refresh()
+            return
+
+        with self._lock:
+            self._upsert(personnel_id, embedding)
+            self._update_ann()
+
+    def remove(self, personnel_id):
+        """Remove a personnel from the index, if present."""
+        if self._store is not None:
+            self._store.remove(personnel_id)
+            self.refresh()
+            return
+
+        with self._lock:
+            if self._ann is not None:
+                self._ann.remove(personnel_id)
+
+            row = self._rows.pop(personnel_id, None)
+            if row is None:
+                return
+
+            # Move the last row into the freed slot to keep the matrix dense
+            last = self._size - 1
+            if row != last:
+                moved_id = self._ids[last]
+                self._matrix[row] = self._matrix[last]
+                if self._scales is not None:
+                    self._scales[row] = self._scales[last]
+                self._ids[row] = moved_id
+                self._rows[moved_id] = row
+
+            self._ids.pop()
+            self._size = last
+
+    def get(self, personnel_id):
+        """Return a copy of the normalized embedding for a personnel, or None."""
+        self.ensure_loaded()
+        self.refresh()
+        with self._lock:
+            row = self._rows.get(personnel_id)
+            if row is None:
+                return None
+            return self._dequantize(slice(row, row + 1))[0]
+
+    def snapshot(self):
+        """Return (ids, matrix) copies of the current index contents."""
+        self.ensure_loaded()
+        with self._lock:
+            if self._matrix is None:
+                return [], np.empty((0, 0), dtype=np.float32)
+            if self._alive is not None:
+                rows = np.flatnonzero(self._alive)
+                return [self._ids[row] for row in rows], self._dequantize(rows)
+            return list(self._ids), self._dequantize(slice(0, self._size))
+
+    def verify(self, personnel_id, probe):
+        """
+        1:1 lookup: cosine similarity between a probe embedding and the
+        stored embedding of one personnel.
+
+        Returns:
+            float: Similarity score, or None if the personnel is not enrolled
+        """
+        probe = self._prepare_probe(probe)
+        if probe is None:
+            return None
+
+        self.ensure_loaded()
+        self.refresh()
+        with self._lock:
+            row = self._rows.get(personnel_id)
+            if row is None:
+                return None
+            return float(self._score(slice(row, row + 1), probe)[0])
+
+    def search(self, probe, k=5, threshold=None, n_probe=None):
+        """
+        1:N lookup: the k most similar enrolled faces.
+
+        Args:
+            probe (bytes or numpy.ndarray): Query embedding
+            k (int): Maximum number of matches to return
+            threshold (float, optional): Minimum similarity for a match
+            n_probe (int, optional): IVF lists to scan when the ANN index is used
+
+        Returns:
+            list: Matches as {'id', 'similarity'} dicts, best first
+        """
+        probe = self._prepare_probe(probe)
+        if probe is None:
+            return []
+
+        self.ensure_loaded()
+        self.refresh()
+        if self._ann is not None:
+            return self._ann.search(probe, k=k, threshold=threshold, n_probe=n_probe)
+
+        with self._lock:
+            if self._size == 0:
+                return []
+
+            scores = self._score(slice(0, self._size), probe)
+            if self._alive is not None:
+                scores = np.where(self._alive, scores, -np.inf)
+            ids = list(self._ids)
+
+        return self.top_k(scores, ids, k, threshold)
+
+    @staticmethod
+    def top_k(scores, ids, k, threshold=None):
+        """Select the k best scores and format them as matches."""
+        k = min(max(int(k), 1), len(scores))
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates])]
+
+        matches = []
+        for row in candidates:
+            similarity = float(scores[row])
+            if not np.isfinite(similarity) or (threshold is not None and similarity < threshold):
+                break
+            matches.append({
+                'id': ids[row],
+                'similarity': similarity
+            })
+
+        return matches
+
+    def _prepare_probe(self, probe):
+        probe = normalize_embedding(probe)
+        if probe is None:
+            return None
+
+        dimension = self.dimension
+        if dimension is not None and probe.shape[0] != dimension:
+            logger.warning(f"Probe embedding has {probe.shape[0]} dimensions, gallery has {dimension}")
+            return None
+
+        return probe
+
+    def _upsert(self, personnel_id, embedding):
+        vector = normalize_embedding(embedding)
+        if vector is None:
+            self.remove(personnel_id)
+            return
+
+        if self._matrix is None:
+            self._matrix = np.empty((16, vector.shape[0]), dtype=matrix_dtype(self._encoding))
+            if self._encoding == 'int8':
+                self._scales = np.empty(16, dtype=np.float32)
+        elif vector.shape[0] != self._matrix.shape[1]:
+            logger.warning(f"Skipping embedding for {personnel_id}: expected {self._matrix.shape[1]} dimensions, got {vector.shape[0]}")
+            return
+
+        row = self._rows.get(personnel_id)
+        if row is None:
+            if self._size == self._matrix.shape[0]:
+                # Grow geometrically so appends stay amortized O(1)
+                grown = np.empty((self._size * 2, self._matrix.shape[1]), dtype=self._matrix.dtype)
+                grown[:self._size] = self._matrix[:self._size]
+                self._matrix = grown
+                if self._scales is not None:
+                    grown_scales = np.empty(self._size * 2, dtype=np.float32)
+                    grown_scales[:self._size] = self._scales[:self._size]
+                    self._scales = grown_scales
+
+            row = self._size
+            self._size += 1
+            self._ids.append(personnel_id)
+            self._rows[personnel_id] = row
+
+        values, scale = quantize_vector(vector, self._encoding)
+        self._matrix[row] = values
+        if self._scales is not None:
+            self._scales[row] = scale
+
+        if self._ann is not None:
+            # The stored row, so later rows match the ones the lists were built from
+            self._ann.add(personnel_id, self._dequantize(slice(row, row + 1))[0])
+
+    def _score(self, rows, probe):
+        scales = None if self._scales is None else self._scales[rows]
+        return score_matrix(self._matrix[rows], probe, scales)
+
+    def _dequantize(self, rows):
+        scales = None if self._scales is None else self._scales[rows]
+        return dequantize_matrix(self._matrix[rows], scales).copy()
+
+    def _update_ann(self):
+        """Build the IVF index once the gallery is large enough, retrain it once it doubled."""
+        if self._ann is None:
+            self._ann = self._build_ann()
+        elif len(self._rows) >= 2 * self._ann_size:
+            self._ann = self._build_ann(retrain=True)
+
+    def _build_ann(self, retrain=False):
+        """Build the IVF index for the loaded rows, if it is enabled."""
+        if getattr(settings, 'FACE_INDEX_BACKEND', 'exact') != 'ivf':
+            return None
+
+        if len(self._rows) < getattr(settings, 'FACE_IVF_MIN_SIZE', 1000):
+            # Brute force is faster than IVF for small galleries
+            return None
+
+        index_path = getattr(settings, 'FACE_IVF_INDEX_PATH', None)
+        ids = self._ids
+        matrix = self._dequantize(slice(0, self._size))
+        if self._alive is not None:
+            rows = np.flatnonzero(self._alive)
+            ids = [self._ids[row] for row in rows]
+            matrix = matrix[rows]
+
+        self._ann_size = len(ids)
+
+        # Reuse persisted centroids so workers don't retrain on every start
+        if index_path and not retrain and os.path.exists(index_path):
+            try:
+                index = IVFIndex.load(index_path)
+                if index.dimension == matrix.shape[1]:
+                    index.n_probe = getattr(settings, 'FACE_IVF_PROBE', index.n_probe)
+                    index.build(ids, matrix, retrain=False)
+                    return index
+            except Exception as e:
+                logger.error(f"Error loading IVF index from {index_path}: {str(e)}")
+
+        index = IVFIndex(
+            n_lists=getattr(settings, 'FACE_IVF_LISTS', 256),
+            n_probe=getattr(settings, 'FACE_IVF_PROBE', 16)
+        )
+        index.build(ids, matrix)
+
+        if index_path:
+            try:
+                index.save(index_path)
+            except Exception as e:
+                logger.error(f"Error saving IVF index to {index_path}: {str(e)}")
+
+        return index
+
+
+# Shared index for the Django process
+gallery = GalleryIndex(store=get_embedding_store())
@@ -0,0 +1,178 @@
+# face_authentication/idempotency.py
+import functools
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(request):
+    """Hash of the request payload, to detect a key reused for another request"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def claim_key(scope, endpoint, key, request_hash, ttl, lock_timeout):
+    """
+    Register a request under its idempotency key.
+
+    An expired record, or one left in progress for longer than lock_timeout
+    by a crashed worker, is taken over.
+
+    Returns:
+        tuple: (IdempotencyRecord, claimed) where claimed is True if the
+        caller has to run the request
+    """
+    from .models import IdempotencyRecord
+
+    for _ in range(3):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = IdempotencyRecord.objects.create(
+                    scope=scope,
+                    endpoint=endpoint,
+                    key=key,
+                    request_hash=request_hash,
+                    created_at=now,
+                    expires_at=now + ttl
+                )
+            return record, True
+        except IntegrityError:
+            pass
+
+        record = IdempotencyRecord.objects.filter(scope=scope, endpoint=endpoint, key=key).first()
+        if record is None:
+            # Deleted in between, the request that held it failed
+            continue
+
+        abandoned = record.status == 'in_progress' and record.created_at < now - lock_timeout
+        if record.expires_at > now and not abandoned:
+            return record, False
+
+        # Conditional update, only one of several retries takes it over
+        taken = IdempotencyRecord.objects.filter(
+            pk=record.pk, status=record.status, created_at=record.created_at
+        ).update(
+            status='in_progress',
+            request_hash=request_hash,
+            status_code=None,
+            response=None,
+            created_at=now,
+            expires_at=now + ttl
+        )
+        if taken:
+            record.refresh_from_db()
+            return record, True
+
+    raise RuntimeError(f'Could not claim idempotency key {key}')
+
+
+def store_response(record, response):
+    """Keep a final response for replay; anything retryable releases the key instead"""
+    retryable = response.status_code >= 500 or response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    if retryable or not hasattr(response, 'data'):
+        record.delete()
+        return
+
+    record.status = 'completed'
+    record.status_code = response.status_code
+    record.response = response.data
+    try:
+        record.save(update_fields=['status', 'status_code', 'response'])
+    except (TypeError, ValueError) as e:
+        logger.error(f"Could not store response for idempotency key {record.key}: {str(e)}")
+        record.delete()
+
+
+def replay_response(record):
+    response = Response(record.response, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(endpoint=None):
+    """
+    View decorator for Idempotency-Key support.
+
+    The first request with a key runs the view; its response is stored for
+    FACE_IDEMPOTENCY_TTL seconds and replayed to every repeat of the same
+    request, without running inference or writes again. A repeat that
+    arrives while the first is still running waits up to
+    FACE_IDEMPOTENCY_WAIT seconds for its response, then gets 409. Reusing
+    a key for a different payload gets 422. Server errors and 429s are not
+    stored, so the client can retry with the same key.
+
+    Keys are scoped per user. Apply it directly below @api_view and
+    @permission_classes, above any coalescing or admission control.
+    """
+    def decorator(view_func):
+        name = endpoint or view_func.__name__
+
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if not key:
+                return view_func(request, *args, **kwargs)
+
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            scope = str(request.user.pk) if request.user.is_authenticated else ''
+            request_hash = request_fingerprint(request)
+            ttl = timedelta(seconds=getattr(settings, 'FACE_IDEMPOTENCY_TTL', 24 * 3600))
+            lock_timeout = timedelta(seconds=getattr(settings, 'FACE_IDEMPOTENCY_LOCK_TIMEOUT', 120))
+            deadline = time.monotonic() + getattr(settings, 'FACE_IDEMPOTENCY_WAIT', 10.0)
+
+            while True:
+                record, claimed = claim_key(scope, name, key, request_hash, ttl, lock_timeout)
+                if claimed:
+                    break
+
+                if record.request_hash != request_hash:
+                    return Response(
+                        {'error': 'Idempotency-Key was already used for a different request'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+
+                if record.status == 'completed':
+                    logger.info(f"Replaying {name} response for idempotency key {key}")
+                    return replay_response(record)
+
+                if time.monotonic() >= deadline:
+                    response = Response(
+                        {'error': 'A request with this Idempotency-Key is still being processed'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                    response['Retry-After'] = '1'
+                    return response
+
+                time.sleep(0.2)
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+
+            store_response(record, response)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,161 @@
+# face_authentication/image_store.py
+import hashlib
+import logging
+import os
+import uuid
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+IMAGE_DIR = 'face_images'
+THUMBNAIL_DIR = os.path.join(IMAGE_DIR, 'thumbs')
+
+
+def content_path(digest):
+    """Path (relative to MEDIA_ROOT) of the image with the given sha256 digest"""
+    return os.path.join(IMAGE_DIR, digest[:2], digest[2:4], f"{digest}.jpg")
+
+
+def thumbnail_path(image_path):
+    """Path (relative to MEDIA_ROOT) of the thumbnail of a stored image"""
+    return os.path.join(THUMBNAIL_DIR, os.path.relpath(image_path, IMAGE_DIR))
+
+
+def store_face_image(image_data):
+    """
+    Store a face image under its content hash and pre-generate its thumbnail.
+
+    Identical uploads map to the same file, so re-registering the same
+    capture costs no extra disk space. With FACE_IMAGE_MAX_SIDE or
+    FACE_IMAGE_MAX_BYTES set, the image is downscaled/recompressed before
+    it is written; the hash is taken over the uploaded bytes so dedup does
+    not depend on those settings.
+
+    Args:
+        image_data (bytes): Encoded image
+
+    Returns:
+        str: Image path relative to MEDIA_ROOT
+    """
+    digest = hashlib.sha256(image_data).hexdigest()
+    relative_path = content_path(digest)
+    full_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+
+    if os.path.exists(full_path):
+        # Refresh the mtime so the garbage collector's grace period starts over
+        os.utime(full_path)
+    else:
+        _write_atomic(full_path, recompress(image_data))
+
+    if not os.path.exists(os.path.join(settings.MEDIA_ROOT, thumbnail_path(relative_path))):
+        make_thumbnail(relative_path, image_data)
+
+    return relative_path
+
+
+def recompress(image_data, max_side=None, max_bytes=None):
+    """
+    Downscale and re-encode an image to fit the configured size budget.
+
+    Returns the original bytes if no budget is configured, the image
+    already fits or it cannot be decoded.
+    """
+    max_side = max_side or getattr(settings, 'FACE_IMAGE_MAX_SIDE', None)
+    max_bytes = max_bytes or getattr(settings, 'FACE_IMAGE_MAX_BYTES', None)
+    if not max_side and not max_bytes:
+        return image_data
+
+    image = _decode(image_data)
+    if image is None:
+        return image_data
+
+    height, width = image.shape[:2]
+    resized = False
+    if max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        resized = True
+
+    if not resized and (not max_bytes or len(image_data) <= max_bytes):
+        return image_data
+
+    encoded = image_data
+    for quality in (90, 80, 70, 60, 50, 40):
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            return image_data
+        encoded = buffer.tobytes()
+        if not max_bytes or len(encoded) <= max_bytes:
+            break
+
+    return encoded
+
+
+def make_thumbnail(image_path, image_data=None, size=None):
+    """
+    Write the thumbnail of a stored image.
+
+    Args:
+        image_path (str): Image path relative to MEDIA_ROOT
+        image_data (bytes, optional): Image bytes, read from disk if omitted
+        size (int, optional): Longest side in pixels, defaults to
+            FACE_IMAGE_THUMBNAIL_SIZE
+
+    Returns:
+        str: Thumbnail path relative to MEDIA_ROOT, or None on failure
+    """
+    size = size or getattr(settings, 'FACE_IMAGE_THUMBNAIL_SIZE', 100)
+
+    try:
+        if image_data is None:
+            with open(os.path.join(settings.MEDIA_ROOT, image_path), 'rb') as f:
+                image_data = f.read()
+
+        image = _decode(image_data)
+        if image is None:
+            return None
+
+        height, width = image.shape[:2]
+        scale = min(1.0, size / max(height, width))
+        thumbnail = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode('.jpg', thumbnail, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        if not ok:
+            return None
+
+        relative_path = thumbnail_path(image_path)
+        _write_atomic(os.path.join(settings.MEDIA_ROOT, relative_path), buffer.tobytes())
+        return relative_path
+
+    except Exception as e:
+        logger.error(f"Error creating thumbnail for {image_path}: {str(e)}")
+        return None
+
+
+def ensure_thumbnail(image_path):
+    """
+    Thumbnail path for a stored image, generating it for images stored
+    before thumbnails existed. Falls back to the image itself.
+    """
+    if not image_path:
+        return None
+
+    relative_path = thumbnail_path(image_path)
+    if os.path.exists(os.path.join(settings.MEDIA_ROOT, relative_path)):
+        return relative_path
+
+    return make_thumbnail(image_path) or image_path
+
+
+def _decode(image_data):
+    return cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def _write_atomic(full_path, data):
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    tmp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, full_path)
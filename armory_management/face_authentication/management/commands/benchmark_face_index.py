@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import time
+import numpy as np
+
+from face_authentication.ann import IVFIndex
+from face_authentication.gallery import GalleryIndex
+
+
+class Command(BaseCommand):
+    help = 'Measure IVF face index recall@k and latency against exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Benchmark on N random embeddings instead of the face records')
+        parser.add_argument('--dim', type=int, default=512, help='Dimension of synthetic embeddings')
+        parser.add_argument('--queries', type=int, default=200, help='Number of query embeddings')
+        parser.add_argument('--k', type=int, default=10, help='Number of neighbours per query')
+        parser.add_argument('--lists', type=int, default=getattr(settings, 'FACE_IVF_LISTS', 256),
+                            help='Number of IVF lists (clusters)')
+        parser.add_argument('--probes', type=str, default='1,4,8,16,32,64',
+                            help='Comma separated n_probe values to test')
+        parser.add_argument('--noise', type=float, default=0.5,
+                            help='Noise added to gallery vectors to build queries')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+
+        if options['synthetic']:
+            ids, matrix = self.synthetic_gallery(rng, options['synthetic'], options['dim'])
+        else:
+            gallery = GalleryIndex()
+            gallery.load()
+            if not len(gallery):
+                raise CommandError('No active face records with embeddings found, use --synthetic')
+            ids, matrix = gallery.snapshot()
+
+        # Queries are perturbed gallery members, like a new capture of an enrolled face
+        sample = rng.choice(len(ids), min(options['queries'], len(ids)), replace=False)
+        queries = matrix[sample] + options['noise'] * rng.normal(size=(len(sample), matrix.shape[1])).astype(np.float32) / np.sqrt(matrix.shape[1])
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        k = options['k']
+
+        start = time.perf_counter()
+        truth = [{match['id'] for match in GalleryIndex.top_k(matrix @ query, ids, k)} for query in queries]
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        start = time.perf_counter()
+        index = IVFIndex(n_lists=options['lists'])
+        index.build(ids, matrix)
+        build_s = time.perf_counter() - start
+
+        self.stdout.write(f'Gallery: {len(ids)} x {matrix.shape[1]}, queries: {len(queries)}, k={k}')
+        self.stdout.write(f'IVF build: {index.n_lists} lists in {build_s:.2f}s')
+        self.stdout.write(f'{"method":<16}{"recall@" + str(k):>12}{"ms/query":>12}')
+        self.stdout.write(f'{"exact":<16}{1.0:>12.4f}{exact_ms:>12.3f}')
+
+        for n_probe in [int(value) for value in options['probes'].split(',') if value]:
+            if n_probe > index.n_lists:
+                continue
+
+            start = time.perf_counter()
+            results = [index.search(query, k=k, n_probe=n_probe) for query in queries]
+            ivf_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            hits = sum(len(expected & {match['id'] for match in found})
+                       for expected, found in zip(truth, results))
+            recall = hits / sum(len(expected) for expected in truth)
+
+            self.stdout.write(f'{"ivf/" + str(n_probe):<16}{recall:>12.4f}{ivf_ms:>12.3f}')
+
+    def synthetic_gallery(self, rng, count, dim):
+        """Clustered random embeddings, roughly like several templates per identity"""
+        identities = max(count // 4, 1)
+        centers = rng.normal(size=(identities, dim)).astype(np.float32)
+        matrix = centers[rng.integers(0, identities, count)] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        return [f'synthetic-{i}' for i in range(count)], matrix
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from face_authentication.ann import IVFIndex
+from face_authentication.gallery import GalleryIndex
+
+
+class Command(BaseCommand):
+    help = 'Train the IVF face index on all active face records and save it to disk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=str, default=None,
+                            help='Index file path (defaults to FACE_IVF_INDEX_PATH)')
+        parser.add_argument('--lists', type=int, default=getattr(settings, 'FACE_IVF_LISTS', 256),
+                            help='Number of IVF lists (clusters)')
+        parser.add_argument('--probe', type=int, default=getattr(settings, 'FACE_IVF_PROBE', 16),
+                            help='Default number of lists scanned per query')
+        parser.add_argument('--iterations', type=int, default=20, help='k-means training iterations')
+
+    def handle(self, *args, **options):
+        output = options['output'] or getattr(settings, 'FACE_IVF_INDEX_PATH', None)
+        if not output:
+            raise CommandError('No output path given and FACE_IVF_INDEX_PATH is not set')
+
+        gallery = GalleryIndex()
+        gallery.load()
+        if not len(gallery):
+            raise CommandError('No active face records with embeddings found')
+
+        ids, matrix = gallery.snapshot()
+
+        start = time.perf_counter()
+        index = IVFIndex(n_lists=options['lists'], n_probe=options['probe'],
+                         train_iterations=options['iterations'])
+        index.build(ids, matrix)
+        index.save(output)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Built IVF index with {len(index)} embeddings in {index.n_lists} lists '
+            f'({elapsed:.1f}s), saved to {output}'
+        ))
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import csv
+import os
+import time
+
+from face_authentication.bulk_enrollment import ArchiveTooLarge, BulkEnrollment, iter_archive, iter_directory
+
+
+class Command(BaseCommand):
+    help = 'Enroll face images from a directory (or zip archive) of files named by personnel id_number'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='Directory or zip archive with images such as 123.jpg or 123_2.jpg')
+        parser.add_argument('--recursive', action='store_true', help='Include images in subdirectories')
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'FACE_BULK_ENROLL_WORKERS', 4),
+                            help='Parallel decode/extraction workers')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Images stored per database transaction')
+        parser.add_argument('--report', type=str, default=None, help='Write the per-file report to this CSV file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if os.path.isdir(path):
+            items = list(iter_directory(path, recursive=options['recursive']))
+        elif os.path.isfile(path) and path.lower().endswith('.zip'):
+            try:
+                items = list(iter_archive(path))
+            except ArchiveTooLarge as e:
+                raise CommandError(str(e))
+        else:
+            raise CommandError(f'"{path}" is not a directory or zip archive')
+
+        if not items:
+            raise CommandError(f'No images found in "{path}"')
+
+        enrollment = BulkEnrollment(workers=options['workers'], device_info='bulk_enroll command')
+        batch_size = options['batch_size']
+
+        start = time.perf_counter()
+        reports = []
+        for offset in range(0, len(items), batch_size):
+            reports.extend(enrollment.run(items[offset:offset + batch_size]))
+            self.stdout.write(f'{len(reports)}/{len(items)} images processed')
+        elapsed = time.perf_counter() - start
+
+        for report in reports:
+            if report['status'] != 'enrolled':
+                self.stdout.write(self.style.ERROR(f"{report['file']}: {report['error']}"))
+
+        if options['report']:
+            with open(options['report'], 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=['file', 'personnel_id', 'status', 'error', 'face_id', 'template_id'])
+                writer.writeheader()
+                writer.writerows(reports)
+            self.stdout.write(f"Report written to {options['report']}")
+
+        enrolled = sum(report['status'] == 'enrolled' for report in reports)
+        style = self.style.SUCCESS if enrolled == len(reports) else self.style.WARNING
+        self.stdout.write(style(
+            f'Enrolled {enrolled} of {len(reports)} images ({len(reports) - enrolled} failed) in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import os
+import time
+
+from face_authentication.image_store import IMAGE_DIR, thumbnail_path
+from face_authentication.models import FaceRecord, FaceTemplate
+
+
+class Command(BaseCommand):
+    help = 'Delete face images and thumbnails that no face record or template references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list what would be deleted')
+        parser.add_argument('--min-age-hours', type=float, default=24,
+                            help='Keep files younger than this, they may belong to a registration in progress')
+
+    def handle(self, *args, **options):
+        referenced = set()
+        for model in (FaceRecord, FaceTemplate):
+            paths = model.objects.exclude(face_image_path='').values_list('face_image_path', flat=True)
+            for path in paths.iterator():
+                referenced.add(os.path.normpath(path))
+                referenced.add(os.path.normpath(thumbnail_path(path)))
+
+        root = os.path.join(settings.MEDIA_ROOT, IMAGE_DIR)
+        if not os.path.isdir(root):
+            self.stdout.write(f'No face image directory at {root}')
+            return
+
+        cutoff = time.time() - options['min_age_hours'] * 3600
+        removed = 0
+        freed = 0
+        kept_recent = 0
+
+        for directory, _, files in os.walk(root, topdown=False):
+            for name in files:
+                full_path = os.path.join(directory, name)
+                relative_path = os.path.normpath(os.path.relpath(full_path, settings.MEDIA_ROOT))
+                if relative_path in referenced:
+                    continue
+
+                try:
+                    stat = os.stat(full_path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime > cutoff:
+                    kept_recent += 1
+                    continue
+
+                removed += 1
+                freed += stat.st_size
+                if options['dry_run']:
+                    self.stdout.write(relative_path)
+                    continue
+
+                try:
+                    os.remove(full_path)
+                except OSError as e:
+                    self.stdout.write(self.style.ERROR(f'Could not delete {relative_path}: {e}'))
+
+            if not options['dry_run'] and directory != root:
+                try:
+                    os.rmdir(directory)  # only succeeds once the directory is empty
+                except OSError:
+                    pass
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {removed} unreferenced files ({freed / 1024 / 1024:.1f} MB), '
+            f'kept {kept_recent} recent unreferenced files'
+        ))
@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import numpy as np
+
+from face_authentication.embeddings import ENCODINGS, decode_embedding, embedding_encoding, encode_embedding
+from face_authentication.models import FaceRecord
+
+
+class Command(BaseCommand):
+    help = 'Convert stored face embeddings to float32, float16 or int8 and report the accuracy impact'
+
+    def add_arguments(self, parser):
+        parser.add_argument('encoding', choices=ENCODINGS, help='Target storage encoding')
+        parser.add_argument('--threshold', type=float,
+                            default=getattr(settings, 'FACE_SIMILARITY_THRESHOLD', 0.6),
+                            help='Verification threshold used to count decision flips')
+        parser.add_argument('--dry-run', action='store_true', help='Only report, do not rewrite rows')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per bulk update')
+        parser.add_argument('--chunk-size', type=int, default=1024, help='Rows per block when scoring pairs')
+
+    def handle(self, *args, **options):
+        encoding = options['encoding']
+
+        face_records = list(FaceRecord.objects.filter(face_embedding__isnull=False).only('id', 'personnel_id', 'face_embedding'))
+
+        self.report(face_records, 'face_embedding', encoding, options)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run, no rows were changed'))
+            return
+
+        converted = self.convert(FaceRecord, face_records, 'face_embedding', encoding, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Converted {converted} embeddings to {encoding}'))
+
+    def report(self, objects, field, encoding, options):
+        """Print storage size, similarity error and decision flips for one table"""
+        label = f'{objects[0]._meta.model_name}.{field}' if objects else field
+        originals = []
+        quantized = []
+        bytes_before = 0
+        bytes_after = 0
+        lossy_sources = 0
+
+        for obj in objects:
+            blob = bytes(getattr(obj, field))
+            vector = decode_embedding(blob)
+            if vector is None or not np.any(vector):
+                continue
+            if embedding_encoding(blob) != 'float32':
+                lossy_sources += 1
+
+            encoded = encode_embedding(vector, encoding)
+            bytes_before += len(blob)
+            bytes_after += len(encoded)
+            originals.append(vector)
+            quantized.append(decode_embedding(encoded))
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{label}: {len(originals)} embeddings'))
+        if not originals:
+            return
+
+        if len({vector.shape[0] for vector in originals}) > 1:
+            self.stdout.write(self.style.ERROR('  Mixed embedding dimensions, skipping accuracy report'))
+            return
+
+        originals = self.normalize(np.vstack(originals))
+        quantized = self.normalize(np.vstack(quantized))
+
+        self.stdout.write(f'  storage: {bytes_before} -> {bytes_after} bytes')
+        if lossy_sources:
+            self.stdout.write(self.style.WARNING(
+                f'  {lossy_sources} rows are already quantized, their error is measured against the decoded values'
+            ))
+
+        reconstruction = np.sum(originals * quantized, axis=1)
+        self.stdout.write(f'  reconstruction cosine: mean {reconstruction.mean():.6f}, min {reconstruction.min():.6f}')
+
+        # A fresh float32 probe is scored against the stored (quantized) gallery
+        threshold = options['threshold']
+        chunk_size = options['chunk_size']
+        pairs = 0
+        error_sum = 0.0
+        error_max = 0.0
+        flips = 0
+        accepted = 0
+        for start in range(0, len(originals), chunk_size):
+            probes = originals[start:start + chunk_size]
+            exact = probes @ originals.T
+            approximate = probes @ quantized.T
+
+            error = np.abs(exact - approximate)
+            pairs += error.size
+            error_sum += float(error.sum())
+            error_max = max(error_max, float(error.max()))
+            flips += int(np.count_nonzero((exact >= threshold) != (approximate >= threshold)))
+            accepted += int(np.count_nonzero(exact >= threshold))
+
+        self.stdout.write(f'  similarity error over {pairs} pairs: mean {error_sum / pairs:.6f}, max {error_max:.6f}')
+        self.stdout.write(
+            f'  decision flips at threshold {threshold}: {flips} of {pairs} pairs '
+            f'({100.0 * flips / pairs:.4f}%), {accepted} pairs accepted with float32'
+        )
+
+    def convert(self, model, objects, field, encoding, batch_size):
+        changed = []
+        for obj in objects:
+            blob = bytes(getattr(obj, field))
+            if not blob or embedding_encoding(blob) == encoding:
+                continue
+            setattr(obj, field, encode_embedding(blob, encoding))
+            changed.append(obj)
+
+        model.objects.bulk_update(changed, [field], batch_size=batch_size)
+        return len(changed)
+
+    @staticmethod
+    def normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from face_authentication.embedding_store import get_embedding_store
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the shared on-disk embedding store from all active face records'
+
+    def handle(self, *args, **options):
+        store = get_embedding_store()
+        if store is None:
+            raise CommandError('FACE_EMBEDDING_STORE_DIR is not set')
+
+        store.rebuild()
+        manifest = store.read_manifest()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Embedding store version {manifest['version']} written to {store.directory} "
+            f"({manifest['rows']} embeddings, {manifest['dimension']} dimensions)"
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from face_authentication.models import WeaponState
+
+
+class Command(BaseCommand):
+    help = 'Recompute the weapon state table from the transaction ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weapon', type=int, action='append', dest='weapon_ids',
+                            help='Only rebuild this weapon (repeatable)')
+
+    def handle(self, *args, **options):
+        written = WeaponState.rebuild(options['weapon_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} weapon states'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from face_authentication.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute the dashboard counters table from scratch'
+
+    def handle(self, *args, **options):
+        corrections = reconcile()
+        for name, (stored, actual) in sorted(corrections.items()):
+            self.stdout.write(f'{name}: {stored} -> {actual}')
+        self.stdout.write(self.style.SUCCESS(f'Reconciled counters, {len(corrections)} corrected'))
@@ -0,0 +1,54 @@
+# Generated by Django 5.2 on 2026-10-19 09:18
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+def copy_embeddings_to_templates(apps, schema_editor):
+    """Every existing face record becomes a record with a single template"""
+    FaceRecord = apps.get_model('face_authentication', 'FaceRecord')
+    FaceTemplate = apps.get_model('face_authentication', 'FaceTemplate')
+
+    templates = [
+        FaceTemplate(
+            face_record_id=record.id,
+            embedding=record.face_embedding,
+            face_image_path=record.face_image_path,
+            captured_at=record.last_updated,
+            source='migration',
+        )
+        for record in FaceRecord.objects.filter(face_embedding__isnull=False).iterator()
+        if record.face_embedding
+    ]
+    FaceTemplate.objects.bulk_create(templates, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_authentication', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceTemplate',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('embedding', models.BinaryField()),
+                ('face_image_path', models.CharField(blank=True, max_length=255)),
+                ('captured_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source', models.CharField(choices=[('kiosk', 'Kiosk'), ('admin', 'Admin'), ('bulk', 'Bulk enrollment'), ('migration', 'Migration')], default='kiosk', max_length=20)),
+                ('device_info', models.CharField(blank=True, max_length=255)),
+                ('metadata', models.JSONField(blank=True, default=dict)),
+                ('face_record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='templates', to='face_authentication.facerecord')),
+            ],
+            options={
+                'verbose_name': 'Царайны загвар',
+                'verbose_name_plural': 'Царайны загварууд',
+                'ordering': ['-captured_at'],
+            },
+        ),
+        migrations.RunPython(copy_embeddings_to_templates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-19 09:22
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_authentication', '0002_facetemplate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistrationJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('personnel_id', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10)),
+                ('image_data', models.BinaryField(blank=True, null=True)),
+                ('source', models.CharField(choices=[('kiosk', 'Kiosk'), ('admin', 'Admin'), ('bulk', 'Bulk enrollment'), ('migration', 'Migration')], default='kiosk', max_length=20)),
+                ('device_info', models.CharField(blank=True, max_length=255)),
+                ('capture_metadata', models.JSONField(blank=True, default=dict)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Царай бүртгэх ажил',
+                'verbose_name_plural': 'Царай бүртгэх ажлууд',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+from django.db import migrations
+from django.utils import timezone
+
+from face_authentication.embeddings import centroid_embedding, decode_embedding, encode_embedding
+
+
+def move_face_encodings(apps, schema_editor):
+    """Keep embeddings that only exist on Personnel as FaceRecord templates"""
+    Personnel = apps.get_model('inventory', 'Personnel')
+    FaceRecord = apps.get_model('face_authentication', 'FaceRecord')
+    FaceTemplate = apps.get_model('face_authentication', 'FaceTemplate')
+
+    encodings = Personnel.objects.filter(face_encoding__isnull=False).values_list('id_number', 'face_encoding')
+    for id_number, face_encoding in encodings.iterator():
+        if not face_encoding:
+            continue
+
+        face_record, _ = FaceRecord.objects.get_or_create(personnel_id=id_number, defaults={'is_active': True})
+        templates = list(FaceTemplate.objects.filter(face_record=face_record).values_list('embedding', flat=True))
+
+        # Registration wrote the same embedding to both tables
+        vector = decode_embedding(face_encoding)
+        if any(bytes(e) == bytes(face_encoding) for e in templates):
+            continue
+        if face_record.face_embedding and decode_embedding(face_record.face_embedding).tobytes() == vector.tobytes():
+            continue
+
+        FaceTemplate.objects.create(
+            face_record=face_record,
+            embedding=bytes(face_encoding),
+            captured_at=timezone.now(),
+            source='migration',
+        )
+        centroid = centroid_embedding(templates + [face_encoding])
+        if centroid is not None:
+            face_record.face_embedding = encode_embedding(centroid)
+            face_record.save(update_fields=['face_embedding', 'last_updated'])
+
+
+def restore_face_encodings(apps, schema_editor):
+    Personnel = apps.get_model('inventory', 'Personnel')
+    FaceRecord = apps.get_model('face_authentication', 'FaceRecord')
+
+    records = FaceRecord.objects.filter(is_active=True, face_embedding__isnull=False).values_list('personnel_id', 'face_embedding')
+    for personnel_id, face_embedding in records.iterator():
+        Personnel.objects.filter(id_number=personnel_id).update(face_encoding=face_embedding)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+        ('face_authentication', '0003_registrationjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_face_encodings, restore_face_encodings),
+    ]
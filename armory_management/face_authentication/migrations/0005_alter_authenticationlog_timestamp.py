@@ -0,0 +1,17 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_authentication', '0004_move_personnel_face_encodings'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='authenticationlog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,26 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_authentication', '0005_alter_authenticationlog_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('personnel_id', models.CharField(db_index=True, max_length=20)),
+                ('action', models.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], max_length=10)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Царайны өөрчлөлт',
+                'verbose_name_plural': 'Царайны өөрчлөлтүүд',
+                'ordering': ['seq'],
+            },
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_authentication', '0006_facechange'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='facerecord',
+            index=models.Index(fields=['last_updated', 'id'], name='face_record_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_weapon_state(apps, schema_editor):
+    """Replay the transaction ledger into one state row per weapon"""
+    Weapon = apps.get_model('inventory', 'Weapon')
+    WeaponTransaction = apps.get_model('face_authentication', 'WeaponTransaction')
+    WeaponState = apps.get_model('face_authentication', 'WeaponState')
+
+    locations = dict(Weapon.objects.values_list('pk', 'location'))
+    states = {}
+    ledger = WeaponTransaction.objects.order_by('timestamp').values_list(
+        'id', 'weapon_id', 'personnel_id', 'transaction_type', 'timestamp'
+    )
+    for transaction_id, weapon_id, personnel_id, transaction_type, timestamp in ledger.iterator(chunk_size=2000):
+        state = states.get(weapon_id)
+        if state is None:
+            state = states[weapon_id] = WeaponState(weapon_id=weapon_id, location=locations.get(weapon_id, 'in'))
+        state.last_transaction_id = transaction_id
+        state.transaction_type = transaction_type
+        state.timestamp = timestamp
+        if transaction_type in ('checkin', 'checkout'):
+            state.location = 'out' if transaction_type == 'checkout' else 'in'
+            state.holder_id = personnel_id if transaction_type == 'checkout' else None
+
+    WeaponState.objects.bulk_create(states.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_authentication', '0008_idempotencyrecord'),
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='weapontransaction',
+            index=models.Index(fields=['weapon', 'timestamp'], name='weapon_tx_weapon_time_idx'),
+        ),
+        migrations.CreateModel(
+            name='WeaponState',
+            fields=[
+                ('weapon', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='state', serialize=False, to='inventory.weapon')),
+                ('transaction_type', models.CharField(choices=[('checkout', 'Гарсан'), ('checkin', 'Орсон'), ('reassign', 'Дахин хуваарилсан')], max_length=20, verbose_name='Төрөл')),
+                ('location', models.CharField(choices=[('in', 'Хадгалагдасан'), ('out', 'Гарсан')], max_length=10, verbose_name='Галт зэвсгийн байршил')),
+                ('timestamp', models.DateTimeField(verbose_name='Огноо')),
+                ('holder', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.personnel', verbose_name='Эзэмшигч')),
+                ('last_transaction', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='face_authentication.weapontransaction')),
+            ],
+            options={
+                'verbose_name': 'Галт зэвсгийн төлөв',
+                'verbose_name_plural': 'Галт зэвсгийн төлөвүүд',
+            },
+        ),
+        migrations.RunPython(backfill_weapon_state, migrations.RunPython.noop),
+    ]
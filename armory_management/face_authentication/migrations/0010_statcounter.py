@@ -0,0 +1,54 @@
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def seed_counters(apps, schema_editor):
+    """Start the counters from the current table contents"""
+    Weapon = apps.get_model('inventory', 'Weapon')
+    Personnel = apps.get_model('inventory', 'Personnel')
+    FaceRecord = apps.get_model('face_authentication', 'FaceRecord')
+    WeaponTransaction = apps.get_model('face_authentication', 'WeaponTransaction')
+    AuthenticationLog = apps.get_model('face_authentication', 'AuthenticationLog')
+    StatCounter = apps.get_model('face_authentication', 'StatCounter')
+
+    values = defaultdict(int)
+    for status, location, count in Weapon.objects.values_list('status', 'location').annotate(count=Count('pk')).order_by():
+        values['weapons.total'] += count
+        values[f'weapons.status.{status}'] += count
+        values[f'weapons.location.{location}'] += count
+    for prefix, model, field in (('personnel', Personnel, 'active_status'), ('face_records', FaceRecord, 'is_active')):
+        for active, count in model.objects.values_list(field).annotate(count=Count('pk')).order_by():
+            values[f'{prefix}.total'] += count
+            if active:
+                values[f'{prefix}.active'] += count
+    for prefix, queryset in (('transactions', WeaponTransaction.objects.all()),
+                             ('auth_failures', AuthenticationLog.objects.filter(result='FAILURE'))):
+        for day, count in queryset.annotate(day=TruncDate('timestamp')).values_list('day').annotate(count=Count('pk')).order_by():
+            values[f'{prefix}.{day.isoformat()}'] = count
+
+    StatCounter.objects.bulk_create([StatCounter(name=name, value=value) for name, value in values.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_authentication', '0009_weaponstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Тоолуур',
+                'verbose_name_plural': 'Тоолуурууд',
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_authentication', '0010_statcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registrationjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
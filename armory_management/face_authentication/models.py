@@ -1,11 +1,16 @@
 # face_authentication/models.py
-from django.db import models
+from django.db import models, transaction
 from inventory.models import Personnel, Weapon
 from django.utils import timezone
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.translation import gettext_lazy as _
+from .embeddings import centroid_embedding, encode_embedding, normalize_embedding
+from .image_store import store_face_image
+import numpy as np
 import os
 import uuid
+from datetime import timedelta
  
 class WeaponTransaction(models.Model):
     TRANSACTION_TYPES = [
@@ -40,24 +45,206 @@ class WeaponTransaction(models.Model):
         ordering = ['-timestamp']
         verbose_name = "Оролт гаралтын бүртгэл"
         verbose_name_plural = "Оролт гаралтын бүртгэлүүд"
+        indexes = [
+            # Latest transaction of a weapon before a point in time
+            models.Index(fields=['weapon', 'timestamp'], name='weapon_tx_weapon_time_idx'),
+        ]
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, weapon_locked=False, **kwargs):
+        # weapon_locked: the caller holds select_for_update on the weapon row,
+        # so the assignment cannot change and needn't be re-read
         original_assignemnt = None
-        if self.weapon.pk and (self.transaction_type in ['checkin', 'checkout']):
-            original_assignemnt = Weapon.objects.get(pk=self.weapon.pk).assigned_to
+        if not weapon_locked and self.weapon.pk and (self.transaction_type in ['checkin', 'checkout']):
+            original_assignemnt = Weapon.objects.filter(pk=self.weapon.pk).values_list('assigned_to', flat=True).first()
 
-        if self.transaction_type == 'reassign':
-            self.weapon.assigned_to = self.pesronnel
-            self.weapon.save()
-    
-        # Save the transaction
-        super().save(*args, **kwargs)
+        # The weapon state and the dashboard counters are updated by post_save
+        # handlers, commit them with the row
+        with transaction.atomic():
+            if self.transaction_type == 'reassign':
+                self.weapon.assigned_to = self.personnel
+                self.weapon.save()
+        
+            # Save the transaction
+            super().save(*args, **kwargs)
 
         if original_assignemnt is not None:
-            current_assignment = Weapon.objects.get(pk=self.weapon.pk).assigned_to
+            current_assignment = Weapon.objects.filter(pk=self.weapon.pk).values_list('assigned_to', flat=True).first()
             if original_assignemnt != current_assignment:
                 raise ValueError(f"Weapon assignment changed during {self.transaction_type} operation. This should not happen!")
 
+class WeaponState(models.Model):
+    """
+    Current state of every weapon, derived from the transaction ledger:
+    its last transaction, the personnel holding it and its location.
+    Maintained in the same database transaction as every WeaponTransaction
+    insert; as_of() answers the same question for a point in the past.
+    """
+    weapon = models.OneToOneField(Weapon, on_delete=models.CASCADE, primary_key=True, related_name='state')
+    last_transaction = models.ForeignKey(WeaponTransaction, on_delete=models.SET_NULL, null=True, related_name='+')
+    transaction_type = models.CharField(max_length=20, choices=WeaponTransaction.TRANSACTION_TYPES, verbose_name=_("Төрөл"))
+    holder = models.ForeignKey(Personnel, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                               verbose_name=_("Эзэмшигч"))
+    location = models.CharField(max_length=10, choices=Weapon.LOCATION_CHOICES, verbose_name=_('Галт зэвсгийн байршил'))
+    timestamp = models.DateTimeField(verbose_name=_("Огноо"))
+    
+    def __str__(self):
+        return f"{self.weapon_id}: {self.location} ({self.timestamp.strftime('%Y-%m-%d %H:%M')})"
+    
+    def apply(self, weapon_transaction):
+        """Move the state forward by a transaction"""
+        from .transactions import LOCATION_AFTER
+        
+        self.last_transaction_id = weapon_transaction.pk
+        self.transaction_type = weapon_transaction.transaction_type
+        self.timestamp = weapon_transaction.timestamp
+        if weapon_transaction.transaction_type in LOCATION_AFTER:
+            # Reassignments change neither location nor holder
+            self.location = LOCATION_AFTER[weapon_transaction.transaction_type]
+            self.holder_id = weapon_transaction.personnel_id if self.location == 'out' else None
+    
+    @classmethod
+    def record(cls, transactions):
+        """
+        Apply newly inserted transactions to the state table. Call it inside
+        the database transaction that inserted them; the state rows are
+        locked, so concurrent inserts for the same weapon apply in turn.
+        Transactions older than a weapon's state are part of its history
+        only and leave the state alone.
+        """
+        transactions = sorted(transactions, key=lambda weapon_transaction: weapon_transaction.timestamp)
+        weapon_ids = {weapon_transaction.weapon_id for weapon_transaction in transactions}
+        states = cls.objects.select_for_update().in_bulk(weapon_ids)
+        
+        created = {}
+        # Where a weapon without a ledger was, until its first checkin or checkout
+        missing = weapon_ids - states.keys()
+        locations = dict(Weapon.objects.filter(pk__in=missing).values_list('pk', 'location')) if missing else {}
+        
+        for weapon_transaction in transactions:
+            weapon_id = weapon_transaction.weapon_id
+            state = states.get(weapon_id)
+            if state is None:
+                state = cls(weapon_id=weapon_id, location=locations.get(weapon_id, 'in'))
+                states[weapon_id] = created[weapon_id] = state
+            elif state.timestamp and weapon_transaction.timestamp < state.timestamp:
+                continue
+            state.apply(weapon_transaction)
+        
+        cls.objects.bulk_create(created.values())
+        updated = [state for weapon_id, state in states.items() if weapon_id not in created]
+        if updated:
+            cls.objects.bulk_update(updated, ['last_transaction', 'transaction_type', 'holder', 'location', 'timestamp'])
+    
+    @classmethod
+    def as_of(cls, timestamp, weapon_ids=None):
+        """
+        State of the weapons at a point in time, from the ledger. Two index
+        lookups per weapon on (weapon, timestamp): the latest transaction,
+        and the latest checkin or checkout for location and holder.
+        
+        Args:
+            timestamp (datetime): Point in time
+            weapon_ids (iterable, optional): Restrict to these weapons
+        
+        Returns:
+            list: Unsaved WeaponState instances, for weapons with at least
+            one transaction up to the timestamp
+        """
+        from .transactions import LOCATION_AFTER
+        
+        ledger = WeaponTransaction.objects.filter(
+            weapon=models.OuterRef('pk'),
+            timestamp__lte=timestamp
+        ).order_by('-timestamp', '-id')
+        
+        weapons = Weapon.objects.all() if weapon_ids is None else Weapon.objects.filter(pk__in=weapon_ids)
+        latest = weapons.annotate(
+            last_id=models.Subquery(ledger.values('id')[:1]),
+            moved_id=models.Subquery(ledger.filter(transaction_type__in=LOCATION_AFTER).values('id')[:1])
+        ).filter(last_id__isnull=False).values_list('pk', 'last_id', 'moved_id')
+        latest = list(latest)
+        
+        transactions = WeaponTransaction.objects.only(
+            'id', 'weapon_id', 'personnel_id', 'transaction_type', 'timestamp'
+        ).in_bulk({transaction_id for row in latest for transaction_id in row[1:] if transaction_id})
+        
+        states = []
+        for weapon_id, last_id, moved_id in latest:
+            # Without a checkin or checkout yet, a weapon is in the armory
+            state = cls(weapon_id=weapon_id, location='in')
+            if moved_id:
+                state.apply(transactions[moved_id])
+            state.apply(transactions[last_id])
+            states.append(state)
+        return states
+    
+    @classmethod
+    def rebuild(cls, weapon_ids=None):
+        """
+        Recompute the state rows from the ledger, e.g. after a transaction
+        was edited or deleted.
+        
+        Returns:
+            int: Number of state rows written
+        """
+        with transaction.atomic():
+            states = cls.as_of(timezone.now(), weapon_ids)
+            stale = cls.objects.exclude(pk__in=[state.weapon_id for state in states])
+            if weapon_ids is not None:
+                stale = stale.filter(pk__in=weapon_ids)
+            stale.delete()
+            cls.objects.bulk_create(
+                states,
+                update_conflicts=True,
+                unique_fields=['weapon'],
+                update_fields=['last_transaction', 'transaction_type', 'holder', 'location', 'timestamp']
+            )
+        return len(states)
+    
+    class Meta:
+        verbose_name = 'Галт зэвсгийн төлөв'
+        verbose_name_plural = 'Галт зэвсгийн төлөвүүд'
+
+class StatCounter(models.Model):
+    """
+    Incrementally maintained counts for the dashboard, so it never has to
+    COUNT(*) the growing tables. Rows are adjusted by counters.py in the
+    same database transaction as the writes they count; daily counters
+    carry the local date in their name, e.g. transactions.2025-01-31.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+    
+    @classmethod
+    def add(cls, deltas):
+        """
+        Adjust counters in place.
+        
+        Args:
+            deltas (dict): Counter name to signed change
+        """
+        # A fixed row order, so concurrent writers cannot deadlock
+        for name in sorted(deltas):
+            delta = deltas[name]
+            if not delta:
+                continue
+            if not cls.objects.filter(name=name).update(value=models.F('value') + delta):
+                cls.objects.bulk_create([cls(name=name)], ignore_conflicts=True)
+                cls.objects.filter(name=name).update(value=models.F('value') + delta)
+    
+    @classmethod
+    def read(cls, *names):
+        """Values of the named counters in one query, 0 for missing ones"""
+        values = dict(cls.objects.filter(name__in=names).values_list('name', 'value'))
+        return {name: values.get(name, 0) for name in names}
+    
+    class Meta:
+        verbose_name = 'Тоолуур'
+        verbose_name_plural = 'Тоолуурууд'
+
 class FaceRegistrationLog(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     personnel = models.ForeignKey(Personnel, on_delete=models.CASCADE, related_name='face_registrations')
@@ -88,30 +275,244 @@ class FaceRecord(models.Model):
     def __str__(self):
         return f"Face Record: {self.personnel_id}"
     
-    def save_face_image(self, image_data):
-        """Save face image to disk and update the path"""
-        # Create directory if it doesn't exist
-        face_dir = os.path.join(settings.MEDIA_ROOT, 'face_images')
-        os.makedirs(face_dir, exist_ok=True)
+    def save(self, *args, **kwargs):
+        # The change log and the dashboard counters are updated by post_save
+        # handlers, commit them with the row
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def add_template(self, embedding, source='kiosk', device_info='', metadata=None, max_templates=None):
+        """
+        Store a new enrollment embedding and refresh the centroid.
+        The oldest templates are dropped once there are more than max_templates.
+        """
+        max_templates = max_templates or getattr(settings, 'FACE_MAX_TEMPLATES', 5)
+        
+        template = FaceTemplate.objects.create(
+            face_record=self,
+            embedding=encode_embedding(embedding),
+            source=source,
+            device_info=device_info[:255],
+            metadata=metadata or {}
+        )
+        
+        stale_ids = list(self.templates.order_by('-captured_at').values_list('id', flat=True)[max_templates:])
+        if stale_ids:
+            FaceTemplate.objects.filter(id__in=stale_ids).delete()
         
-        # Generate filename
-        filename = f"{self.personnel_id}_{uuid.uuid4().hex}.jpg"
-        filepath = os.path.join(face_dir, filename)
+        self.update_centroid()
+        return template
+    
+    def template_embeddings(self):
+        """Normalized template embeddings as rows of a float32 matrix"""
+        embeddings = [normalize_embedding(e) for e in self.templates.values_list('embedding', flat=True)]
+        embeddings = [e for e in embeddings if e is not None]
+        
+        # Records enrolled before templates existed only have the single embedding
+        if not embeddings and self.face_embedding:
+            embedding = normalize_embedding(self.face_embedding)
+            if embedding is not None:
+                embeddings = [embedding]
         
-        # Save image
-        with open(filepath, 'wb') as f:
-            f.write(image_data)
+        if not embeddings:
+            return None
+        return np.vstack(embeddings)
+    
+    def update_centroid(self):
+        """
+        Recompute face_embedding as the normalized mean of all templates.
+        Without templates left the embedding is cleared, the person has to
+        enroll again before they can be verified.
+        """
+        centroid = centroid_embedding(self.templates.values_list('embedding', flat=True))
+        if centroid is None:
+            if not self.face_embedding:
+                return
+            self.face_embedding = None
+        else:
+            self.face_embedding = encode_embedding(centroid)
         
-        # Update path
-        self.face_image_path = os.path.join('face_images', filename)
+        self.save(update_fields=['face_embedding', 'last_updated'])
+    
+    def write_face_image(self, image_data):
+        """Write a face image to the content-addressed store and return its path relative to MEDIA_ROOT"""
+        return store_face_image(image_data)
+    
+    def save_face_image(self, image_data, template=None):
+        """Save face image to disk and update the path"""
+        self.face_image_path = self.write_face_image(image_data)
         self.save(update_fields=['face_image_path'])
+        
+        if template is not None:
+            template.face_image_path = self.face_image_path
+            template.save(update_fields=['face_image_path'])
 
     class Meta:
         db_table = ''
         managed = True
+        indexes = [
+            # Keyset pagination of list_faces
+            models.Index(fields=['last_updated', 'id'], name='face_record_updated_idx'),
+        ]
         verbose_name = 'Царайны бүртгэл'
         verbose_name_plural = 'Царайны бүртгэл'
 
+class FaceTemplate(models.Model):
+    """One enrollment embedding of a face record, with its capture metadata"""
+    SOURCE_CHOICES = [
+        ('kiosk', 'Kiosk'),
+        ('admin', 'Admin'),
+        ('bulk', 'Bulk enrollment'),
+        ('migration', 'Migration'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    face_record = models.ForeignKey(FaceRecord, on_delete=models.CASCADE, related_name='templates')
+    embedding = models.BinaryField()
+    face_image_path = models.CharField(max_length=255, blank=True)
+    captured_at = models.DateTimeField(default=timezone.now)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='kiosk')
+    device_info = models.CharField(max_length=255, blank=True)
+    metadata = models.JSONField(default=dict, blank=True)
+    
+    def __str__(self):
+        return f"Face Template: {self.face_record.personnel_id} ({self.captured_at.strftime('%Y-%m-%d %H:%M')})"
+    
+    class Meta:
+        ordering = ['-captured_at']
+        verbose_name = 'Царайны загвар'
+        verbose_name_plural = 'Царайны загварууд'
+
+class FaceChange(models.Model):
+    """
+    Append-only log of face record changes for incremental kiosk sync.
+    Deactivated and deleted records are logged as 'delete' tombstones.
+    """
+    ACTION_CHOICES = [
+        ('upsert', 'Upsert'),
+        ('delete', 'Delete'),
+    ]
+    
+    seq = models.BigAutoField(primary_key=True)
+    personnel_id = models.CharField(max_length=20, db_index=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    def __str__(self):
+        return f"Face Change {self.seq}: {self.action} {self.personnel_id}"
+    
+    @classmethod
+    def record(cls, face_record):
+        """Log the current state of a face record"""
+        return cls.objects.create(personnel_id=face_record.personnel_id, action=cls.action_for(face_record))
+    
+    @staticmethod
+    def action_for(face_record):
+        return 'upsert' if face_record.is_active and face_record.face_embedding else 'delete'
+    
+    @classmethod
+    def latest_seq(cls):
+        """Sequence number of the latest change, committed or not yet safe to hand out"""
+        return cls.objects.aggregate(seq=models.Max('seq'))['seq'] or 0
+    
+    @classmethod
+    def stamp(cls):
+        """(latest sequence, time of the latest change) of all face records, for conditional GETs"""
+        latest = cls.objects.aggregate(seq=models.Max('seq'), created_at=models.Max('created_at'))
+        return latest['seq'] or 0, latest['created_at']
+    
+    @classmethod
+    def cursor(cls):
+        """
+        Sequence number a client that is fully synced now can continue from.
+        
+        Sequence numbers are assigned at insert but become visible at commit,
+        and registrations run inference inside their transaction, so a lower
+        number can commit well after a higher one. The cursor therefore stops
+        below the first number missing among recent changes, until it commits.
+        A number still missing FACE_CHANGES_MAX_COMMIT_DELAY seconds after the
+        change above it belongs to a rolled back transaction and is passed.
+        """
+        cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'FACE_CHANGES_MAX_COMMIT_DELAY', 600))
+        start = cls.objects.filter(created_at__gte=cutoff).aggregate(start=models.Min('seq'))['start']
+        if start is None:
+            return cls.latest_seq()
+        
+        expected = (cls.objects.filter(seq__lt=start).aggregate(seq=models.Max('seq'))['seq'] or 0) + 1
+        for seq, created_at in cls.objects.filter(seq__gte=start).order_by('seq').values_list('seq', 'created_at').iterator():
+            if seq != expected and created_at >= cutoff:
+                break
+            expected = seq + 1
+        return expected - 1
+    
+    class Meta:
+        ordering = ['seq']
+        verbose_name = 'Царайны өөрчлөлт'
+        verbose_name_plural = 'Царайны өөрчлөлтүүд'
+
+class RegistrationJob(models.Model):
+    """Face registration queued by the asynchronous register endpoint"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    personnel_id = models.CharField(max_length=20)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    image_data = models.BinaryField(null=True, blank=True)
+    source = models.CharField(max_length=20, choices=FaceTemplate.SOURCE_CHOICES, default='kiosk')
+    device_info = models.CharField(max_length=255, blank=True)
+    capture_metadata = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error_message = models.TextField(blank=True)
+    # Times the job was claimed, a job interrupted too often is failed
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Registration Job: {self.personnel_id} ({self.status})"
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Царай бүртгэх ажил'
+        verbose_name_plural = 'Царай бүртгэх ажлууд'
+
+class IdempotencyRecord(models.Model):
+    """
+    Stored response of a request made with an Idempotency-Key header, so a
+    retried request gets the same response without running again
+    """
+    STATUS_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    scope = models.CharField(max_length=150, blank=True)
+    endpoint = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"Idempotency Key {self.endpoint}: {self.key} ({self.status})"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'endpoint', 'key'], name='unique_idempotency_key'),
+        ]
+        verbose_name = 'Давтагдашгүй хүсэлт'
+        verbose_name_plural = 'Давтагдашгүй хүсэлтүүд'
+
 class AuthenticationLog(models.Model):
     """Model to log face authentication attempts"""
     RESULT_CHOICES = [
@@ -122,7 +523,8 @@ class AuthenticationLog(models.Model):
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     personnel_id = models.CharField(max_length=20, null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the attempt happens, not when the buffered writer inserts it
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     result = models.CharField(max_length=10, choices=RESULT_CHOICES)
     confidence_score = models.FloatField(null=True, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
@@ -132,6 +534,11 @@ class AuthenticationLog(models.Model):
     def __str__(self):
         return f"Auth {self.result}: {self.personnel_id} at {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
     
+    def save(self, *args, **kwargs):
+        # Dashboard counters are updated by a post_save handler, commit them with the row
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
     class Meta:
         ordering = ['-timestamp']
         verbose_name = "Баталгаажуулалтын лог"
@@ -0,0 +1,76 @@
+# face_authentication/pagination.py
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that was not produced by encode_cursor"""
+
+
+def encode_cursor(timestamp, pk):
+    """Opaque cursor pointing just after the row with this (timestamp, pk)"""
+    raw = json.dumps([timestamp.isoformat(), str(pk)]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        tuple: (timestamp, pk) encoded in the cursor
+
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, pk = json.loads(raw)
+        timestamp = parse_datetime(timestamp)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if timestamp is None:
+        raise InvalidCursor('Invalid cursor')
+    return timestamp, pk
+
+
+def keyset_page(queryset, field, cursor=None, limit=500):
+    """
+    One page of a queryset ordered by (field, pk).
+
+    Unlike OFFSET pagination every page costs the same index range scan,
+    and rows inserted or updated while a client pages through are neither
+    skipped nor repeated; an updated row moves to the end and shows up
+    again on a later page.
+
+    Args:
+        queryset (QuerySet): Rows to page through
+        field (str): Timestamp field the pages are ordered by
+        cursor (str, optional): next_cursor of the previous page
+        limit (int): Maximum rows per page
+
+    Returns:
+        tuple: (rows, next_cursor) where next_cursor is None on the last page
+    """
+    queryset = queryset.order_by(field, 'pk')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'pk__gt': pk}))
+
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, field), last.pk)
+
+
+def keyset_iterator(queryset, field, cursor=None, chunk_size=500):
+    """Every row after the cursor, fetched one keyset page at a time"""
+    while True:
+        rows, cursor = keyset_page(queryset, field, cursor, chunk_size)
+        yield from rows
+        if cursor is None:
+            return
@@ -0,0 +1,59 @@
+# face_authentication/prefetch.py
+import logging
+
+from django.conf import settings
+from django.core import signing
+
+from .embedding_cache import embedding_cache
+
+logger = logging.getLogger(__name__)
+
+SALT = 'face_authentication.prefetch'
+
+
+def prefetch_assignee(weapon):
+    """
+    Warm the embedding cache for the personnel a weapon is assigned to and
+    issue a token for the transaction that is likely to follow.
+
+    Args:
+        weapon (Weapon): Scanned weapon, with assigned_to loaded
+
+    Returns:
+        str: Prefetch token, or None if the weapon has no assignee or the
+        prefetch failed
+    """
+    personnel = weapon.assigned_to
+    if personnel is None:
+        return None
+
+    try:
+        embedding_cache.prefetch(personnel)
+    except Exception as e:
+        # Only an optimization, the transaction loads what it needs itself
+        logger.warning(f"Embedding prefetch for {personnel.id_number} failed: {str(e)}")
+        return None
+
+    return signing.dumps({'w': weapon.pk, 'q': weapon.qr_code, 'p': personnel.id_number}, salt=SALT)
+
+
+def redeem_prefetch_token(token, qr_code, personnel_id):
+    """
+    Weapon id named by a prefetch token, if the token is valid, recent
+    (FACE_PREFETCH_TOKEN_TTL seconds) and issued for this QR code and
+    personnel.
+
+    Returns:
+        Weapon primary key, or None if the caller has to look it up itself
+    """
+    if not token:
+        return None
+
+    try:
+        payload = signing.loads(token, salt=SALT, max_age=getattr(settings, 'FACE_PREFETCH_TOKEN_TTL', 120))
+    except signing.BadSignature:
+        return None
+
+    if payload.get('q') != qr_code or payload.get('p') != personnel_id:
+        return None
+    return payload.get('w')
@@ -0,0 +1,227 @@
+# face_authentication/registration.py
+import base64
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class RegistrationError(Exception):
+    """Registration failure that maps to an API error response"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def decode_face_image(face_image_b64):
+    """Decode a base64 image, with or without a data URL prefix"""
+    # Remove data URL prefix if present
+    if ',' in face_image_b64:
+        face_image_b64 = face_image_b64.split(',')[1]
+
+    return base64.b64decode(face_image_b64)
+
+
+def register_face_image(personnel_id, face_image_data, source='kiosk', device_info='', metadata=None, client=None):
+    """
+    Extract the embedding of a face image and store it as a new template.
+
+    Args:
+        personnel_id (str): Personnel id_number
+        face_image_data (bytes): Encoded image
+        source (str): FaceTemplate source
+        device_info (str): Client user agent
+        metadata (dict, optional): Capture conditions reported by the client
+        client (ArcFaceClient, optional): Client used for extraction
+
+    Returns:
+        dict: face_id, template_id, template_count and created
+
+    Raises:
+        RegistrationError: If the personnel is unknown or no face was found
+    """
+    from inventory.models import Personnel
+    from .arcface_client import ArcFaceClient
+    from .models import FaceRecord
+
+    # Check if personnel exists
+    if not Personnel.objects.filter(id_number=personnel_id).exists():
+        logger.error(f"Personnel with ID {personnel_id} not found")
+        raise RegistrationError('Personnel ID not found in the system', status_code=404)
+
+    # Extract face embeddings using ArcFace
+    client = client or ArcFaceClient()
+    result = client.extract_embeddings(face_image_data)
+
+    if 'error' in result or result.get('status') == 'ERROR':
+        raise RegistrationError(result.get('error', 'Failed to extract face embeddings'))
+
+    embedding_bytes = result.get('embedding_bytes')
+    if not embedding_bytes:
+        raise RegistrationError('No face embedding generated')
+
+    # Create the face record on first enrollment
+    face_record, created = FaceRecord.objects.get_or_create(
+        personnel_id=personnel_id,
+        defaults={'is_active': True}
+    )
+
+    if not face_record.is_active:
+        face_record.is_active = True
+        face_record.save(update_fields=['is_active', 'last_updated'])
+
+    # Add the embedding as another template instead of overwriting
+    template = face_record.add_template(
+        embedding_bytes,
+        source=source,
+        device_info=device_info,
+        metadata=metadata if isinstance(metadata, dict) else {}
+    )
+
+    # Save the face image
+    face_record.save_face_image(face_image_data, template=template)
+
+    return {
+        'face_id': str(face_record.id),
+        'template_id': str(template.id),
+        'template_count': face_record.templates.count(),
+        'created': created
+    }
+
+
+class RegistrationWorker:
+    """
+    Background pool that processes queued RegistrationJobs.
+
+    Jobs are claimed with a conditional UPDATE, so a job is only processed
+    once even if several workers resume the same pending jobs. A job still
+    running after ``job_timeout`` seconds belonged to a process that died;
+    resume() queues it again, or fails it after ``max_attempts`` claims.
+    """
+
+    def __init__(self, max_workers=None, job_timeout=None, max_attempts=None):
+        self.max_workers = max_workers or getattr(settings, 'FACE_REGISTRATION_WORKERS', 2)
+        self.job_timeout = job_timeout or getattr(settings, 'FACE_REGISTRATION_JOB_TIMEOUT', 600)
+        self.max_attempts = max_attempts or getattr(settings, 'FACE_REGISTRATION_MAX_ATTEMPTS', 2)
+        self._executor = None
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='face-registration'
+                )
+            return self._executor
+
+    @property
+    def client(self):
+        # One client (and HTTP session) shared by the pool threads
+        with self._lock:
+            if self._client is None:
+                from .arcface_client import ArcFaceClient
+                self._client = ArcFaceClient()
+            return self._client
+
+    def submit(self, job_id):
+        """Queue a job once the transaction that created it has committed"""
+        transaction.on_commit(lambda: self.executor.submit(self.run, job_id))
+
+    def recover_interrupted(self):
+        """
+        Put jobs whose process died while running them back in the queue.
+
+        Returns:
+            tuple: (requeued, failed) job counts
+        """
+        from .models import RegistrationJob
+
+        now = timezone.now()
+        stale = RegistrationJob.objects.filter(status='running', started_at__lt=now - timedelta(seconds=self.job_timeout))
+        failed = stale.filter(attempts__gte=self.max_attempts).update(
+            status='failed',
+            error_message='Face registration was interrupted, please register again',
+            image_data=None,
+            finished_at=now
+        )
+        requeued = stale.filter(attempts__lt=self.max_attempts).update(status='pending', started_at=None)
+        if requeued or failed:
+            logger.warning(f"Recovered interrupted registration jobs: {requeued} requeued, {failed} failed")
+        return requeued, failed
+
+    def resume(self):
+        """Queue jobs left pending or running by a previous process, e.g. at worker startup"""
+        def resume_task():
+            from .models import RegistrationJob
+            try:
+                self.recover_interrupted()
+                job_ids = list(RegistrationJob.objects.filter(status='pending').values_list('id', flat=True))
+                for job_id in job_ids:
+                    self.executor.submit(self.run, job_id)
+                if job_ids:
+                    logger.info(f"Resumed {len(job_ids)} pending registration jobs")
+            except Exception as e:
+                logger.error(f"Error resuming registration jobs: {str(e)}")
+            finally:
+                close_old_connections()
+
+        threading.Thread(target=resume_task, name='face-registration-resume', daemon=True).start()
+
+    def run(self, job_id):
+        """Process one job"""
+        from .models import RegistrationJob
+
+        try:
+            claimed = RegistrationJob.objects.filter(id=job_id, status='pending').update(
+                status='running',
+                started_at=timezone.now(),
+                attempts=F('attempts') + 1
+            )
+            if not claimed:
+                return
+
+            job = RegistrationJob.objects.get(id=job_id)
+            try:
+                result = register_face_image(
+                    job.personnel_id,
+                    bytes(job.image_data),
+                    source=job.source,
+                    device_info=job.device_info,
+                    metadata=job.capture_metadata,
+                    client=self.client
+                )
+                job.status = 'succeeded'
+                job.result = result
+            except RegistrationError as e:
+                job.status = 'failed'
+                job.error_message = e.message
+            except Exception as e:
+                logger.error(f"Registration job {job_id} failed: {str(e)}")
+                job.status = 'failed'
+                job.error_message = f'Face registration failed: {str(e)}'
+
+            # The image is on disk now (or was rejected), don't keep it twice
+            job.image_data = None
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'result', 'error_message', 'image_data', 'finished_at'])
+
+        except Exception as e:
+            logger.error(f"Error running registration job {job_id}: {str(e)}")
+        finally:
+            close_old_connections()
+
+
+# Shared worker pool for the Django process
+registration_worker = RegistrationWorker()
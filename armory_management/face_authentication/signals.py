@@ -1,10 +1,106 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import WeaponTransaction
+from inventory.models import Personnel, Weapon
+from .models import AuthenticationLog, WeaponTransaction, WeaponState, FaceChange, FaceRecord, FaceTemplate
+from . import counters
+from .embedding_cache import embedding_cache
+from .gallery import gallery
+from .transactions import transactions_committed
+from .weapon_cache import weapon_cache
 
 @receiver(post_save, sender=WeaponTransaction)
 def transaction_saved(sender, instance, created, **kwargs):
     """Handle transaction save events for real-time updates"""
-    # This signal is just a placeholder - we'll use SSE for real-time updates
-    # No additional code needed here since we're checking for updates in the SSE view
-    pass
\ No newline at end of file
+    # Real-time updates are served by the SSE view, the weapon state is
+    # kept in the same database transaction as the ledger
+    weapon_id = instance.weapon_id
+    if created:
+        WeaponState.record([instance])
+        transaction.on_commit(lambda: weapon_cache.invalidate_weapons([weapon_id]))
+    else:
+        # An edited transaction may have been anywhere in the history
+        WeaponState.rebuild([weapon_id])
+
+@receiver(post_delete, sender=WeaponTransaction)
+def transaction_deleted(sender, instance, **kwargs):
+    """Fall back to the weapon's previous transaction"""
+    WeaponState.rebuild([instance.weapon_id])
+
+@receiver(transactions_committed)
+def transactions_bulk_committed(sender, weapons, **kwargs):
+    """Bulk written transactions send no post_save"""
+    weapon_cache.invalidate_weapons([weapon.pk for weapon in weapons])
+
+@receiver(post_save, sender=Weapon)
+@receiver(post_delete, sender=Weapon)
+def weapon_changed(sender, instance, **kwargs):
+    """Drop cached weapon snapshots, also under a previous QR code"""
+    pk = instance.pk
+    qr_code = instance.qr_code
+    transaction.on_commit(lambda: weapon_cache.invalidate_where(
+        lambda entry: entry.pk == pk or entry.qr_code == qr_code
+    ))
+
+@receiver(post_save, sender=FaceRecord)
+def face_record_saved(sender, instance, update_fields=None, **kwargs):
+    """Keep the in-memory face gallery in sync with saved face records"""
+    # Image path updates don't change what the gallery holds
+    if update_fields and not {'face_embedding', 'is_active'} & set(update_fields):
+        return
+
+    # Logged in the same transaction as the change itself
+    FaceChange.record(instance)
+
+    personnel_id = instance.personnel_id
+    transaction.on_commit(lambda: embedding_cache.invalidate(personnel_id))
+    transaction.on_commit(lambda: gallery.sync_record(instance))
+
+@receiver(post_delete, sender=FaceRecord)
+def face_record_deleted(sender, instance, **kwargs):
+    """Drop deleted face records from the in-memory face gallery"""
+    personnel_id = instance.personnel_id
+    FaceChange.objects.create(personnel_id=personnel_id, action='delete')
+    transaction.on_commit(lambda: embedding_cache.invalidate(personnel_id))
+    transaction.on_commit(lambda: gallery.remove(personnel_id))
+
+@receiver(post_save, sender=FaceTemplate)
+@receiver(post_delete, sender=FaceTemplate)
+def face_template_changed(sender, instance, **kwargs):
+    """Drop cached templates of the face record the template belongs to"""
+    face_record_id = instance.face_record_id
+    transaction.on_commit(lambda: embedding_cache.invalidate_where(
+        lambda entry: entry.face_record_id == face_record_id
+    ))
+
+@receiver(post_save, sender=Personnel)
+@receiver(post_delete, sender=Personnel)
+def personnel_changed(sender, instance, **kwargs):
+    """Drop cached personnel snapshots, also under a previous id_number"""
+    pk = instance.pk
+    id_number = instance.id_number
+    transaction.on_commit(lambda: embedding_cache.invalidate_where(
+        lambda entry: entry.personnel_id == id_number or (entry.personnel and entry.personnel.pk == pk)
+    ))
+    transaction.on_commit(lambda: weapon_cache.invalidate_where(
+        lambda entry: entry.assigned_to is not None and entry.assigned_to.pk == pk
+    ))
+
+def counted_instance_loaded(sender, instance, **kwargs):
+    counters.track(instance)
+
+def counted_instance_saving(sender, instance, raw=False, **kwargs):
+    counters.load_tracked(instance)
+
+def counted_instance_saved(sender, instance, created, **kwargs):
+    """Counters change in the same database transaction as the row"""
+    counters.count_saved(instance, created)
+
+def counted_instance_deleted(sender, instance, **kwargs):
+    counters.count_deleted(instance)
+
+for counted_model in (Weapon, Personnel, FaceRecord, WeaponTransaction, AuthenticationLog):
+    post_init.connect(counted_instance_loaded, sender=counted_model)
+    pre_save.connect(counted_instance_saving, sender=counted_model)
+    post_save.connect(counted_instance_saved, sender=counted_model)
+    post_delete.connect(counted_instance_deleted, sender=counted_model)
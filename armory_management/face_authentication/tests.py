@@ -1,3 +1,1815 @@
-from django.test import TestCase
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from armory_management.middleware import CompressionMiddleware
+from dashboard import stats
+from dashboard.stats import StatsSnapshot, collect_stats
+from inventory.models import Personnel, Regiment, Weapon
+from . import registration, views, views_transaction
+from .admission import AdmissionController, AdmissionRejected, admission_control
+from .ann import IVFIndex
+from .arcface_client import ArcFaceClient
+from .auth_log import AuthenticationLogWriter, auth_log_writer
+from .batch_transactions import BatchTransaction
+from .bulk_enrollment import ArchiveTooLarge, iter_archive
+from .coalescing import FlightTimeout, SingleFlight, coalesce_requests, verification_flight
+from .counters import compute_counters, reconcile
+from .embedding_cache import EmbeddingCache, embedding_cache
+from .embedding_export import export_records, parse_export
+from .embedding_store import EmbeddingStore
+from .embeddings import decode_embedding, embedding_encoding, encode_embedding, normalize_embedding
+from .gallery import GalleryIndex
+from .image_store import content_path, ensure_thumbnail, store_face_image, thumbnail_path
+from .models import AuthenticationLog, FaceChange, FaceRecord, RegistrationJob, StatCounter, WeaponState, WeaponTransaction
+from .prefetch import prefetch_assignee, redeem_prefetch_token
+from .registration import RegistrationWorker
+from .transactions import TransactionRejected, commit_transaction
+from .weapon_cache import weapon_cache
+
+FACE_IMAGE = base64.b64encode(b'face image').decode('ascii')
+
+VERIFIED = {'verified': True, 'status': 'SUCCESS', 'confidence': 0.9}
+
+
+def unit_embedding(seed):
+    embedding = np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+
+@override_settings(FACE_AUTH_LOG_ASYNC=False)
+class ArmoryTestCase(TestCase):
+    """Two enrolled personnel and a weapon assigned to the first"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('operator', password='operator')
+        regiment = Regiment.objects.create(regiment_id='01', regiment_type='Танк')
+        cls.personnel = Personnel.objects.create(id_number='101', first_name='Бат', last_name='Дорж', regiment=regiment)
+        cls.other_personnel = Personnel.objects.create(id_number='102', first_name='Болд', last_name='Сүх', regiment=regiment)
+        for seed, personnel in enumerate((cls.personnel, cls.other_personnel)):
+            FaceRecord.objects.create(
+                personnel_id=personnel.id_number,
+                face_embedding=encode_embedding(unit_embedding(seed)),
+                is_active=True
+            )
+        cls.weapon = Weapon.objects.create(
+            serial_number='A00001', bolt_number='B00001', case_number='C00001',
+            weapon_model='АКМ', assigned_to=cls.personnel
+        )
+
+    def setUp(self):
+        # Process-wide caches outlive the test transactions
+        embedding_cache.clear()
+        weapon_cache.clear()
+        verification_flight._calls.clear()
+        self.client.force_login(self.user)
+
+    def transaction_request(self, personnel_id='101', transaction_type='check_out', **extra):
+        return self.client.post('/api/face/weapon/transaction/', {
+            'personnel_id': personnel_id,
+            'face_image': FACE_IMAGE,
+            'qr_code': self.weapon.qr_code,
+            'transaction_type': transaction_type,
+            **extra.pop('data', {})
+        }, content_type='application/json', **extra)
+
+
+@mock.patch.object(views_transaction.arcface_client, 'verify_templates', return_value=VERIFIED)
+class WeaponTransactionTests(ArmoryTestCase):
+
+    def test_checkout_records_transaction(self, verify_templates):
+        response = self.transaction_request()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['transaction_success'])
+        self.weapon.refresh_from_db()
+        self.assertEqual(self.weapon.location, 'out')
+        self.assertEqual(WeaponTransaction.objects.filter(weapon=self.weapon, transaction_type='checkout').count(), 1)
+
+    @override_settings(FACE_AUTH_LOG_ASYNC=True)
+    def test_transaction_log_is_written_before_the_transaction(self, verify_templates):
+        with mock.patch.object(auth_log_writer, '_ensure_thread'):
+            self.transaction_request()
+
+        weapon_transaction = WeaponTransaction.objects.select_related('auth_log').get(weapon=self.weapon)
+        self.assertEqual(weapon_transaction.auth_log.result, 'SUCCESS')
+        self.assertEqual(auth_log_writer.pending(), 0)
+
+    def test_rejected_transaction_changes_nothing(self, verify_templates):
+        Weapon.objects.filter(pk=self.weapon.pk).update(location='out')
+
+        response = self.transaction_request()
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertTrue(body['verified'])
+        self.assertFalse(body['transaction_success'])
+        self.assertIn('already checked out', body['message'])
+        self.assertFalse(WeaponTransaction.objects.exists())
+        # The verification itself is still logged
+        self.assertEqual(AuthenticationLog.objects.filter(personnel_id='101', result='SUCCESS').count(), 1)
+
+    def test_failed_commit_returns_failure_body(self, verify_templates):
+        with mock.patch.object(views_transaction, 'commit_transaction', side_effect=RuntimeError('database went away')):
+            response = self.transaction_request()
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertFalse(body['transaction_success'])
+        self.assertIn('database went away', body['message'])
+        self.assertNotIn('weapon_info', body)
+        self.assertFalse(WeaponTransaction.objects.exists())
+        self.assertEqual(AuthenticationLog.objects.filter(personnel_id='101').count(), 1)
+        self.weapon.refresh_from_db()
+        self.assertEqual(self.weapon.location, 'in')
+
+
+class CommitTransactionTests(ArmoryTestCase):
+
+    def commit(self, transaction_type='checkout', personnel=None, **kwargs):
+        return commit_transaction(
+            self.weapon.pk, personnel or self.personnel, transaction_type,
+            {'personnel_id': '101', 'result': 'SUCCESS', 'confidence_score': 0.9}, **kwargs
+        )
+
+    def assertNothingWritten(self):
+        self.assertFalse(AuthenticationLog.objects.exists())
+        self.assertFalse(WeaponTransaction.objects.exists())
+        self.weapon.refresh_from_db()
+        self.assertEqual(self.weapon.location, 'in')
+
+    def test_checkout_and_checkin_move_the_weapon(self):
+        weapon_transaction, weapon = self.commit(qr_code=self.weapon.qr_code)
+
+        self.assertEqual(weapon.location, 'out')
+        self.assertEqual(weapon_transaction.auth_log.confidence_score, 0.9)
+        self.assertEqual(Weapon.objects.get(pk=self.weapon.pk).location, 'out')
+
+        _, weapon = self.commit('checkin')
+        self.assertEqual(weapon.location, 'in')
+        self.assertEqual(WeaponTransaction.objects.count(), 2)
+
+    def test_weapon_row_is_locked(self):
+        with mock.patch.object(Weapon.objects, 'select_for_update', wraps=Weapon.objects.select_for_update) as lock:
+            self.commit()
+
+        lock.assert_called_once_with()
+
+    def test_state_is_checked_against_the_locked_row(self):
+        # The caller's copy still says 'in', the database already says 'out'
+        Weapon.objects.filter(pk=self.weapon.pk).update(location='out')
+
+        with self.assertRaisesMessage(TransactionRejected, 'already checked out'):
+            self.commit()
+        self.assertFalse(WeaponTransaction.objects.exists())
+
+    def test_invalid_transactions_are_rejected(self):
+        Weapon.objects.filter(pk=self.weapon.pk).update(status='maintenance')
+        with self.assertRaisesMessage(TransactionRejected, 'maintenance'):
+            self.commit()
+        Weapon.objects.filter(pk=self.weapon.pk).update(status='assigned')
+
+        for transaction_type, personnel, message in (
+            ('checkin', None, 'already checked in'),
+            ('checkout', self.other_personnel, 'assigned to different personnel'),
+            ('repair', None, 'Unknown transaction type'),
+        ):
+            with self.subTest(transaction_type=transaction_type):
+                with self.assertRaisesMessage(TransactionRejected, message):
+                    self.commit(transaction_type, personnel)
+
+        self.assertNothingWritten()
+
+    def test_weapon_with_another_qr_code_is_not_found(self):
+        with self.assertRaises(Weapon.DoesNotExist):
+            self.commit(qr_code='WPN-OLD')
+
+        self.assertNothingWritten()
+
+    def test_failed_insert_rolls_back_the_log(self):
+        with mock.patch.object(WeaponTransaction, 'save', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                self.commit()
+
+        self.assertNothingWritten()
+
+
+def embedding_b64(seed):
+    return base64.b64encode(unit_embedding(seed).tobytes()).decode('ascii')
+
+
+class BatchTransactionTests(ArmoryTestCase):
+
+    def batch(self, items):
+        return self.client.post('/api/face/weapon/transaction/batch/', {'items': items}, content_type='application/json')
+
+    def item(self, transaction_type='check_out', seed=0, **fields):
+        return {'qr_code': self.weapon.qr_code, 'personnel_id': '101', 'transaction_type': transaction_type,
+                'embedding': embedding_b64(seed), **fields}
+
+    def test_items_are_applied_in_order(self):
+        body = self.batch([self.item('check_out'), self.item('check_in'), self.item('check_in')]).json()
+
+        self.assertEqual((body['count'], body['succeeded']), (3, 2))
+        self.assertEqual([result['weapon_location'] for result in body['results']], ['out', 'in', None])
+        self.assertIn('already checked in', body['results'][2]['message'])
+        self.assertEqual(Weapon.objects.get(pk=self.weapon.pk).location, 'in')
+        self.assertEqual(
+            list(WeaponTransaction.objects.order_by('timestamp').values_list('transaction_type', flat=True)),
+            ['checkout', 'checkin']
+        )
+        # The rejected item was still verified
+        self.assertEqual(AuthenticationLog.objects.filter(result='SUCCESS').count(), 3)
+
+    def test_each_item_gets_its_own_result(self):
+        body = self.batch([
+            self.item(embedding=None),
+            self.item('reassign'),
+            self.item(qr_code='WPN-UNKNOWN'),
+            self.item(personnel_id='999'),
+            self.item(seed=1),
+            self.item(embedding='not base64!'),
+        ]).json()
+
+        messages = [result['message'] for result in body['results']]
+        self.assertEqual(body['succeeded'], 0)
+        self.assertIn('required', messages[0])
+        self.assertIn('not supported', messages[1])
+        self.assertIn('Weapon not found', messages[2])
+        self.assertIn('Personnel not found', messages[3])
+        self.assertEqual(messages[4], 'Face verification failed')
+        self.assertIn('base64', messages[5])
+        self.assertEqual([result['index'] for result in body['results']], list(range(6)))
+        self.assertEqual(sorted(AuthenticationLog.objects.values_list('result', flat=True)), ['FAILURE', 'FAILURE'])
+        self.assertFalse(WeaponTransaction.objects.exists())
+
+    def test_images_are_extracted_in_one_call(self):
+        other_weapon = Weapon.objects.create(
+            serial_number='A00002', bolt_number='B00002', case_number='C00002',
+            weapon_model='АКМ', assigned_to=self.other_personnel
+        )
+        extractions = [{'embedding_array': unit_embedding(0)}, {'error': 'No face detected'}]
+
+        with mock.patch.object(views_transaction.arcface_client, 'extract_embeddings_batch', return_value=extractions) as extract:
+            body = self.batch([
+                self.item(embedding=None, face_image=FACE_IMAGE),
+                self.item(embedding=None, face_image=FACE_IMAGE, qr_code=other_weapon.qr_code, personnel_id='102'),
+            ]).json()
+
+        extract.assert_called_once_with([b'face image', b'face image'])
+        self.assertEqual([result['transaction_success'] for result in body['results']], [True, False])
+        self.assertEqual(body['results'][1]['message'], 'No face detected')
+        self.assertEqual(AuthenticationLog.objects.get(personnel_id='102').result, 'ERROR')
+
+    def test_failed_commit_still_logs_the_verifications(self):
+        with mock.patch.object(WeaponTransaction.objects, 'bulk_create', side_effect=DatabaseError('disk full')):
+            body = self.batch([self.item('check_out'), self.item(seed=1)]).json()
+
+        self.assertEqual(body['succeeded'], 0)
+        self.assertIn('Transaction processing error', body['results'][0]['message'])
+        self.assertEqual(sorted(AuthenticationLog.objects.values_list('result', flat=True)), ['FAILURE', 'SUCCESS'])
+        self.assertEqual(Weapon.objects.get(pk=self.weapon.pk).location, 'in')
+
+    @override_settings(FACE_BATCH_TRANSACTION_MAX_ITEMS=2)
+    def test_malformed_batches_are_rejected(self):
+        self.assertEqual(self.batch([]).status_code, 400)
+        self.assertEqual(self.batch([self.item()] * 3).status_code, 400)
+
+
+class WeaponStateTests(ArmoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.start = timezone.now() - timedelta(hours=3)
+
+    def ledger(self, hours, transaction_type, personnel=None):
+        return WeaponTransaction.objects.create(
+            weapon=self.weapon, personnel=personnel or self.personnel,
+            transaction_type=transaction_type, timestamp=self.start + timedelta(hours=hours)
+        )
+
+    def state(self):
+        state = WeaponState.objects.get(weapon=self.weapon)
+        return state.location, state.holder_id, state.transaction_type
+
+    def test_state_follows_the_ledger(self):
+        checkout = self.ledger(0, 'checkout')
+        self.assertEqual(self.state(), ('out', self.personnel.pk, 'checkout'))
+        self.assertEqual(WeaponState.objects.get(weapon=self.weapon).last_transaction, checkout)
+
+        # A reassignment changes neither location nor holder
+        self.ledger(1, 'reassign', self.other_personnel)
+        self.assertEqual(self.state(), ('out', self.personnel.pk, 'reassign'))
+
+        self.ledger(2, 'checkin', self.other_personnel)
+        self.assertEqual(self.state(), ('in', None, 'checkin'))
+
+    def test_backdated_transaction_only_joins_the_history(self):
+        self.ledger(2, 'checkin')
+        self.ledger(1, 'checkout')
+
+        self.assertEqual(self.state(), ('in', None, 'checkin'))
+        state, = WeaponState.as_of(self.start + timedelta(hours=1, minutes=30))
+        self.assertEqual((state.location, state.holder_id), ('out', self.personnel.pk))
+
+    def test_as_of_reconstructs_past_states(self):
+        self.ledger(0, 'checkout')
+        self.ledger(1, 'reassign', self.other_personnel)
+        self.ledger(2, 'checkin', self.other_personnel)
+
+        self.assertEqual(WeaponState.as_of(self.start - timedelta(minutes=1)), [])
+        for hours, expected in ((0.5, ('out', self.personnel.pk, 'checkout')),
+                                (1.5, ('out', self.personnel.pk, 'reassign')),
+                                (2.5, ('in', None, 'checkin'))):
+            with self.subTest(hours=hours):
+                state, = WeaponState.as_of(self.start + timedelta(hours=hours), [self.weapon.pk])
+                self.assertEqual((state.location, state.holder_id, state.transaction_type), expected)
+
+    def test_rebuild_repairs_and_drops_states(self):
+        checkout = self.ledger(0, 'checkout')
+        WeaponState.objects.filter(weapon=self.weapon).update(location='in', holder=None)
+
+        self.assertEqual(WeaponState.rebuild(), 1)
+        self.assertEqual(self.state(), ('out', self.personnel.pk, 'checkout'))
+
+        # Deleting the only transaction leaves no ledger for the weapon
+        checkout.delete()
+        self.assertFalse(WeaponState.objects.exists())
+
+    def test_edited_transaction_is_rebuilt(self):
+        self.ledger(0, 'checkout')
+        checkin = self.ledger(1, 'checkin')
+
+        checkin.timestamp = self.start - timedelta(hours=1)
+        checkin.save()
+
+        self.assertEqual(self.state(), ('out', self.personnel.pk, 'checkout'))
+
+    def test_state_endpoint(self):
+        self.ledger(0, 'checkout')
+        self.ledger(2, 'checkin')
+
+        now = self.client.get('/api/face/weapon/state/').json()
+        then = self.client.get('/api/face/weapon/state/', {
+            'as_of': (self.start + timedelta(hours=1)).isoformat(), 'weapon_id': self.weapon.pk
+        }).json()
+
+        self.assertEqual([(weapon['location'], weapon['holder']) for weapon in now['weapons']], [('in', None)])
+        self.assertEqual([(weapon['location'], weapon['holder']) for weapon in then['weapons']], [('out', '101')])
+        self.assertEqual(self.client.get('/api/face/weapon/state/', {'as_of': 'yesterday'}).status_code, 400)
+
+
+class PrefetchTokenTests(ArmoryTestCase):
+
+    def test_token_names_the_scanned_weapon(self):
+        token = prefetch_assignee(self.weapon)
+
+        self.assertEqual(redeem_prefetch_token(token, self.weapon.qr_code, '101'), self.weapon.pk)
+
+    def test_token_for_other_qr_code_or_personnel_is_ignored(self):
+        token = prefetch_assignee(self.weapon)
+
+        self.assertIsNone(redeem_prefetch_token(token, 'WPN-OTHER', '101'))
+        self.assertIsNone(redeem_prefetch_token(token, self.weapon.qr_code, '102'))
+        self.assertIsNone(redeem_prefetch_token(token + 'x', self.weapon.qr_code, '101'))
+        self.assertIsNone(redeem_prefetch_token(None, self.weapon.qr_code, '101'))
+
+    @mock.patch.object(views_transaction.arcface_client, 'verify_templates', return_value=VERIFIED)
+    def test_mismatched_token_falls_back_to_qr_code(self, verify_templates):
+        other_weapon = Weapon.objects.create(
+            serial_number='A00002', bolt_number='B00002', case_number='C00002', weapon_model='АКМ'
+        )
+        token = prefetch_assignee(self.weapon)
+
+        # A token issued for another weapon must not redirect the transaction
+        response = self.client.post('/api/face/weapon/transaction/', {
+            'personnel_id': '102',
+            'face_image': FACE_IMAGE,
+            'qr_code': other_weapon.qr_code,
+            'transaction_type': 'check_out',
+            'prefetch_token': token
+        }, content_type='application/json')
+
+        self.assertTrue(response.json()['transaction_success'])
+        self.assertFalse(WeaponTransaction.objects.filter(weapon=self.weapon).exists())
+        self.assertTrue(WeaponTransaction.objects.filter(weapon=other_weapon, personnel=self.other_personnel).exists())
+
+
+class CoalescingTests(ArmoryTestCase):
+
+    def verify_request(self, personnel_id, idempotency_key='k1'):
+        return self.client.post('/api/face/verify/', {
+            'personnel_id': personnel_id,
+            'face_image': FACE_IMAGE
+        }, content_type='application/json', HTTP_IDEMPOTENCY_KEY=idempotency_key)
+
+    def test_reused_idempotency_key_with_other_payload_is_not_coalesced(self):
+        results = [VERIFIED, {'verified': False, 'status': 'FAILURE', 'confidence': 0.2}]
+        with mock.patch.object(views.arcface_client, 'verify_templates', side_effect=results) as verify_templates:
+            first = self.verify_request('101')
+            # Same image and key, but claimed for another personnel
+            second = self.verify_request('102')
+
+        self.assertTrue(first.json()['verified'])
+        self.assertFalse(second.json()['verified'])
+        self.assertFalse(second.has_header('X-Coalesced'))
+        self.assertEqual(verify_templates.call_count, 2)
+
+    def test_identical_requests_share_one_verification(self):
+        with mock.patch.object(views.arcface_client, 'verify_templates', return_value=VERIFIED) as verify_templates:
+            self.verify_request('101')
+            second = self.verify_request('101')
+
+        self.assertEqual(second['X-Coalesced'], 'true')
+        self.assertEqual(verify_templates.call_count, 1)
+
+    def test_other_users_are_not_coalesced(self):
+        with mock.patch.object(views.arcface_client, 'verify_templates', return_value=VERIFIED) as verify_templates:
+            self.verify_request('101')
+            self.client.force_login(User.objects.create_user('other_operator'))
+            second = self.verify_request('101')
+
+        self.assertFalse(second.has_header('X-Coalesced'))
+        self.assertEqual(verify_templates.call_count, 2)
+
+
+class AdmissionControlTests(TestCase):
+
+    def test_requests_beyond_the_queue_are_rejected_with_429(self):
+        controller = AdmissionController('test', max_in_flight=1, max_waiting=0)
+
+        with controller.admit():
+            with self.assertRaises(AdmissionRejected) as rejected:
+                controller.acquire()
+
+        self.assertEqual(rejected.exception.status_code, 429)
+        self.assertEqual(controller.rejected_full, 1)
+        # The slot is free again
+        with controller.admit():
+            pass
+        self.assertEqual(controller.admitted, 2)
+
+    def test_wait_that_times_out_is_rejected_with_503(self):
+        controller = AdmissionController('test', max_in_flight=1, max_waiting=1, wait_timeout=0.05)
+
+        with controller.admit():
+            with self.assertRaises(AdmissionRejected) as rejected:
+                controller.acquire()
+
+        self.assertEqual(rejected.exception.status_code, 503)
+        self.assertEqual(controller.rejected_timeout, 1)
+
+    def test_released_slot_admits_a_waiting_request(self):
+        controller = AdmissionController('test', max_in_flight=1, max_waiting=1, wait_timeout=5)
+        controller.acquire()
+        waited = []
+        waiter = threading.Thread(target=lambda: waited.append(controller.acquire()))
+        waiter.start()
+        while not controller._waiting:
+            time.sleep(0.01)
+
+        controller.release(0.2)
+        waiter.join()
+
+        self.assertEqual(len(waited), 1)
+        self.assertEqual(controller.stats()['in_flight'], 1)
+
+    def test_retry_after_follows_the_backlog(self):
+        controller = AdmissionController('test', max_in_flight=2)
+        self.assertEqual(controller.retry_after(), 1)
+
+        for _ in range(4):
+            controller.acquire()
+            controller.release(3.0)
+        controller._in_flight = 2
+        controller._waiting = 2
+
+        self.assertEqual(controller.retry_after(), 6)
+
+    def test_decorator_renders_rejections(self):
+        controller = AdmissionController('test', max_in_flight=1, max_waiting=0)
+
+        @api_view(['POST'])
+        @admission_control(controller)
+        def view(request):
+            return Response({'verified': True})
+
+        factory = APIRequestFactory()
+        response = view(factory.post('/verify/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Queue-Wait-Ms', response)
+
+        with controller.admit():
+            response = view(factory.post('/verify/'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.data['retry_after'], 1)
+
+
+class FollowerTimeoutTests(TestCase):
+
+    def test_follower_gives_up_with_503(self):
+        flight = SingleFlight(wait_timeout=0.05)
+        controller = AdmissionController('test')
+        release = threading.Event()
+
+        @api_view(['POST'])
+        @coalesce_requests(flight, lambda request: ('same capture',), controller)
+        def slow_view(request):
+            release.wait(5)
+            return Response({'verified': True})
+
+        factory = APIRequestFactory()
+        leader = threading.Thread(target=slow_view, args=(factory.post('/verify/'),))
+        leader.start()
+        try:
+            while not flight._calls:
+                time.sleep(0.01)
+            response = slow_view(factory.post('/verify/'))
+        finally:
+            release.set()
+            leader.join()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(flight.timed_out, 1)
+
+    @override_settings(FACE_INFERENCE_WAIT_TIMEOUT=0.1)
+    def test_follower_waits_no_longer_than_for_a_slot(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        leader = threading.Thread(target=flight.do, args=('key', lambda: release.wait(5)))
+        leader.start()
+        try:
+            while not flight._calls:
+                time.sleep(0.01)
+            with self.assertRaises(FlightTimeout):
+                flight.do('key', lambda: 'not run')
+        finally:
+            release.set()
+            leader.join()
+
+        self.assertEqual(flight.wait_timeout, 0.1)
+
+
+def zip_archive(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+class ArchiveLimitTests(ArmoryTestCase):
+
+    def test_images_within_limits_are_read(self):
+        archive = zip_archive({'101.jpg': b'x' * 10, 'notes.txt': b'not an image'})
+
+        self.assertEqual(list(iter_archive(archive, max_files=1, max_image_bytes=10)), [('101.jpg', b'x' * 10)])
+
+    def test_limits_are_checked_before_anything_is_read(self):
+        with self.assertRaises(ArchiveTooLarge):
+            next(iter_archive(zip_archive({'101.jpg': b'x', '102.jpg': b'x'}), max_files=1))
+        with self.assertRaises(ArchiveTooLarge):
+            # Highly compressible, a zip bomb in miniature
+            next(iter_archive(zip_archive({'101.jpg': b'\0' * 100000}), max_image_bytes=1000))
+        with self.assertRaises(ArchiveTooLarge):
+            next(iter_archive(zip_archive({'101.jpg': b'x' * 600, '102.jpg': b'x' * 600}), max_total_bytes=1000))
+
+    @override_settings(FACE_BULK_ENROLL_MAX_FILES=2)
+    def test_bulk_registration_rejects_oversized_archive(self):
+        archive = zip_archive({'101.jpg': b'x', '102.jpg': b'x', '103.jpg': b'x'})
+
+        with mock.patch.object(views.arcface_client, 'extract_embeddings') as extract_embeddings:
+            response = self.client.post('/api/face/register/bulk/', {
+                'archive': SimpleUploadedFile('unit.zip', archive.read(), content_type='application/zip')
+            })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At most 2 images', response.json()['error'])
+        extract_embeddings.assert_not_called()
+
+    @override_settings(FACE_BULK_ENROLL_MAX_IMAGE_BYTES=100)
+    def test_bulk_registration_rejects_oversized_image(self):
+        response = self.client.post('/api/face/register/bulk/', {
+            'images': [SimpleUploadedFile('101.jpg', b'x' * 101, content_type='image/jpeg')]
+        })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('101.jpg', response.json()['error'])
+
+
+@mock.patch.object(views_transaction.arcface_client, 'verify_templates', return_value=VERIFIED)
+class IdempotencyTests(ArmoryTestCase):
+
+    def test_retry_replays_the_stored_response(self, verify_templates):
+        first = self.transaction_request(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        verification_flight._calls.clear()
+        retry = self.transaction_request(HTTP_IDEMPOTENCY_KEY='checkout-1')
+
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(verify_templates.call_count, 1)
+        self.assertEqual(WeaponTransaction.objects.count(), 1)
+
+    def test_key_reused_for_other_payload_is_rejected(self, verify_templates):
+        self.transaction_request(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        response = self.transaction_request(transaction_type='check_in', HTTP_IDEMPOTENCY_KEY='checkout-1')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(verify_templates.call_count, 1)
+        self.assertEqual(WeaponTransaction.objects.count(), 1)
+
+
+class CounterTests(ArmoryTestCase):
+
+    def assertCountersMatch(self):
+        stored = {name: value for name, value in StatCounter.objects.values_list('name', 'value') if value}
+        actual = {name: value for name, value in compute_counters().items() if value}
+        self.assertEqual(stored, actual)
+
+    def test_fixture_is_counted(self):
+        self.assertCountersMatch()
+        self.assertEqual(StatCounter.read('weapons.status.assigned', 'personnel.active', 'face_records.active'), {
+            'weapons.status.assigned': 1, 'personnel.active': 2, 'face_records.active': 2
+        })
+
+    def test_saves(self):
+        self.weapon.location = 'out'
+        self.weapon.save(update_fields=['location'])
+        self.other_personnel.active_status = False
+        self.other_personnel.save()
+        WeaponTransaction.objects.create(weapon=self.weapon, personnel=self.personnel, transaction_type='checkout')
+        AuthenticationLog.objects.create(personnel_id='102', result='FAILURE')
+        # Saved from a copy loaded without the counted field
+        face_record = FaceRecord.objects.only('id', 'personnel_id').get(personnel_id='102')
+        face_record.is_active = False
+        face_record.save(update_fields=['is_active'])
+
+        self.assertCountersMatch()
+
+    def test_deletes(self):
+        WeaponTransaction.objects.create(weapon=self.weapon, personnel=self.other_personnel, transaction_type='checkout')
+        FaceRecord.objects.filter(personnel_id='101').delete()
+        # Cascades to the personnel's transactions
+        self.other_personnel.delete()
+        Weapon.objects.get(pk=self.weapon.pk).delete()
+
+        self.assertCountersMatch()
+
+    def test_bulk_writes(self):
+        results = BatchTransaction(client=mock.MagicMock()).run([
+            {'qr_code': self.weapon.qr_code, 'personnel_id': '101', 'transaction_type': 'check_out', 'embedding': embedding_b64(0)},
+            # Someone else's face, a logged authentication failure
+            {'qr_code': self.weapon.qr_code, 'personnel_id': '101', 'transaction_type': 'check_in', 'embedding': embedding_b64(1)},
+        ])
+        auth_log_writer._write([AuthenticationLog(personnel_id='102', result='FAILURE')])
+
+        self.assertEqual([result['transaction_success'] for result in results], [True, False])
+        self.assertCountersMatch()
+
+    def test_failed_counter_update_rolls_back_the_write(self):
+        with mock.patch.object(StatCounter, 'add', side_effect=DatabaseError('counter update failed')):
+            with self.assertRaises(DatabaseError):
+                Personnel.objects.create(id_number='103', first_name='Ганаа', last_name='Бат', regiment=self.personnel.regiment)
+            with self.assertRaises(DatabaseError):
+                self.weapon.location = 'out'
+                self.weapon.save()
+            with self.assertRaises(DatabaseError):
+                WeaponTransaction.objects.create(weapon=self.weapon, personnel=self.other_personnel, transaction_type='reassign')
+            # Deletes run in the collector's own transaction, outermost outside of tests
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                self.other_personnel.delete()
+
+        self.assertFalse(Personnel.objects.filter(id_number='103').exists())
+        self.assertTrue(Personnel.objects.filter(id_number='102').exists())
+        weapon = Weapon.objects.get(pk=self.weapon.pk)
+        self.assertEqual((weapon.location, weapon.assigned_to_id), ('in', self.personnel.pk))
+        self.assertFalse(WeaponTransaction.objects.exists())
+        self.assertCountersMatch()
+
+    def test_reconcile_repairs_drift(self):
+        # Queryset updates bypass the counters
+        Weapon.objects.filter(pk=self.weapon.pk).update(location='out')
+        StatCounter.objects.filter(name='personnel.total').update(value=99)
+
+        corrections = reconcile()
+
+        self.assertEqual(corrections['personnel.total'], (99, 2))
+        self.assertEqual(corrections['weapons.location.out'], (0, 1))
+        self.assertCountersMatch()
+
+
+@override_settings(FACE_AUTH_LOG_ASYNC=True)
+class AuthenticationLogWriterTests(ArmoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Rows are written by flush() on the test thread instead
+        patcher = mock.patch.object(AuthenticationLogWriter, '_ensure_thread')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rows_are_queued_and_written_in_batches(self):
+        writer = AuthenticationLogWriter(batch_size=2)
+
+        with self.assertNumQueries(0):
+            entries = [writer.log(personnel_id='101', result='FAILURE') for _ in range(5)]
+        self.assertEqual(writer.pending(), 5)
+
+        with mock.patch.object(AuthenticationLog.objects, 'bulk_create', wraps=AuthenticationLog.objects.bulk_create) as bulk_create:
+            writer.flush()
+
+        self.assertEqual([len(call.args[0]) for call in bulk_create.call_args_list], [2, 2, 1])
+        self.assertEqual(set(AuthenticationLog.objects.values_list('id', flat=True)), {entry.id for entry in entries})
+        self.assertEqual(writer.written, 5)
+        self.assertEqual(compute_counters()[f"auth_failures.{timezone.localdate().isoformat()}"], 5)
+
+    def test_full_queue_writes_synchronously(self):
+        writer = AuthenticationLogWriter(max_queue=1)
+
+        writer.log(personnel_id='101', result='SUCCESS')
+        entry = writer.log(personnel_id='102', result='SUCCESS')
+
+        self.assertEqual(writer.fallbacks, 1)
+        self.assertEqual(list(AuthenticationLog.objects.values_list('id', flat=True)), [entry.id])
+        self.assertEqual(writer.pending(), 1)
+
+    def test_bad_row_does_not_lose_its_batch(self):
+        writer = AuthenticationLogWriter()
+        existing = AuthenticationLog.objects.create(personnel_id='101', result='SUCCESS')
+
+        writer.log(personnel_id='101', result='SUCCESS')
+        writer.log(id=existing.id, personnel_id='102', result='SUCCESS')
+        writer.log(personnel_id='102', result='FAILURE')
+        writer.flush()
+
+        self.assertEqual(AuthenticationLog.objects.count(), 3)
+        self.assertEqual(writer.written, 2)
+        self.assertEqual(AuthenticationLog.objects.get(id=existing.id).personnel_id, '101')
+
+    @override_settings(FACE_AUTH_LOG_ASYNC=False)
+    def test_disabled_writer_writes_at_once(self):
+        writer = AuthenticationLogWriter()
+
+        writer.log(personnel_id='101', result='SUCCESS')
+
+        self.assertEqual(writer.pending(), 0)
+        self.assertEqual(AuthenticationLog.objects.count(), 1)
+
+
+def jpeg_image(width=400, height=300, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode('.jpg', pixels)[1].tobytes()
+
+
+class ImageStoreTests(ArmoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media_root = directory.name
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def media(self, path):
+        return os.path.join(self.media_root, path)
+
+    def test_identical_uploads_share_one_file(self):
+        image = jpeg_image()
+
+        path = store_face_image(image)
+
+        self.assertEqual(path, content_path(hashlib.sha256(image).hexdigest()))
+        self.assertEqual(store_face_image(image), path)
+        self.assertNotEqual(store_face_image(jpeg_image(seed=1)), path)
+        with open(self.media(path), 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+    def test_thumbnail_is_written_with_the_image(self):
+        path = store_face_image(jpeg_image())
+
+        thumbnail = cv2.imread(self.media(thumbnail_path(path)))
+        self.assertEqual(thumbnail.shape[:2], (75, 100))
+        self.assertEqual(ensure_thumbnail(path), thumbnail_path(path))
+
+    def test_missing_thumbnail_is_generated_on_demand(self):
+        path = store_face_image(jpeg_image())
+        os.remove(self.media(thumbnail_path(path)))
+
+        self.assertEqual(ensure_thumbnail(path), thumbnail_path(path))
+        self.assertTrue(os.path.exists(self.media(thumbnail_path(path))))
+
+    @override_settings(FACE_IMAGE_MAX_SIDE=200)
+    def test_large_images_are_downscaled_but_keyed_by_the_upload(self):
+        image = jpeg_image()
+
+        path = store_face_image(image)
+
+        self.assertEqual(path, content_path(hashlib.sha256(image).hexdigest()))
+        self.assertEqual(cv2.imread(self.media(path)).shape[:2], (150, 200))
+
+    def test_unreferenced_old_images_are_collected(self):
+        kept = store_face_image(jpeg_image())
+        FaceRecord.objects.filter(personnel_id='101').update(face_image_path=kept)
+        orphan = store_face_image(jpeg_image(seed=1))
+        recent = store_face_image(jpeg_image(seed=2))
+        old = time.time() - 2 * 86400
+        for path in (kept, orphan, thumbnail_path(orphan)):
+            os.utime(self.media(path), (old, old))
+
+        call_command('gc_face_images', stdout=io.StringIO())
+
+        self.assertTrue(os.path.exists(self.media(kept)))
+        self.assertTrue(os.path.exists(self.media(thumbnail_path(kept))))
+        self.assertFalse(os.path.exists(self.media(orphan)))
+        self.assertFalse(os.path.exists(self.media(thumbnail_path(orphan))))
+        self.assertTrue(os.path.exists(self.media(recent)))
+
+
+class StatsSnapshotTests(ArmoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        clock = mock.patch.object(stats.time, 'monotonic', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.snapshot = StatsSnapshot(ttl=10, min_interval=1)
+
+    def test_counts_come_from_the_counters(self):
+        data = collect_stats()
+
+        self.assertEqual(data['personnel'], {'count': 2, 'active_count': 2})
+        self.assertEqual(data['weapons']['assigned_count'], 1)
+        self.assertEqual(data['face_records']['active_count'], 2)
+
+    def test_snapshot_is_reused_until_it_expires(self):
+        first = self.snapshot.get()
+
+        self.now += 9
+        with self.assertNumQueries(0):
+            self.assertIs(self.snapshot.get(), first)
+
+        self.now += 1
+        self.snapshot.get()
+        self.assertEqual(self.snapshot.refreshes, 2)
+
+    def test_invalidation_waits_for_the_minimum_interval(self):
+        self.snapshot.get()
+        self.snapshot.invalidate()
+
+        self.now += 0.5
+        self.snapshot.get()
+        self.assertEqual(self.snapshot.refreshes, 1)
+
+        self.now += 0.5
+        self.snapshot.get()
+        self.assertEqual(self.snapshot.refreshes, 2)
+
+    def test_version_changes_only_with_the_numbers(self):
+        first = self.snapshot.get()
+        self.snapshot.invalidate()
+        self.now += 1
+        self.assertEqual(self.snapshot.get().version, first.version)
+
+        Personnel.objects.create(id_number='103', first_name='Ганаа', last_name='Бат', regiment=self.personnel.regiment)
+        self.snapshot.invalidate()
+        self.now += 1
+        second = self.snapshot.get()
+
+        self.assertNotEqual(second.version, first.version)
+        self.assertEqual(second.data['personnel']['count'], 3)
+
+    def test_other_requests_get_the_old_snapshot_during_a_refresh(self):
+        first = self.snapshot.get()
+        self.now += 10
+
+        with self.snapshot._lock:
+            with self.assertNumQueries(0):
+                self.assertIs(self.snapshot.get(), first)
+
+    def test_committed_change_invalidates_the_shared_snapshot(self):
+        with mock.patch.object(stats.stats_snapshot, 'invalidate') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.weapon.location = 'out'
+                self.weapon.save()
+
+        invalidate.assert_called()
+
+
+class IdentifyFaceTests(ArmoryTestCase):
+
+    def identify_request(self):
+        return self.client.post('/api/face/identify/', {'face_image': FACE_IMAGE}, content_type='application/json')
+
+    def test_anonymous_request_is_rejected(self):
+        self.client.logout()
+
+        with mock.patch.object(views.arcface_client, 'extract_embeddings') as extract_embeddings:
+            response = self.identify_request()
+
+        self.assertIn(response.status_code, (401, 403))
+        extract_embeddings.assert_not_called()
+
+    def test_face_is_identified(self):
+        extracted = {'status': 'SUCCESS', 'embedding_array': unit_embedding(1)}
+        with mock.patch.object(views, 'gallery', GalleryIndex()), \
+                mock.patch.object(views.arcface_client, 'extract_embeddings', return_value=extracted):
+            response = self.identify_request()
+
+        body = response.json()
+        self.assertTrue(body['identified'])
+        self.assertEqual(body['personnel_id'], '102')
+        self.assertEqual(body['personnel_info']['name'], 'Болд Сүх')
+
+
+class GalleryIndexTests(ArmoryTestCase):
+
+    def loaded_index(self, **kwargs):
+        index = GalleryIndex(**kwargs)
+        index.load()
+        return index
+
+    def test_search_ranks_matches_above_the_threshold(self):
+        index = self.loaded_index()
+        near = unit_embedding(0) + 0.02 * unit_embedding(5)
+        index.upsert('103', near)
+
+        matches = index.search(unit_embedding(0), k=5)
+        self.assertEqual([match['id'] for match in matches[:2]], ['101', '103'])
+        self.assertEqual(len(matches), 3)
+        self.assertAlmostEqual(matches[0]['similarity'], 1.0, places=5)
+
+        self.assertEqual([match['id'] for match in index.search(unit_embedding(0), k=5, threshold=0.99)], ['101', '103'])
+        self.assertEqual(index.search(unit_embedding(9), threshold=0.9), [])
+
+    def test_verify_scores_one_personnel(self):
+        index = self.loaded_index()
+
+        self.assertAlmostEqual(index.verify('101', unit_embedding(0)), 1.0, places=5)
+        self.assertLess(index.verify('102', unit_embedding(0)), 0.3)
+        self.assertIsNone(index.verify('999', unit_embedding(0)))
+        # A probe of another model's dimension cannot be compared
+        self.assertIsNone(index.verify('101', np.ones(128, dtype=np.float32)))
+        self.assertEqual(index.search(np.ones(128, dtype=np.float32)), [])
+
+    def test_remove_moves_the_last_row_into_the_gap(self):
+        index = self.loaded_index()
+        index.upsert('103', unit_embedding(2))
+
+        index.remove('101')
+
+        self.assertEqual(len(index), 2)
+        self.assertNotIn('101', index)
+        ids, matrix = index.snapshot()
+        self.assertEqual(sorted(ids), ['102', '103'])
+        np.testing.assert_allclose(index.get('103'), unit_embedding(2), atol=1e-6)
+        self.assertEqual(index.search(unit_embedding(2), k=1)[0]['id'], '103')
+
+    def test_inactive_and_empty_records_are_not_loaded(self):
+        FaceRecord.objects.filter(personnel_id='101').update(is_active=False)
+        FaceRecord.objects.create(personnel_id='103', face_embedding=None)
+
+        index = self.loaded_index()
+
+        self.assertEqual(sorted(index.snapshot()[0]), ['102'])
+
+    def test_changes_from_other_processes_are_applied(self):
+        index = GalleryIndex()
+        index.load()
+
+        # Saved outside the index; on_commit handlers never run in a TestCase,
+        # just like the signals of another worker process never reach this one
+        face_record = FaceRecord.objects.get(personnel_id='101')
+        face_record.is_active = False
+        face_record.save()
+        FaceRecord.objects.create(personnel_id='103', face_embedding=encode_embedding(unit_embedding(2)))
+
+        self.assertIsNone(index.verify('101', unit_embedding(0)))
+        self.assertEqual(index.search(unit_embedding(2), k=1)[0]['id'], '103')
+        self.assertEqual(len(index), 2)
+
+    def test_unchanged_gallery_checks_one_version(self):
+        index = GalleryIndex()
+        index.load()
+
+        with self.assertNumQueries(1):
+            matches = index.search(unit_embedding(0), k=1)
+
+        self.assertEqual(matches[0]['id'], '101')
+
+
+def unit_matrix(rows, seed=0):
+    matrix = np.random.default_rng(seed).standard_normal((rows, 512)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+class IVFIndexTests(TestCase):
+
+    def setUp(self):
+        self.matrix = unit_matrix(300)
+        self.keys = [f'{row:03d}' for row in range(300)]
+        self.index = IVFIndex(n_lists=8, n_probe=2)
+        self.index.build(self.keys, self.matrix)
+
+    def test_probing_every_list_is_exact(self):
+        probe = unit_matrix(1, seed=1)[0]
+
+        expected = GalleryIndex.top_k(self.matrix @ probe, self.keys, 10)
+
+        self.assertEqual(self.index.search(probe, k=10, n_probe=8), expected)
+
+    def test_stored_vectors_are_found_in_their_own_list(self):
+        for row in range(0, 300, 30):
+            match = self.index.search(self.matrix[row], k=1, n_probe=1)[0]
+            self.assertEqual(match['id'], self.keys[row])
+            self.assertAlmostEqual(match['similarity'], 1.0, places=5)
+
+    def test_remove_and_add(self):
+        self.index.remove('000')
+        self.assertNotIn('000', self.index)
+        self.assertNotEqual(self.index.search(self.matrix[0], k=1)[0]['id'], '000')
+
+        self.index.add('new', self.matrix[0])
+        self.assertEqual(len(self.index), 300)
+        self.assertEqual(self.index.search(self.matrix[0], k=1)[0]['id'], 'new')
+
+    def test_saved_index_searches_the_same(self):
+        probe = unit_matrix(1, seed=2)[0]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ivf.npz')
+            self.index.save(path)
+            loaded = IVFIndex.load(path)
+
+        np.testing.assert_array_equal(loaded.centroids, self.index.centroids)
+        self.assertEqual(len(loaded), 300)
+        self.assertEqual(loaded.search(probe, k=5), self.index.search(probe, k=5))
+
+
+class EmbeddingStoreTests(ArmoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = EmbeddingStore(directory.name)
+
+    def test_rebuild_maps_active_records(self):
+        self.store.rebuild()
+
+        snapshot = self.store.open()
+        self.assertEqual((snapshot.version, snapshot.generation), (1, 1))
+        self.assertEqual(sorted(snapshot.ids), ['101', '102'])
+        row = snapshot.ids.index('102')
+        np.testing.assert_allclose(snapshot.matrix[row], unit_embedding(1), atol=1e-6)
+
+    def test_updates_append_within_a_generation(self):
+        self.store.compact_ratio = 0.5
+        self.store.rebuild()
+        before = self.store.open()
+
+        self.store.upsert('101', unit_embedding(2))
+
+        after = self.store.open()
+        self.assertEqual((after.version, after.generation), (2, 1))
+        self.assertEqual(after.ids, [None if pid == '101' else pid for pid in before.ids] + ['101'])
+        np.testing.assert_allclose(after.matrix[-1], unit_embedding(2), atol=1e-6)
+        # The earlier mapping still reads the rows it was opened with
+        np.testing.assert_array_equal(before.matrix, after.matrix[:len(before.ids)])
+
+    def test_too_many_dead_rows_compact_into_a_new_generation(self):
+        self.store.rebuild()
+
+        self.store.remove('101')
+
+        snapshot = self.store.open()
+        self.assertEqual(snapshot.generation, 2)
+        self.assertEqual(snapshot.ids, ['102'])
+        self.assertEqual(snapshot.matrix.shape, (1, 512))
+
+    def test_galleries_sharing_a_store_see_each_others_writes(self):
+        writer = GalleryIndex(store=self.store)
+        reader = GalleryIndex(store=EmbeddingStore(self.store.directory))
+        writer.load()
+        reader.load()
+
+        writer.upsert('101', unit_embedding(2))
+        writer.remove('102')
+
+        matches = reader.search(unit_embedding(2), k=5)
+        self.assertEqual([match['id'] for match in matches], ['101'])
+
+
+class EmbeddingEncodingTests(ArmoryTestCase):
+
+    def test_encodings_round_trip_within_their_precision(self):
+        vector = unit_matrix(1, seed=3)[0]
+
+        for encoding, size, tolerance in (('float32', 2048, 0), ('float16', 1028, 1e-3), ('int8', 520, 1e-2)):
+            with self.subTest(encoding=encoding):
+                blob = encode_embedding(vector, encoding)
+                self.assertEqual(len(blob), size)
+                self.assertEqual(embedding_encoding(blob), encoding)
+                decoded = decode_embedding(blob)
+                self.assertGreaterEqual(float(decoded @ vector) / np.linalg.norm(decoded), 1 - tolerance)
+
+    def test_raw_float32_blobs_are_still_read(self):
+        vector = unit_matrix(1, seed=4)[0]
+
+        np.testing.assert_array_equal(decode_embedding(vector.tobytes()), vector)
+        self.assertEqual(embedding_encoding(vector.tobytes()), 'float32')
+        self.assertIsNone(decode_embedding(b''))
+
+    def test_quantize_command_reports_before_converting(self):
+        out = io.StringIO()
+        call_command('quantize_embeddings', 'int8', '--dry-run', stdout=out)
+
+        self.assertIn('decision flips', out.getvalue())
+        self.assertEqual(embedding_encoding(FaceRecord.objects.get(personnel_id='101').face_embedding), 'float32')
+
+        call_command('quantize_embeddings', 'int8', stdout=io.StringIO())
+
+        for face_record in FaceRecord.objects.all():
+            self.assertEqual(embedding_encoding(face_record.face_embedding), 'int8')
+        stored = decode_embedding(FaceRecord.objects.get(personnel_id='101').face_embedding)
+        self.assertGreater(float(stored @ unit_embedding(0)) / np.linalg.norm(stored), 0.99)
+
+
+class FaceTemplateTests(ArmoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.face_record = FaceRecord.objects.get(personnel_id='101')
+
+    def test_oldest_templates_are_dropped(self):
+        for seed in range(4):
+            self.face_record.add_template(unit_embedding(10 + seed), max_templates=3)
+
+        self.assertEqual(self.face_record.templates.count(), 3)
+        kept = self.face_record.template_embeddings()
+        np.testing.assert_allclose(kept[0], unit_embedding(13), atol=1e-6)
+        self.assertFalse(np.any(np.isclose(kept @ unit_embedding(10), 1.0, atol=1e-5)))
+
+    def test_embedding_is_the_centroid_of_the_templates(self):
+        self.face_record.add_template(unit_embedding(10))
+        self.face_record.add_template(unit_embedding(11))
+
+        self.face_record.refresh_from_db()
+        expected = normalize_embedding(unit_embedding(10) + unit_embedding(11))
+        np.testing.assert_allclose(decode_embedding(self.face_record.face_embedding), expected, atol=1e-6)
+
+    def test_record_without_templates_uses_its_embedding(self):
+        np.testing.assert_allclose(self.face_record.template_embeddings(), [unit_embedding(0)], atol=1e-6)
+
+    def test_policies_score_the_templates_differently(self):
+        client = ArcFaceClient(api_url='http://arcface.invalid')
+        probe = unit_embedding(20)
+        near = normalize_embedding(probe + 0.3 * unit_embedding(21))
+        far = unit_embedding(22)
+        templates = np.vstack([near, far])
+
+        scores = {}
+        with mock.patch.object(client, 'extract_embeddings', return_value={'embedding_array': probe}):
+            for policy in ('max', 'mean', 'centroid'):
+                scores[policy] = client.verify_templates(b'image', templates, threshold=0.6, policy=policy)
+
+        self.assertTrue(scores['max']['verified'])
+        self.assertAlmostEqual(scores['max']['confidence'], float(near @ probe), places=5)
+        self.assertFalse(scores['mean']['verified'])
+        self.assertAlmostEqual(scores['mean']['confidence'], float((near @ probe + far @ probe) / 2), places=5)
+        self.assertAlmostEqual(
+            scores['centroid']['confidence'], float(normalize_embedding(near + far) @ probe), places=5
+        )
+        self.assertEqual(len(scores['max']['template_scores']), 2)
+
+    def test_mismatched_dimension_is_an_error(self):
+        client = ArcFaceClient(api_url='http://arcface.invalid')
+
+        with mock.patch.object(client, 'extract_embeddings', return_value={'embedding_array': np.ones(128)}):
+            result = client.verify_templates(b'image', np.vstack([unit_embedding(0)]))
+
+        self.assertFalse(result['verified'])
+        self.assertEqual(result['status'], 'ERROR')
+
+
+class EmbeddingCacheTests(ArmoryTestCase):
+
+    def test_second_lookup_is_served_from_memory(self):
+        entry = embedding_cache.lookup('101')
+
+        self.assertEqual(entry.personnel.first_name, 'Бат')
+        np.testing.assert_allclose(entry.templates, [unit_embedding(0)], atol=1e-6)
+        self.assertFalse(entry.templates.flags.writeable)
+        with self.assertNumQueries(0):
+            self.assertIs(embedding_cache.lookup('101'), entry)
+
+    def test_unknown_personnel_is_cached_too(self):
+        entry = embedding_cache.lookup('999')
+
+        self.assertIsNone(entry.personnel)
+        self.assertIsNone(entry.templates)
+        with self.assertNumQueries(0):
+            embedding_cache.lookup('999')
+
+    def test_saved_face_record_invalidates_its_entry(self):
+        embedding_cache.lookup('101')
+        embedding_cache.lookup('102')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            face_record = FaceRecord.objects.get(personnel_id='101')
+            face_record.face_embedding = encode_embedding(unit_embedding(5))
+            face_record.save()
+
+        self.assertIsNone(embedding_cache.get('101'))
+        self.assertIsNotNone(embedding_cache.get('102'))
+        np.testing.assert_allclose(embedding_cache.lookup('101').templates, [unit_embedding(5)], atol=1e-6)
+
+    def test_renamed_personnel_invalidates_its_entry(self):
+        embedding_cache.lookup('101')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.personnel.first_name = 'Бат-Эрдэнэ'
+            self.personnel.save()
+
+        self.assertEqual(embedding_cache.lookup('101').personnel.first_name, 'Бат-Эрдэнэ')
+
+    def test_entries_expire_and_are_evicted(self):
+        cache = EmbeddingCache(max_entries=1, ttl=60)
+
+        with mock.patch('face_authentication.embedding_cache.time.monotonic', return_value=1000.0):
+            cache.lookup('101')
+        with mock.patch('face_authentication.embedding_cache.time.monotonic', return_value=1059.0):
+            self.assertIsNotNone(cache.get('101'))
+        with mock.patch('face_authentication.embedding_cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('101'))
+
+        cache.lookup('101')
+        cache.lookup('102')
+        self.assertEqual(len(cache), 1)
+        self.assertIsNone(cache.get('101'))
+
+    def test_lookup_many_loads_misses_together(self):
+        embedding_cache.lookup('101')
+
+        with self.assertNumQueries(2):
+            entries = embedding_cache.lookup_many([self.personnel, self.other_personnel])
+
+        self.assertEqual(set(entries), {'101', '102'})
+        np.testing.assert_allclose(entries['102'].templates, [unit_embedding(1)], atol=1e-6)
+
+
+@override_settings(FACE_INDEX_BACKEND='ivf', FACE_IVF_MIN_SIZE=4, FACE_IVF_LISTS=2, FACE_IVF_PROBE=2)
+class IVFGrowthTests(ArmoryTestCase):
+
+    def test_small_gallery_is_searched_exactly(self):
+        with override_settings(FACE_IVF_MIN_SIZE=1000):
+            index = GalleryIndex()
+            index.load()
+
+        self.assertIsNone(index._ann)
+        self.assertEqual(index.search(unit_embedding(1), k=1)[0]['id'], '102')
+
+    def test_index_is_built_and_retrained_as_the_gallery_grows(self):
+        index = GalleryIndex(encoding='int8')
+        index.load()
+        self.assertIsNone(index._ann)
+
+        for seed in range(2, 4):
+            index.upsert(f'2{seed:02d}', unit_embedding(seed))
+        self.assertEqual(len(index._ann), 4)
+        self.assertEqual(index.search(unit_embedding(3), k=1)[0]['id'], '203')
+
+        first_centroids = index._ann.centroids
+        index.sync_records([
+            FaceRecord(personnel_id=f'2{seed:02d}', face_embedding=encode_embedding(unit_embedding(seed)), is_active=True)
+            for seed in range(4, 8)
+        ])
+        self.assertIsNot(index._ann.centroids, first_centroids)
+        self.assertEqual(len(index._ann), 8)
+
+        index.upsert('208', unit_embedding(8))
+        self.assertIn('208', index._ann)
+        # Every row sits in the list of its nearest centroid, as build() places them
+        for personnel_id, (list_no, _) in index._ann._locations.items():
+            self.assertEqual(int(np.argmax(index._ann.centroids @ index.get(personnel_id))), list_no)
+
+
+class AsyncRegistrationTests(ArmoryTestCase):
+
+    def register(self, personnel_id='101'):
+        return self.client.post('/api/face/register/', {
+            'personnel_id': personnel_id,
+            'face_image': FACE_IMAGE,
+            'async': True
+        }, content_type='application/json')
+
+    def test_registration_is_queued_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.register()
+
+        self.assertEqual(response.status_code, 202)
+        job = RegistrationJob.objects.get(id=response.json()['job_id'])
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(bytes(job.image_data), b'face image')
+        self.assertTrue(response.json()['status_url'].endswith(f'/api/face/register/jobs/{job.id}/'))
+        self.assertEqual(len(callbacks), 1)
+
+        result = {'face_id': 'f', 'template_id': 't', 'template_count': 1, 'created': False}
+        with mock.patch.object(registration, 'register_face_image', return_value=result):
+            RegistrationWorker().run(job.id)
+
+        body = self.client.get(f'/api/face/register/jobs/{job.id}/').json()
+        self.assertEqual(body['status'], 'succeeded')
+        self.assertEqual(body['template_count'], 1)
+        job.refresh_from_db()
+        self.assertIsNone(job.image_data)
+
+    def test_failed_registration_is_reported(self):
+        with self.captureOnCommitCallbacks():
+            job_id = self.register().json()['job_id']
+
+        error = registration.RegistrationError('No face detected in the image')
+        with mock.patch.object(registration, 'register_face_image', side_effect=error):
+            RegistrationWorker().run(job_id)
+
+        body = self.client.get(f'/api/face/register/jobs/{job_id}/').json()
+        self.assertEqual(body['status'], 'failed')
+        self.assertEqual(body['error'], 'No face detected in the image')
+
+    def test_job_is_only_run_once(self):
+        with self.captureOnCommitCallbacks():
+            job_id = self.register().json()['job_id']
+
+        result = {'face_id': 'f', 'template_id': 't', 'template_count': 1, 'created': False}
+        with mock.patch.object(registration, 'register_face_image', return_value=result) as register_face_image:
+            RegistrationWorker().run(job_id)
+            RegistrationWorker().run(job_id)
+
+        self.assertEqual(register_face_image.call_count, 1)
+
+    def test_unknown_personnel_is_rejected_before_queueing(self):
+        response = self.register(personnel_id='999')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(RegistrationJob.objects.exists())
+
+    def test_unknown_job_is_not_found(self):
+        response = self.client.get('/api/face/register/jobs/00000000-0000-0000-0000-000000000000/')
+
+        self.assertEqual(response.status_code, 404)
+
+
+class RegistrationRecoveryTests(ArmoryTestCase):
+
+    def running_job(self, started_minutes_ago, attempts=1):
+        return RegistrationJob.objects.create(
+            personnel_id='101',
+            image_data=b'face image',
+            status='running',
+            started_at=timezone.now() - timedelta(minutes=started_minutes_ago),
+            attempts=attempts
+        )
+
+    def test_interrupted_job_is_requeued_and_runs_again(self):
+        job = self.running_job(started_minutes_ago=30)
+        worker = RegistrationWorker(job_timeout=600, max_attempts=2)
+
+        self.assertEqual(worker.recover_interrupted(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        self.assertIsNone(job.started_at)
+
+        result = {'face_id': 'f', 'template_id': 't', 'template_count': 1, 'created': False}
+        with mock.patch.object(registration, 'register_face_image', return_value=result):
+            worker.run(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.attempts, 2)
+
+    def test_job_interrupted_too_often_is_failed(self):
+        job = self.running_job(started_minutes_ago=30, attempts=2)
+
+        self.assertEqual(RegistrationWorker(job_timeout=600, max_attempts=2).recover_interrupted(), (0, 1))
+
+        response = self.client.get(f'/api/face/register/jobs/{job.id}/')
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertIn('interrupted', response.json()['error'])
+
+    def test_job_still_within_timeout_is_left_running(self):
+        job = self.running_job(started_minutes_ago=1)
+
+        self.assertEqual(RegistrationWorker(job_timeout=600).recover_interrupted(), (0, 0))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+
+class PersonnelAdminTests(ArmoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.model_admin = admin.site._registry[Personnel]
+        self.request = RequestFactory().post('/admin/inventory/personnel/', HTTP_USER_AGENT='Admin browser')
+        self.request.user = User.objects.create_superuser('admin', password='admin')
+        self.request.session = {}
+
+    def test_face_registration_comes_from_face_records(self):
+        FaceRecord.objects.filter(personnel_id='102').update(is_active=False)
+        Personnel.objects.create(id_number='103', first_name='Ганаа', last_name='Бат', regiment=self.personnel.regiment)
+
+        personnel = {p.id_number: p for p in self.model_admin.get_queryset(self.request)}
+
+        self.assertTrue(self.model_admin.has_face_registered(personnel['101']))
+        self.assertFalse(self.model_admin.has_face_registered(personnel['102']))
+        self.assertFalse(self.model_admin.has_face_registered(personnel['103']))
+        self.assertNotIn('face_encoding', [field.name for field in Personnel._meta.get_fields()])
+
+    def test_captured_face_is_added_as_an_admin_template(self):
+        self.request.session['face_encoding'] = unit_embedding(6).tolist()
+
+        self.model_admin.save_model(self.request, self.personnel, None, True)
+
+        face_record = FaceRecord.objects.get(personnel_id='101')
+        template = face_record.templates.get()
+        self.assertEqual((template.source, template.device_info), ('admin', 'Admin browser'))
+        np.testing.assert_allclose(decode_embedding(face_record.face_embedding), unit_embedding(6), atol=1e-6)
+        self.assertNotIn('face_encoding', self.request.session)
+
+    def test_captured_face_reactivates_the_face_record(self):
+        personnel = Personnel.objects.create(id_number='103', first_name='Ганаа', last_name='Бат', regiment=self.personnel.regiment)
+        FaceRecord.objects.create(personnel_id='103', is_active=False)
+        self.request.session['face_encoding'] = unit_embedding(7).tolist()
+
+        self.model_admin.save_model(self.request, personnel, None, False)
+
+        face_record = FaceRecord.objects.get(personnel_id='103')
+        self.assertTrue(face_record.is_active)
+        self.assertEqual(face_record.templates.count(), 1)
+
+
+class FaceRecordAdminTests(ArmoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('admin', password='admin'))
+        self.face_record = FaceRecord.objects.get(personnel_id='101')
+        self.templates = [self.face_record.add_template(unit_embedding(seed)) for seed in (3, 4)]
+
+    def save_in_admin(self, delete=()):
+        data = {
+            'personnel_id': '101',
+            'face_image_path': '',
+            'is_active': 'on',
+            'templates-TOTAL_FORMS': len(self.templates),
+            'templates-INITIAL_FORMS': len(self.templates),
+            'templates-MIN_NUM_FORMS': 0,
+            'templates-MAX_NUM_FORMS': 1000,
+        }
+        for number, template in enumerate(self.templates):
+            data[f'templates-{number}-id'] = str(template.id)
+            data[f'templates-{number}-face_record'] = str(self.face_record.id)
+            if template in delete:
+                data[f'templates-{number}-DELETE'] = 'on'
+        response = self.client.post(f'/admin/face_authentication/facerecord/{self.face_record.id}/change/', data)
+        self.assertEqual(response.status_code, 302)
+        self.face_record.refresh_from_db()
+
+    def test_deleting_a_template_recomputes_the_centroid(self):
+        self.save_in_admin(delete=[self.templates[0]])
+
+        np.testing.assert_allclose(decode_embedding(self.face_record.face_embedding), unit_embedding(4), atol=1e-6)
+
+    def test_deleting_every_template_clears_the_embedding(self):
+        self.save_in_admin(delete=self.templates)
+
+        self.assertIsNone(self.face_record.face_embedding)
+        self.assertIsNone(self.face_record.template_embeddings())
+
+    def test_unchanged_templates_keep_the_centroid(self):
+        with mock.patch.object(FaceRecord, 'update_centroid') as update_centroid:
+            self.save_in_admin()
+
+        update_centroid.assert_not_called()
+
+
+class EmbeddingExportTests(ArmoryTestCase):
+
+    def export(self, **params):
+        response = self.client.get('/api/face/export/embeddings/', params)
+        return response, b''.join(response.streaming_content)
+
+    def test_export_holds_every_active_embedding_as_float32(self):
+        FaceRecord.objects.filter(personnel_id='102').update(face_embedding=encode_embedding(unit_embedding(1), 'int8'))
+        FaceRecord.objects.create(personnel_id='103', face_embedding=encode_embedding(unit_embedding(2)), is_active=False)
+
+        response, body = self.export()
+
+        self.assertEqual(response['Content-Type'], 'application/x-face-embeddings')
+        embeddings = parse_export(body)
+        self.assertEqual(sorted(embeddings), ['101', '102'])
+        np.testing.assert_array_equal(embeddings['101'], unit_embedding(0))
+        np.testing.assert_array_equal(
+            embeddings['102'], decode_embedding(FaceRecord.objects.get(personnel_id='102').face_embedding)
+        )
+
+    def test_gzip_export_decodes_to_the_same_embeddings(self):
+        _, plain = self.export()
+        response, body = self.export(compression='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertLess(len(body), len(plain))
+        unpacked = parse_export(gzip.decompress(body))
+        self.assertEqual(unpacked.keys(), parse_export(plain).keys())
+        np.testing.assert_array_equal(unpacked['102'], parse_export(plain)['102'])
+
+    def test_unknown_compression_is_rejected(self):
+        response = self.client.get('/api/face/export/embeddings/', {'compression': 'zip'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_records_are_streamed_in_chunks(self):
+        for seed in range(2, 5):
+            FaceRecord.objects.create(personnel_id=f'2{seed:02d}', face_embedding=encode_embedding(unit_embedding(seed)))
+        chunks = export_records(FaceRecord.objects.filter(is_active=True), chunk_size=2)
+
+        header, id_table = next(chunks), next(chunks)
+        # The record disappears after its id was exported
+        FaceRecord.objects.filter(personnel_id='203').delete()
+        rows = list(chunks)
+
+        self.assertEqual([len(row) for row in rows], [2 * 2048, 2 * 2048, 2048])
+        embeddings = parse_export(header + id_table + b''.join(rows))
+        self.assertEqual(sorted(embeddings), ['101', '102', '202', '204'])
+        np.testing.assert_array_equal(embeddings['204'], unit_embedding(4))
+
+
+class ListFacesTests(ArmoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Three records share a timestamp, so pages have to break ties on the id
+        same_time = timezone.now()
+        for seed in range(2, 5):
+            FaceRecord.objects.create(personnel_id=f'2{seed:02d}', face_embedding=encode_embedding(unit_embedding(seed)))
+        FaceRecord.objects.filter(personnel_id__in=['102', '202', '203']).update(last_updated=same_time)
+
+    def list_faces(self, **params):
+        return self.client.get('/api/face/list_faces/', params)
+
+    def test_pages_cover_every_record_once(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            page = self.list_faces(**params).json()
+            self.assertLessEqual(page['count'], 2)
+            seen.extend(record['personnel_id'] for record in page['records'])
+            cursor = page['next_cursor']
+            if not page['has_more']:
+                break
+
+        expected = FaceRecord.objects.order_by('last_updated', 'pk').values_list('personnel_id', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_record_updated_while_paging_is_not_skipped(self):
+        first = self.list_faces(limit=2).json()
+        updated = first['records'][0]['personnel_id']
+        FaceRecord.objects.get(personnel_id=updated).save()
+
+        rest = self.list_faces(cursor=first['next_cursor'], limit=10).json()
+
+        ids = [record['personnel_id'] for record in first['records'] + rest['records']]
+        self.assertEqual(sorted(set(ids)), ['101', '102', '202', '203', '204'])
+        self.assertEqual(rest['records'][-1]['personnel_id'], updated)
+
+    def test_stream_returns_every_record_after_the_cursor(self):
+        first = self.list_faces(limit=2).json()
+
+        response = self.list_faces(stream=1, cursor=first['next_cursor'])
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(all(line['has_embedding'] for line in lines))
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.list_faces(cursor='not-a-cursor').status_code, 400)
+        # Streaming fails before the response starts instead of mid-body
+        response = self.list_faces(stream=1, cursor='not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.streaming)
+
+
+class ConditionalGetTests(ArmoryTestCase):
+
+    def list_faces(self, **headers):
+        return self.client.get('/api/face/list_faces/', headers=headers)
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.list_faces()['ETag']
+
+        # The session user and the change stamp, the view itself does not run
+        with self.assertNumQueries(2):
+            response = self.list_faces(if_none_match=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_changed_list_gets_a_new_etag(self):
+        etag = self.list_faces()['ETag']
+        FaceRecord.objects.get(personnel_id='101').save()
+
+        response = self.list_faces(if_none_match=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_query_string_is_part_of_the_etag(self):
+        etag = self.list_faces()['ETag']
+
+        response = self.client.get('/api/face/list_faces/', {'limit': 1}, headers={'if_none_match': etag})
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        last_modified = self.list_faces()['Last-Modified']
+
+        self.assertEqual(self.list_faces(if_modified_since=last_modified).status_code, 304)
+        earlier = http_date(FaceChange.stamp()[1].timestamp() - 60)
+        self.assertEqual(self.list_faces(if_modified_since=earlier).status_code, 200)
+
+    def test_missing_face_record_has_no_validators(self):
+        response = self.client.get('/api/face/get_face_data/999/')
+
+        self.assertNotIn('ETag', response)
+
+    def test_compressed_response_gets_a_weak_etag_that_still_matches(self):
+        for seed in range(2, 12):
+            FaceRecord.objects.create(personnel_id=f'2{seed:02d}', face_embedding=encode_embedding(unit_embedding(seed)))
+
+        plain = self.list_faces()
+        response = self.list_faces(accept_encoding='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(self.list_faces(accept_encoding='gzip', if_none_match=response['ETag']).status_code, 304)
+
+
+class CompressionMiddlewareTests(TestCase):
+
+    def respond(self, response, accept_encoding='gzip'):
+        middleware = CompressionMiddleware(lambda request: response)
+        return middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding))
+
+    def test_small_and_binary_responses_are_left_alone(self):
+        small = self.respond(HttpResponse(b'{}', content_type='application/json'))
+        binary = self.respond(HttpResponse(b'\0' * 4096, content_type='application/octet-stream'))
+
+        self.assertNotIn('Content-Encoding', small)
+        self.assertNotIn('Content-Encoding', binary)
+
+    def test_client_preference_is_honoured(self):
+        middleware = CompressionMiddleware(None)
+
+        self.assertEqual(middleware.negotiate('gzip;q=1.0, br;q=0'), 'gzip')
+        self.assertIsNone(middleware.negotiate('identity'))
+        self.assertIsNone(middleware.negotiate('gzip;q=0'))
+        with mock.patch('armory_management.middleware.brotli', None):
+            self.assertEqual(middleware.negotiate('br, *;q=0.5'), 'gzip')
+
+    def test_weak_etag_is_not_weakened_twice(self):
+        response = HttpResponse(b'{"records": []}' * 200, content_type='application/json')
+        response['ETag'] = 'W/"abc"'
+
+        response = self.respond(response, 'gzip;q=1.0, br;q=0')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+
+
+class FaceChangesTests(ArmoryTestCase):
+
+    def changes(self, **params):
+        return self.client.get('/api/face/changes/', params)
+
+    def save_embedding(self, personnel_id, seed):
+        face_record = FaceRecord.objects.get(personnel_id=personnel_id)
+        face_record.face_embedding = encode_embedding(unit_embedding(seed), 'float16')
+        face_record.save()
+
+    def test_each_personnel_is_sent_once_with_its_current_state(self):
+        base = FaceChange.latest_seq()
+        self.save_embedding('101', 5)
+        self.save_embedding('102', 6)
+        self.save_embedding('101', 7)
+        FaceRecord.objects.get(personnel_id='102').delete()
+
+        page = self.changes(since=base).json()
+
+        self.assertEqual(page['cursor'], base + 4)
+        self.assertEqual(
+            [(change['seq'], change['personnel_id'], change['action']) for change in page['changes']],
+            [(base + 3, '101', 'upsert'), (base + 4, '102', 'delete')]
+        )
+        embedding = np.frombuffer(base64.b64decode(page['changes'][0]['embedding']), dtype=np.float32)
+        np.testing.assert_allclose(embedding, unit_embedding(7), atol=1e-3)
+
+    def test_changes_are_paged(self):
+        base = FaceChange.latest_seq()
+        self.save_embedding('101', 5)
+        self.save_embedding('102', 6)
+
+        first = self.changes(since=base, limit=1).json()
+        second = self.changes(since=first['cursor'], limit=1).json()
+        last = self.changes(since=second['cursor'], limit=1).json()
+
+        self.assertEqual((first['cursor'], first['has_more']), (base + 1, True))
+        self.assertEqual([change['personnel_id'] for change in first['changes']], ['101'])
+        self.assertEqual((second['cursor'], second['has_more']), (base + 2, False))
+        self.assertEqual([change['personnel_id'] for change in second['changes']], ['102'])
+        self.assertEqual((last['cursor'], last['count']), (base + 2, 0))
+
+    def test_cursor_unknown_to_the_server_is_gone(self):
+        response = self.changes(since=FaceChange.latest_seq() + 100)
+
+        self.assertEqual(response.status_code, 410)
+
+    def test_malformed_parameters_are_rejected(self):
+        self.assertEqual(self.changes(since='latest').status_code, 400)
+        self.assertEqual(self.changes(since=0, limit=0).status_code, 400)
+
+
+class FaceChangeCursorTests(ArmoryTestCase):
+
+    def changes(self, since):
+        return self.client.get('/api/face/changes/', {'since': since}).json()
+
+    def test_change_committed_out_of_order_is_not_skipped(self):
+        base = FaceChange.latest_seq()
+        # base + 1 is taken by a registration still running inference in its
+        # transaction when base + 2 commits
+        FaceChange.objects.create(seq=base + 2, personnel_id='102', action='upsert')
+
+        page = self.changes(base)
+        self.assertEqual([change['personnel_id'] for change in page['changes']], ['102'])
+        self.assertEqual(page['cursor'], base)
+        self.assertFalse(page['has_more'])
+
+        # The older transaction commits
+        FaceRecord.objects.filter(personnel_id='101').update(is_active=False)
+        FaceChange.objects.create(seq=base + 1, personnel_id='101', action='delete')
+
+        page = self.changes(page['cursor'])
+        self.assertEqual(
+            [(change['personnel_id'], change['action']) for change in page['changes']],
+            [('101', 'delete'), ('102', 'upsert')]
+        )
+        self.assertEqual(page['cursor'], base + 2)
+
+    def test_sequence_of_rolled_back_change_is_passed_eventually(self):
+        base = FaceChange.latest_seq()
+        FaceChange.objects.create(seq=base + 2, personnel_id='102', action='upsert')
+
+        with override_settings(FACE_CHANGES_MAX_COMMIT_DELAY=600):
+            self.assertEqual(FaceChange.cursor(), base)
+        FaceChange.objects.filter(seq=base + 2).update(created_at=timezone.now() - timedelta(minutes=11))
+        with override_settings(FACE_CHANGES_MAX_COMMIT_DELAY=600):
+            self.assertEqual(FaceChange.cursor(), base + 2)
+
+    def test_export_cursor_stays_below_uncommitted_change(self):
+        base = FaceChange.latest_seq()
+        FaceChange.objects.create(seq=base + 2, personnel_id='102', action='upsert')
+
+        response = self.client.get('/api/face/export/embeddings/')
+
+        self.assertEqual(response['X-Change-Cursor'], str(base))
@@ -0,0 +1,117 @@
+# face_authentication/transactions.py
+import logging
+
+from django.db import transaction
+from django.dispatch import Signal
+
+from inventory.models import Weapon
+
+logger = logging.getLogger(__name__)
+
+# Sent after weapon transactions were written with bulk_create/bulk_update,
+# which send no post_save; arguments: transactions, weapons
+transactions_committed = Signal()
+
+# Kiosk spellings of the transaction types
+TRANSACTION_TYPE_ALIASES = {
+    'check_in': 'checkin',
+    'check_out': 'checkout',
+}
+
+# Weapon.location after each transaction type
+LOCATION_AFTER = {
+    'checkout': 'out',
+    'checkin': 'in',
+}
+
+
+class TransactionRejected(Exception):
+    """The weapon's current state does not allow the transaction"""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def normalize_transaction_type(transaction_type):
+    """Model transaction type for a kiosk transaction type"""
+    return TRANSACTION_TYPE_ALIASES.get(transaction_type, transaction_type)
+
+
+def validate_transaction(weapon, personnel, transaction_type):
+    """
+    Check a transaction against the weapon's current state, in memory.
+
+    Raises:
+        TransactionRejected: If the weapon cannot take part in the transaction
+    """
+    if transaction_type not in ('checkin', 'checkout', 'reassign'):
+        raise TransactionRejected(f'Unknown transaction type: {transaction_type}')
+
+    if transaction_type == 'checkout':
+        if weapon.location == 'out':
+            raise TransactionRejected('This weapon is already checked out and not in the armory')
+        if weapon.status in ('maintenance', 'decommissioned'):
+            raise TransactionRejected(f'This weapon cannot be checked out while {weapon.status}')
+    elif transaction_type == 'checkin':
+        if weapon.location == 'in':
+            raise TransactionRejected('This weapon is already checked in and in the armory')
+
+    if transaction_type in LOCATION_AFTER and weapon.assigned_to_id and weapon.assigned_to_id != personnel.pk:
+        raise TransactionRejected('This weapon is assigned to different personnel')
+
+
+def commit_transaction(weapon_id, personnel, transaction_type, log_fields, qr_code=None, **transaction_fields):
+    """
+    Record a verified weapon transaction.
+
+    The weapon row is locked once; the state checks run against that
+    locked copy, and the authentication log, the transaction and the
+    location change are written in the same database transaction. Two
+    kiosks checking out the same weapon at once cannot both succeed.
+
+    Args:
+        weapon_id: Weapon primary key
+        personnel: Verified Personnel or PersonnelSnapshot
+        transaction_type (str): Model transaction type
+        log_fields (dict): AuthenticationLog fields of the verification
+        qr_code (str, optional): Scanned QR code; weapon_id may come from a
+            cache, the locked weapon has to still carry it
+        **transaction_fields: Further WeaponTransaction fields
+
+    Returns:
+        tuple: (WeaponTransaction, locked Weapon after the change)
+
+    Raises:
+        Weapon.DoesNotExist: If the weapon is gone or has another QR code
+        TransactionRejected: If the weapon's state does not allow it; the
+            caller still has to log the verification
+    """
+    from .auth_log import auth_log_writer
+    from .models import WeaponTransaction
+
+    with transaction.atomic():
+        weapon = Weapon.objects.select_for_update().get(pk=weapon_id)
+        if qr_code is not None and weapon.qr_code != qr_code:
+            raise Weapon.DoesNotExist(f'Weapon {weapon_id} no longer has QR code {qr_code}')
+        validate_transaction(weapon, personnel, transaction_type)
+
+        # The transaction references the log, so it cannot wait in the writer's queue
+        authentication_log = auth_log_writer.log_now(**log_fields)
+
+        weapon_transaction = WeaponTransaction(
+            weapon=weapon,
+            personnel_id=personnel.pk,
+            transaction_type=transaction_type,
+            auth_log=authentication_log,
+            **transaction_fields
+        )
+        # The row lock already guarantees the assignment cannot change underneath
+        weapon_transaction.save(weapon_locked=True)
+
+        location = LOCATION_AFTER.get(transaction_type)
+        if location and weapon.location != location:
+            weapon.location = location
+            weapon.save(update_fields=['location'])
+
+    return weapon_transaction, weapon
@@ -7,11 +7,19 @@ app_name = 'face_authentication'
 urlpatterns = [
     # Face authentication endpoints
     path('register/', views.register_face, name='register_face'),
+    path('register/bulk/', views.register_faces_bulk, name='register_faces_bulk'),
+    path('register/jobs/<uuid:job_id>/', views.registration_job_status, name='registration_job_status'),
     path('verify/', views.verify_face, name='verify_face'),
+    path('identify/', views.identify_face, name='identify_face'),
     path('list_faces/', views.list_faces, name='list_faces'),
     path('get_face_data/<str:personnel_id>/', views.get_face_data, name='get_face_data'),
+    path('export/embeddings/', views.export_embeddings, name='export_embeddings'),
+    path('changes/', views.face_changes, name='face_changes'),
+    path('admission/stats/', views.admission_stats, name='admission_stats'),
 
     # Weapon transaction endpoints
     path('weapon/info/', views_transaction.weapon_info, name='weapon_info'),
-    path('weapon/transaction/', views_transaction.weapon_transaction, name='wapon_transaction')
+    path('weapon/transaction/', views_transaction.weapon_transaction, name='wapon_transaction'),
+    path('weapon/transaction/batch/', views_transaction.weapon_transaction_batch, name='weapon_transaction_batch'),
+    path('weapon/state/', views_transaction.weapon_state, name='weapon_state')
 ]
\ No newline at end of file
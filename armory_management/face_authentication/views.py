@@ -1,47 +1,107 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from .models import FaceRecord, AuthenticationLog
+from .models import FaceChange, FaceRecord, RegistrationJob
+from .admission import AdmissionRejected, admission_control, inference_admission, rejected_response
+from .auth_log import auth_log_writer
+from .coalescing import coalesce_requests, request_key, verification_flight
 from .arcface_client import ArcFaceClient
+from .bulk_enrollment import ArchiveTooLarge, BulkEnrollment, iter_archive
+from .embeddings import decode_embedding
+from .embedding_export import CONTENT_TYPE as EXPORT_CONTENT_TYPE, export_records, gzip_stream
+from .embedding_cache import embedding_cache
+from .gallery import gallery
+from .idempotency import idempotent
+from .pagination import InvalidCursor, keyset_iterator, keyset_page
+from .registration import RegistrationError, decode_face_image, register_face_image, registration_worker
 from inventory.models import Personnel
+from armory_management.conditional import versioned
+import itertools
 import json
 import logging
+import zipfile
 from django.conf import settings
+from django.db.models import BooleanField, ExpressionWrapper, Q
 
 logger = logging.getLogger(__name__)
 arcface_client = ArcFaceClient()
 
+def face_records_stamp(request, *args, **kwargs):
+    return FaceChange.stamp()
+
+
+def face_data_stamp(request, personnel_id):
+    row = FaceRecord.objects.filter(personnel_id=personnel_id, is_active=True).values_list(
+        'last_updated', 'face_image_path'
+    ).first()
+    if row is None:
+        return None
+    last_updated, face_image_path = row
+    # Image path updates don't touch last_updated
+    return f"{last_updated.isoformat()}|{face_image_path}", last_updated
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@versioned(face_records_stamp)
 def list_faces(request):
     """
     List all available face records.
     Used for syncing local database with server.
+    Pages are ordered by (last_updated, id): pass next_cursor of the previous
+    page as cursor, optionally with limit. With stream=1 every record after
+    the cursor is streamed as JSON lines instead.
     """
     try:
-        # Get all active face records
-        face_records = FaceRecord.objects.filter(is_active=True)
-        
-        # Prepare response
-        records = []
-        for record in face_records:
-            records.append({
-                'personnel_id': record.personnel_id,
-                'registration_date': record.registration_date.isoformat(),
-                'last_updated': record.last_updated.isoformat(),
-                'has_embedding': bool(record.face_embedding)
-            })
+        # The embedding blob is never loaded, only tested for presence
+        face_records = FaceRecord.objects.filter(is_active=True).only(
+            'id', 'personnel_id', 'registration_date', 'last_updated'
+        ).annotate(
+            has_embedding=ExpressionWrapper(Q(face_embedding__isnull=False), output_field=BooleanField())
+        )
+        cursor = request.query_params.get('cursor')
+        
+        if request.query_params.get('stream') in ('1', 'true'):
+            rows = keyset_iterator(face_records, 'last_updated', cursor)
+            # Fail with a 400 on a bad cursor before the response starts
+            first = next(rows, None)
+            lines = (
+                json.dumps(face_record_summary(record)) + '\n'
+                for record in itertools.chain([first] if first else [], rows)
+            )
+            return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        
+        try:
+            limit = int(request.query_params.get('limit', getattr(settings, 'FACE_LIST_PAGE_SIZE', 500)))
+        except ValueError:
+            return Response(
+                {'error': 'limit must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, getattr(settings, 'FACE_LIST_MAX_PAGE_SIZE', 5000)))
+        
+        page, next_cursor = keyset_page(face_records, 'last_updated', cursor, limit)
+        records = [face_record_summary(record) for record in page]
         
         return Response({
             'status': 'success',
             'count': len(records),
-            'records': records
+            'records': records,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
         })
     
+    except InvalidCursor as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
     except Exception as e:
         logger.error(f"Error listing face records: {str(e)}")
         return Response(
@@ -50,8 +110,154 @@ def list_faces(request):
         )
 
 
+def face_record_summary(record):
+    """list_faces entry of a face record annotated with has_embedding"""
+    return {
+        'personnel_id': record.personnel_id,
+        'registration_date': record.registration_date.isoformat(),
+        'last_updated': record.last_updated.isoformat(),
+        'has_embedding': record.has_embedding
+    }
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_embeddings(request):
+    """
+    Export every active face embedding in one streamed binary response.
+    Used by the kiosk to sync its local database in a single request.
+    The layout is described in embedding_export.py; pass compression=gzip
+    for a gzip-encoded body.
+    """
+    try:
+        # Taken before the export, so later changes reach the client as deltas
+        cursor = FaceChange.cursor()
+        records = FaceRecord.objects.filter(is_active=True)
+        chunks = export_records(records)
+        
+        compression = request.query_params.get('compression')
+        if compression not in (None, '', 'gzip'):
+            return Response(
+                {'error': f'Unsupported compression: {compression}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if compression == 'gzip':
+            chunks = gzip_stream(chunks)
+        
+        response = StreamingHttpResponse(chunks, content_type=EXPORT_CONTENT_TYPE)
+        response['Content-Disposition'] = 'attachment; filename="face_embeddings.bin"'
+        response['X-Change-Cursor'] = str(cursor)
+        if compression == 'gzip':
+            response['Content-Encoding'] = 'gzip'
+        return response
+    
+    except Exception as e:
+        logger.error(f"Error exporting face embeddings: {str(e)}")
+        return Response(
+            {'error': f'Failed to export face embeddings: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def face_changes(request):
+    """
+    Face records changed since a cursor, for incremental kiosk sync.
+    Expects: since (cursor from the previous call or X-Change-Cursor of
+    the export), optional limit.
+    Each personnel appears once per page with its current state: 'upsert'
+    with the embedding or 'delete' for deactivated and deleted records.
+    The cursor never passes a change that may still commit (see
+    FaceChange.cursor), so changes above it can be sent again; applying a
+    current state twice is harmless.
+    """
+    try:
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = min(int(request.query_params.get('limit', 500)), getattr(settings, 'FACE_CHANGES_MAX_LIMIT', 5000))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'since and limit must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if limit < 1:
+            return Response(
+                {'error': 'limit must be positive'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if since > 0 and not FaceChange.objects.filter(seq__gte=since).exists():
+            # Cursor from before a database restore, the client has to start over
+            return Response(
+                {'error': 'Unknown cursor, download the full export'},
+                status=status.HTTP_410_GONE
+            )
+        
+        # Taken before the changes are read, everything up to it is in the read
+        safe_cursor = FaceChange.cursor()
+        changes = list(FaceChange.objects.filter(seq__gt=since).order_by('seq').values_list('seq', 'personnel_id')[:limit + 1])
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        
+        cursor = changes[-1][0] if changes else since
+        if cursor > safe_cursor:
+            # A lower sequence number is still uncommitted, stay below it
+            cursor = max(safe_cursor, since)
+            has_more = False
+        
+        # Only the latest change per personnel matters, its current state is sent
+        latest = {}
+        for seq, personnel_id in changes:
+            latest[personnel_id] = seq
+        
+        records = FaceRecord.objects.filter(
+            personnel_id__in=latest.keys(),
+            is_active=True,
+            face_embedding__isnull=False
+        ).values_list('personnel_id', 'face_embedding', 'last_updated')
+        current = {personnel_id: (embedding, last_updated) for personnel_id, embedding, last_updated in records}
+        
+        import base64
+        results = []
+        for personnel_id, seq in sorted(latest.items(), key=lambda item: item[1]):
+            if personnel_id in current:
+                embedding, last_updated = current[personnel_id]
+                results.append({
+                    'seq': seq,
+                    'personnel_id': personnel_id,
+                    'action': 'upsert',
+                    # Always hand out float32, whatever the storage encoding
+                    'embedding': base64.b64encode(decode_embedding(embedding).tobytes()).decode('utf-8'),
+                    'last_updated': last_updated.isoformat()
+                })
+            else:
+                results.append({
+                    'seq': seq,
+                    'personnel_id': personnel_id,
+                    'action': 'delete'
+                })
+        
+        return Response({
+            'status': 'success',
+            'cursor': cursor,
+            'has_more': has_more,
+            'count': len(results),
+            'changes': results
+        })
+    
+    except Exception as e:
+        logger.error(f"Error listing face changes: {str(e)}")
+        return Response(
+            {'error': f'Failed to list face changes: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@versioned(face_data_stamp)
 def get_face_data(request, personnel_id):
     """
     Get face embedding data for a specific personnel.
@@ -76,7 +282,8 @@ def get_face_data(request, personnel_id):
         
         # Convert embedding to base64
         import base64
-        embedding_b64 = base64.b64encode(face_record.face_embedding).decode('utf-8')
+        # Always hand out float32, whatever the storage encoding
+        embedding_b64 = base64.b64encode(decode_embedding(face_record.face_embedding).tobytes()).decode('utf-8')
         
         # Get face image URL if available
         face_image_url = None
@@ -102,10 +309,13 @@ def get_face_data(request, personnel_id):
     
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('register_face')
 def register_face(request):
     """
     Register a face for a personnel.
     Expects: personnel_id and face_image (base64 encoded)
+    With async=true the registration is queued and 202 is returned with a
+    job id that can be polled at register/jobs/<job_id>/.
     """
     try:
         # Get request data
@@ -118,75 +328,182 @@ def register_face(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Check if personnel exists
-        try:
-            personnel = Personnel.objects.get(id_number=personnel_id)
-        except Personnel.DoesNotExist:
-            logger.error(f"Personnel with ID {personnel_id} not found")
-            return Response(
-                {'error': f'Personnel ID not found in the system'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        face_image_data = decode_face_image(face_image_b64)
         
-        # Decode base64 image
-        import base64
-        from django.core.files.base import ContentFile
+        # Capture conditions (lighting, glasses, ...) reported by the kiosk
+        capture_metadata = request.data.get('capture_metadata')
+        if not isinstance(capture_metadata, dict):
+            capture_metadata = {}
         
-        # Remove data URL prefix if present
-        if ',' in face_image_b64:
-            face_image_b64 = face_image_b64.split(',')[1]
+        device_info = request.META.get('HTTP_USER_AGENT', '')[:255]
         
-        face_image_data = base64.b64decode(face_image_b64)
+        run_async = request.data.get('async', request.query_params.get('async'))
+        if run_async in (True, 'true', 'True', '1', 1):
+            # Reject unknown personnel right away instead of in the job
+            if not Personnel.objects.filter(id_number=personnel_id).exists():
+                logger.error(f"Personnel with ID {personnel_id} not found")
+                return Response(
+                    {'error': f'Personnel ID not found in the system'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            
+            job = RegistrationJob.objects.create(
+                personnel_id=personnel_id,
+                image_data=face_image_data,
+                source='kiosk',
+                device_info=device_info,
+                capture_metadata=capture_metadata
+            )
+            registration_worker.submit(job.id)
+            
+            return Response({
+                'status': 'pending',
+                'job_id': str(job.id),
+                'status_url': request.build_absolute_uri(
+                    reverse('face_authentication:registration_job_status', args=[job.id])
+                )
+            }, status=status.HTTP_202_ACCEPTED)
         
-        # Extract face embeddings using ArcFace
-        result = arcface_client.extract_embeddings(face_image_data)
+        try:
+            # Synchronous registration waits on the inference server
+            with inference_admission.admit():
+                result = register_face_image(
+                    personnel_id,
+                    face_image_data,
+                    source='kiosk',
+                    device_info=device_info,
+                    metadata=capture_metadata,
+                    client=arcface_client
+                )
+        except AdmissionRejected as e:
+            return rejected_response(e)
+        except RegistrationError as e:
+            return Response({'error': e.message}, status=e.status_code)
         
-        if 'error' in result or result.get('status') == 'ERROR':
+        return Response({
+            'status': 'success',
+            'message': 'Face registered successfully',
+            **result
+        })
+    
+    except Exception as e:
+        logger.error(f"Face registration error: {str(e)}")
+        return Response(
+            {'error': f'Face registration failed: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@admission_control(inference_admission)
+def register_faces_bulk(request):
+    """
+    Enroll a whole unit at once.
+    Expects multipart data with a zip 'archive' and/or several 'images'
+    files, each named by the personnel id_number (e.g. 123.jpg, 123_2.jpg).
+    Returns a per-file report.
+    """
+    try:
+        max_files = getattr(settings, 'FACE_BULK_ENROLL_MAX_FILES', 1000)
+        max_image_bytes = getattr(settings, 'FACE_BULK_ENROLL_MAX_IMAGE_BYTES', 10 * 1024 * 1024)
+        images = request.FILES.getlist('images')
+        
+        # Limits are checked before any image is read or decompressed
+        if len(images) > max_files:
             return Response(
-                {'error': result.get('error', 'Failed to extract face embeddings')},
+                {'error': f'At most {max_files} images can be enrolled at once'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        for image in images:
+            if image.size > max_image_bytes:
+                return Response(
+                    {'error': f'{image.name} is larger than {max_image_bytes} bytes'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
         
-        # Get the embedding bytes
-        embedding_bytes = result.get('embedding_bytes')
+        items = []
+        archive = request.FILES.get('archive')
+        if archive:
+            try:
+                items.extend(iter_archive(archive, max_files=max_files - len(images), max_image_bytes=max_image_bytes))
+            except zipfile.BadZipFile:
+                return Response(
+                    {'error': 'Archive is not a valid zip file'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            except ArchiveTooLarge as e:
+                return Response(
+                    {'error': str(e)},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
         
-        if not embedding_bytes:
+        for image in images:
+            items.append((image.name, image.read()))
+        
+        if not items:
             return Response(
-                {'error': 'No face embedding generated'},
+                {'error': 'An archive or image files are required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create or update face record
-        face_record, created = FaceRecord.objects.update_or_create(
-            personnel_id=personnel_id,
-            defaults={
-                'face_embedding': embedding_bytes,
-                'is_active': True
-            }
-        )
-        
-        # Save the face image
-        face_record.save_face_image(face_image_data)
-        
-        # Update the Personnel record with the same embedding
-        personnel.face_encoding = embedding_bytes
-        personnel.save(update_fields=['face_encoding'])
+        reports = BulkEnrollment(
+            client=arcface_client,
+            device_info=request.META.get('HTTP_USER_AGENT', '')
+        ).run(items)
         
+        enrolled = sum(report['status'] == 'enrolled' for report in reports)
         return Response({
-            'status': 'success',
-            'message': 'Face registered successfully',
-            'face_id': str(face_record.id),
-            'created': created
+            'status': 'success' if enrolled == len(reports) else 'partial',
+            'total': len(reports),
+            'enrolled': enrolled,
+            'failed': len(reports) - enrolled,
+            'results': reports
         })
     
     except Exception as e:
-        logger.error(f"Face registration error: {str(e)}")
+        logger.error(f"Bulk face registration error: {str(e)}")
         return Response(
-            {'error': f'Face registration failed: {str(e)}'},
+            {'error': f'Bulk face registration failed: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def registration_job_status(request, job_id):
+    """
+    Get the state of an asynchronous face registration.
+    The result fields match the synchronous register response once the job succeeded.
+    """
+    try:
+        job = RegistrationJob.objects.defer('image_data').get(id=job_id)
+    except RegistrationJob.DoesNotExist:
+        return Response(
+            {'error': f'Registration job {job_id} not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    data = {
+        'job_id': str(job.id),
+        'personnel_id': job.personnel_id,
+        'status': job.status,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    
+    if job.status == 'succeeded':
+        data.update(job.result or {})
+        data['message'] = 'Face registered successfully'
+    elif job.status == 'failed':
+        data['error'] = job.error_message
+    
+    return Response(data)
     
 @api_view(['POST'])
+@coalesce_requests(verification_flight, request_key('personnel_id'), inference_admission)
+@admission_control(inference_admission)
 def verify_face(request):
     """
     Verify a face against a stored record.
@@ -216,12 +533,12 @@ def verify_face(request):
         
         face_image_data = base64.b64decode(face_image_b64)
         
-        # Get face record
-        try:
-            face_record = FaceRecord.objects.get(personnel_id=personnel_id, is_active=True)
-        except FaceRecord.DoesNotExist:
+        # Get the decoded templates, from the cache for recently seen personnel
+        cached_face = embedding_cache.lookup(personnel_id)
+        
+        if cached_face.face_record_id is None:
             # Log failed attempt
-            AuthenticationLog.objects.create(
+            auth_log_writer.log(
                 personnel_id=personnel_id,
                 result='FAILURE',
                 ip_address=ip_address,
@@ -234,18 +551,16 @@ def verify_face(request):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Get stored embedding
-        stored_embedding = face_record.face_embedding
-        
-        # Verify using ArcFace
-        verification_result = arcface_client.verify_identity(
+        # Verify using ArcFace against every template at once
+        verification_result = arcface_client.verify_templates(
             face_image_data, 
-            stored_embedding,
-            threshold=getattr(settings, 'FACE_SIMILARITY_THRESHOLD', 0.6)
+            cached_face.templates,
+            threshold=getattr(settings, 'FACE_SIMILARITY_THRESHOLD', 0.6),
+            policy=getattr(settings, 'FACE_TEMPLATE_POLICY', 'max')
         )
         
         # Log authentication attempt
-        AuthenticationLog.objects.create(
+        auth_log_writer.log(
             personnel_id=personnel_id,
             result=verification_result.get('status', 'ERROR'),
             confidence_score=verification_result.get('confidence', 0.0),
@@ -274,7 +589,7 @@ def verify_face(request):
         logger.error(f"Face verification error: {str(e)}")
         
         # Log error
-        AuthenticationLog.objects.create(
+        auth_log_writer.log(
             personnel_id=personnel_id if 'personnel_id' in locals() else None,
             result='ERROR',
             ip_address=request.META.get('REMOTE_ADDR', None),
@@ -286,3 +601,128 @@ def verify_face(request):
             {'error': f'Face verification failed: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@admission_control(inference_admission)
+def identify_face(request):
+    """
+    Identify a personnel from a face image alone (1:N search).
+    Expects: face_image (base64 encoded), optional top_k
+    """
+    try:
+        face_image_b64 = request.data.get('face_image')
+        
+        if not face_image_b64:
+            return Response(
+                {'error': 'Face image is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            top_k = int(request.data.get('top_k', getattr(settings, 'FACE_IDENTIFY_TOP_K', 5)))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'top_k must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Get client IP and device info for logging
+        ip_address = request.META.get('REMOTE_ADDR', None)
+        device_info = request.META.get('HTTP_USER_AGENT', '')
+        
+        # Decode base64 image
+        import base64
+        
+        # Remove data URL prefix if present
+        if ',' in face_image_b64:
+            face_image_b64 = face_image_b64.split(',')[1]
+        
+        face_image_data = base64.b64decode(face_image_b64)
+        
+        # Extract the probe embedding and search the gallery
+        result = arcface_client.extract_embeddings(face_image_data)
+        
+        if 'error' in result or result.get('status') == 'ERROR' or 'embedding_array' not in result:
+            error_message = result.get('error', 'Failed to extract face embeddings')
+            auth_log_writer.log(
+                result='ERROR',
+                ip_address=ip_address,
+                device_info=device_info,
+                error_message=error_message
+            )
+            return Response(
+                {'error': error_message},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        matches = gallery.search(
+            result['embedding_array'],
+            k=top_k,
+            threshold=getattr(settings, 'FACE_SIMILARITY_THRESHOLD', 0.6)
+        )
+        
+        best_match = matches[0] if matches else None
+        
+        # Log identification attempt against the best candidate
+        auth_log_writer.log(
+            personnel_id=best_match['id'] if best_match else None,
+            result='SUCCESS' if best_match else 'FAILURE',
+            confidence_score=best_match['similarity'] if best_match else 0.0,
+            ip_address=ip_address,
+            device_info=device_info,
+            error_message='' if best_match else 'No matching face found'
+        )
+        
+        if not best_match:
+            return Response({
+                'status': 'failed',
+                'identified': False,
+                'matches': [],
+                'message': 'No matching face found'
+            })
+        
+        personnel_info = None
+        personnel = Personnel.objects.filter(id_number=best_match['id']).select_related('regiment').first()
+        if personnel:
+            personnel_info = {
+                'id': personnel.id,
+                'id_number': personnel.id_number,
+                'name': f"{personnel.first_name} {personnel.last_name}",
+                'rank': personnel.rank,
+                'regiment': str(personnel.regiment),
+            }
+        
+        return Response({
+            'status': 'success',
+            'identified': True,
+            'personnel_id': best_match['id'],
+            'confidence': best_match['similarity'],
+            'personnel_info': personnel_info,
+            'matches': [
+                {'personnel_id': match['id'], 'similarity': match['similarity']}
+                for match in matches
+            ]
+        })
+    
+    except Exception as e:
+        logger.error(f"Face identification error: {str(e)}")
+        return Response(
+            {'error': f'Face identification failed: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def admission_stats(request):
+    """
+    Concurrency and queue wait statistics of the inference-bound endpoints
+    for this worker process.
+    """
+    return Response({
+        'status': 'success',
+        'inference': inference_admission.stats(),
+        'auth_log_pending': auth_log_writer.pending()
+    })
@@ -4,14 +4,25 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from .models import FaceRecord, AuthenticationLog, WeaponTransaction
+from .models import FaceRecord, WeaponState
+from .admission import admission_control, inference_admission
+from .auth_log import auth_log_writer
+from .batch_transactions import BatchTransaction
+from .coalescing import coalesce_requests, request_key, verification_flight
 from .arcface_client import ArcFaceClient
+from .embedding_cache import embedding_cache
+from .idempotency import idempotent
+from .prefetch import prefetch_assignee, redeem_prefetch_token
+from .transactions import TransactionRejected, commit_transaction, normalize_transaction_type
+from .weapon_cache import weapon_cache
 from inventory.models import Personnel, Weapon
 import json
 import logging
 import base64
 import uuid
+from django.db.models import prefetch_related_objects
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
@@ -26,24 +37,23 @@ def weapon_info(request):
         qr_code = request.data.get('qr_code')
         auto_detect = request.data.get('auto_detect', False)
         
-        # Find the weapon by QR code
-        try:
-            weapon = Weapon.objects.get(qr_code=qr_code)
-        except Weapon.DoesNotExist:
+        # Find the weapon by QR code, usually without a query
+        weapon = weapon_cache.lookup(qr_code)
+        if weapon is None:
             return Response(
                 {'error': 'Weapon not found with the provided QR code'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
         # Get weapon's current location
-        location = getattr(weapon, 'location', 'unknown')
+        location = weapon.location or 'unknown'
 
         # Determine recommended action based on location
-        recommended_action = 'check_in' if location == 'field' else 'check_out'
+        recommended_action = 'check_in' if location == 'out' else 'check_out'
         
         # Get weapon info
         weapon_info = {
-            'id': weapon.id,
+            'id': weapon.pk,
             'serial_number': weapon.serial_number,
             'model': weapon.weapon_model,
             'status': weapon.status,
@@ -58,18 +68,22 @@ def weapon_info(request):
             personnel = weapon.assigned_to
             personnel_id = personnel.id_number
             personnel_info = {
-                'id': personnel.id,
+                'id': personnel.pk,
                 'id_number': personnel.id_number,
                 'name': f"{personnel.first_name} {personnel.last_name}",
                 'rank': personnel.rank,
-                'regiment': str(personnel.regiment),
+                'regiment': weapon.regiment,
             }
         
+        # The assignee's face is verified next, have their templates ready
+        prefetch_token = prefetch_assignee(weapon)
+        
         return Response({
             'weapon_info': weapon_info,
             'personnel_id': personnel_id,
             'personnel_info': personnel_info,
-            'recommended_action': recommended_action
+            'recommended_action': recommended_action,
+            'prefetch_token': prefetch_token
         })
         
     except Exception as e:
@@ -80,6 +94,11 @@ def weapon_info(request):
         )
 
 @api_view(['POST'])
+@idempotent('weapon_transaction')
+@coalesce_requests(verification_flight, request_key(
+    'personnel_id', 'qr_code', 'transaction_type', defaults={'transaction_type': 'checkin'}
+), inference_admission)
+@admission_control(inference_admission)
 def weapon_transaction(request):
     """
     Handle weapon transaction (check-in/check-out) with face verification
@@ -101,20 +120,23 @@ def weapon_transaction(request):
         ip_address = request.META.get('REMOTE_ADDR', None)
         device_info = request.META.get('HTTP_USER_AGENT', '')
         
-        # 1. Find the weapon
-        try:
-            weapon = Weapon.objects.get(qr_code=qr_code)
-        except Weapon.DoesNotExist:
-            return Response(
-                {'error': 'Weapon not found with the provided QR code'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        # 1. Find the weapon, a prefetch token from weapon_info already names it
+        weapon_id = redeem_prefetch_token(request.data.get('prefetch_token'), qr_code, personnel_id)
+        if weapon_id is None:
+            cached_weapon = weapon_cache.lookup(qr_code)
+            weapon_id = cached_weapon.pk if cached_weapon else None
+            if weapon_id is None:
+                return Response(
+                    {'error': 'Weapon not found with the provided QR code'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
         
-        # 2. Find the personnel
-        try:
-            personnel = Personnel.objects.get(id_number=personnel_id)
-        except Personnel.DoesNotExist:
-            AuthenticationLog.objects.create(
+        # 2. Find the personnel and their templates, cached for recently seen personnel
+        cached_face = embedding_cache.lookup(personnel_id)
+        personnel = cached_face.personnel
+        
+        if personnel is None:
+            auth_log_writer.log(
                 personnel_id=personnel_id,
                 result='FAILURE',
                 ip_address=ip_address,
@@ -134,11 +156,9 @@ def weapon_transaction(request):
         face_image_data = base64.b64decode(face_image_b64)
         
         # Get face record
-        try:
-            face_record = FaceRecord.objects.get(personnel_id=personnel_id, is_active=True)
-        except FaceRecord.DoesNotExist:
+        if cached_face.face_record_id is None:
             # Log failed attempt
-            AuthenticationLog.objects.create(
+            auth_log_writer.log(
                 personnel_id=personnel_id,
                 result='FAILURE',
                 ip_address=ip_address,
@@ -153,18 +173,15 @@ def weapon_transaction(request):
                 'confidence': 0.0
             })
         
-        # Get stored embedding
-        stored_embedding = face_record.face_embedding
-        
-        # Verify using ArcFace
-        verification_result = arcface_client.verify_identity(
+        # Verify using ArcFace against every template at once
+        verification_result = arcface_client.verify_templates(
             face_image_data, 
-            stored_embedding,
-            threshold=getattr(settings, 'FACE_SIMILARITY_THRESHOLD', 0.6)
+            cached_face.templates,
+            threshold=getattr(settings, 'FACE_SIMILARITY_THRESHOLD', 0.6),
+            policy=getattr(settings, 'FACE_TEMPLATE_POLICY', 'max')
         )
         
-        # Log authentication attempt
-        authentication_log = AuthenticationLog.objects.create(
+        log_fields = dict(
             personnel_id=personnel_id,
             result=verification_result.get('status', 'ERROR'),
             confidence_score=verification_result.get('confidence', 0.0),
@@ -175,6 +192,7 @@ def weapon_transaction(request):
         
         if not verification_result.get('verified', False):
             # Failed face verification
+            auth_log_writer.log(**log_fields)
             return Response({
                 'verified': False,
                 'transaction_success': False,
@@ -182,80 +200,59 @@ def weapon_transaction(request):
                 'confidence': verification_result.get('confidence', 0.0)
             })
         
-        # 4. Check the weapon's current location state
-        # First check if the weapon has a location field
-        weapon_location = getattr(weapon, 'location', None)
-        
-        # If location tracking is available
-        if hasattr(weapon, 'location'):
-            # For checkout transaction
-            if transaction_type == 'check_out' and weapon.location == 'field':
-                return Response({
-                    'verified': True,
-                    'transaction_success': False,
-                    'message': 'This weapon is already checked out and not in the armory',
-                    'confidence': verification_result.get('confidence', 0.0)
-                })
-            # For checkin transaction
-            elif transaction_type == 'check_in' and weapon.location == 'armory':
-                return Response({
-                    'verified': True,
-                    'transaction_success': False,
-                    'message': 'This weapon is already checked in and in the armory',
-                    'confidence': verification_result.get('confidence', 0.0)
-                })
-        
-        # 5. Process transaction
-        transaction_success = False
-        message = ""
+        # 4. Check the weapon's state and record the transaction, the location
+        # change and the log in one database transaction
+        django_transaction_type = normalize_transaction_type(transaction_type)
         
         try:
-            # Map the transaction types to match your model's choices
-            type_mapping = {
-                'check_in': 'checkin',
-                'check_out': 'checkout'
-            }
-            django_transaction_type = type_mapping.get(transaction_type, transaction_type)
-            
-            # Create transaction record
-            transaction = WeaponTransaction(
-                weapon=weapon,
-                personnel=personnel,
-                transaction_type=django_transaction_type,
+            transaction, weapon = commit_transaction(
+                weapon_id,
+                personnel,
+                django_transaction_type,
+                log_fields,
+                qr_code=qr_code,
                 face_confidence_score=verification_result.get('confidence', 0.0),
                 verified_by=f"System-{request.user}" if request.user.is_authenticated else "System",
-                notes=f"Transaction via desktop client: {request.META.get('REMOTE_ADDR', 'Unknown IP')}",
-                auth_log=authentication_log
+                notes=f"Transaction via desktop client: {request.META.get('REMOTE_ADDR', 'Unknown IP')}"
             )
-            
-            # Save the transaction - our model's save method ensures it won't modify assignments
-            transaction.save()
-            
-            # Update the weapon's location if that field exists
-            if hasattr(weapon, 'location'):
-                if django_transaction_type == 'checkout':
-                    weapon.location = 'field'
-                    weapon.save(update_fields=['location'])
-                elif django_transaction_type == 'checkin':
-                    weapon.location = 'armory'
-                    weapon.save(update_fields=['location'])
-            
-            transaction_success = True
-            if django_transaction_type == 'checkin':
-                message = "Weapon checked in successfully"
-            elif django_transaction_type == 'checkout':
-                message = "Weapon checked out successfully"
-            else:
-                message = f"Transaction '{django_transaction_type}' completed successfully"
-                
+        except Weapon.DoesNotExist:
+            auth_log_writer.log(**log_fields)
+            weapon_cache.invalidate(qr_code)
+            return Response(
+                {'error': 'Weapon not found with the provided QR code'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except TransactionRejected as e:
+            auth_log_writer.log(**log_fields)
+            return Response({
+                'verified': True,
+                'transaction_success': False,
+                'message': e.message,
+                'confidence': verification_result.get('confidence', 0.0)
+            })
         except Exception as e:
+            # Nothing was written and no weapon was read, report the failure only
+            auth_log_writer.log(**log_fields)
             logger.error(f"Transaction processing error: {str(e)}")
-            message = f"Transaction processing error: {str(e)}"
+            return Response({
+                'verified': True,
+                'transaction_success': False,
+                'message': f"Transaction processing error: {str(e)}",
+                'confidence': verification_result.get('confidence', 0.0),
+                'transaction_type': transaction_type
+            })
+        
+        if django_transaction_type == 'checkin':
+            message = "Weapon checked in successfully"
+        elif django_transaction_type == 'checkout':
+            message = "Weapon checked out successfully"
+        else:
+            message = f"Transaction '{django_transaction_type}' completed successfully"
         
         # Return result
         return Response({
             'verified': True,
-            'transaction_success': transaction_success,
+            'transaction_success': True,
             'message': message,
             'confidence': verification_result.get('confidence', 0.0),
             'transaction_type': transaction_type,
@@ -277,4 +274,110 @@ def weapon_transaction(request):
         return Response(
             {'error': f'Transaction failed: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent('weapon_transaction_batch')
+@admission_control(inference_admission)
+def weapon_transaction_batch(request):
+    """
+    Handle many weapon transactions (check-in/check-out) in one request,
+    e.g. when a whole unit is issued its weapons.
+    Expects: items, a list of {qr_code, personnel_id, transaction_type,
+    face_image or embedding}. Returns one result per item, in input order.
+    """
+    items = request.data.get('items')
+    if not isinstance(items, list) or not items:
+        return Response(
+            {'error': 'items must be a non-empty list'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    max_items = getattr(settings, 'FACE_BATCH_TRANSACTION_MAX_ITEMS', 200)
+    if len(items) > max_items:
+        return Response(
+            {'error': f'At most {max_items} items per batch'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        ip_address = request.META.get('REMOTE_ADDR', None)
+        batch = BatchTransaction(
+            client=arcface_client,
+            verified_by=f"System-{request.user}",
+            notes=f"Batch transaction via desktop client: {ip_address or 'Unknown IP'}",
+            ip_address=ip_address,
+            device_info=request.META.get('HTTP_USER_AGENT', '')
+        )
+        results = batch.run(items)
+        
+        return Response({
+            'status': 'success',
+            'count': len(results),
+            'succeeded': sum(result['transaction_success'] for result in results),
+            'results': results
+        })
+        
+    except Exception as e:
+        logger.error(f"Batch weapon transaction error: {str(e)}")
+        return Response(
+            {'error': f'Batch transaction failed: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def weapon_state(request):
+    """
+    Where every weapon is and who holds it, from the transaction ledger.
+    Expects: optional as_of (ISO 8601 timestamp) for the state at a point
+    in the past, optional weapon_id to restrict it to one weapon.
+    """
+    try:
+        as_of = request.query_params.get('as_of')
+        weapon_id = request.query_params.get('weapon_id')
+        
+        try:
+            if as_of:
+                as_of = parse_datetime(as_of)
+                if as_of is None:
+                    raise ValueError
+                if timezone.is_naive(as_of):
+                    as_of = timezone.make_aware(as_of)
+            weapon_ids = [int(weapon_id)] if weapon_id else None
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'as_of must be an ISO 8601 timestamp and weapon_id an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if as_of:
+            # Reconstructed from indexed ledger lookups
+            states = WeaponState.as_of(as_of, weapon_ids)
+            prefetch_related_objects(states, 'weapon', 'holder')
+        else:
+            states = WeaponState.objects.select_related('weapon', 'holder').order_by('weapon_id')
+            if weapon_ids is not None:
+                states = states.filter(weapon_id__in=weapon_ids)
+        
+        return Response({
+            'as_of': (as_of or timezone.now()).isoformat(),
+            'count': len(states),
+            'weapons': [{
+                'weapon_id': state.weapon_id,
+                'serial_number': state.weapon.serial_number,
+                'location': state.location,
+                'holder': state.holder.id_number if state.holder else None,
+                'last_transaction_id': str(state.last_transaction_id) if state.last_transaction_id else None,
+                'transaction_type': state.transaction_type,
+                'timestamp': state.timestamp.isoformat()
+            } for state in states]
+        })
+        
+    except Exception as e:
+        logger.error(f"Error retrieving weapon state: {str(e)}")
+        return Response(
+            {'error': f'Failed to retrieve weapon state: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
@@ -0,0 +1,114 @@
+# face_authentication/weapon_cache.py
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .embedding_cache import PersonnelSnapshot
+
+logger = logging.getLogger(__name__)
+
+# assigned_to is a PersonnelSnapshot or None, regiment the assignee's regiment name
+WeaponSnapshot = namedtuple('WeaponSnapshot', [
+    'pk', 'qr_code', 'serial_number', 'weapon_model', 'status', 'location', 'assigned_to', 'regiment', 'expires_at'
+])
+
+
+class WeaponCache:
+    """
+    Bounded LRU cache of weapon snapshots keyed by QR code, so a kiosk
+    scan is answered without a database round trip.
+
+    Entries expire after ``ttl`` seconds and are invalidated by the Weapon,
+    WeaponTransaction and Personnel signals in signals.py. Like the
+    embedding cache, other workers only see a change once the TTL runs
+    out; the transaction commit re-reads and locks the weapon row, so a
+    stale snapshot can only affect what the kiosk displays.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or getattr(settings, 'FACE_WEAPON_CACHE_SIZE', 2048)
+        self.ttl = ttl if ttl is not None else getattr(settings, 'FACE_WEAPON_CACHE_TTL', 300)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, qr_code):
+        """
+        Snapshot of the weapon with a QR code, loaded on a miss.
+
+        Returns:
+            WeaponSnapshot: Snapshot, or None if no weapon has the QR code
+        """
+        if not qr_code:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(qr_code)
+            if entry is not None and entry.expires_at >= time.monotonic():
+                self._entries.move_to_end(qr_code)
+                self.hits += 1
+                return entry
+
+        self.misses += 1
+        entry = self._load(qr_code)
+        if entry is None:
+            # Unknown codes are not cached, a new weapon may be saved by another worker
+            return None
+
+        with self._lock:
+            self._entries[qr_code] = entry
+            self._entries.move_to_end(qr_code)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, qr_code):
+        with self._lock:
+            self._entries.pop(qr_code, None)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry the predicate matches."""
+        with self._lock:
+            for qr_code in [key for key, entry in self._entries.items() if predicate(entry)]:
+                del self._entries[qr_code]
+
+    def invalidate_weapons(self, weapon_ids):
+        weapon_ids = set(weapon_ids)
+        self.invalidate_where(lambda entry: entry.pk in weapon_ids)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _load(self, qr_code):
+        from inventory.models import Weapon
+
+        weapon = Weapon.objects.select_related('assigned_to__regiment').filter(qr_code=qr_code).first()
+        if weapon is None:
+            return None
+
+        personnel = weapon.assigned_to
+        return WeaponSnapshot(
+            pk=weapon.pk,
+            qr_code=weapon.qr_code,
+            serial_number=weapon.serial_number,
+            weapon_model=weapon.weapon_model,
+            status=weapon.status,
+            location=weapon.location,
+            assigned_to=PersonnelSnapshot(
+                personnel.pk, personnel.id_number, personnel.first_name, personnel.last_name, personnel.rank
+            ) if personnel else None,
+            regiment=str(personnel.regiment) if personnel else None,
+            expires_at=time.monotonic() + self.ttl
+        )
+
+
+# Shared cache for the Django process
+weapon_cache = WeaponCache()
@@ -3,6 +3,7 @@ from django.utils.html import format_html
 from django.shortcuts import redirect, render
 from django.urls import path
 from django.http import JsonResponse
+from django.db.models import Exists, OuterRef
 from .models import Personnel, Weapon, Regiment
 from face_authentication.face_utils import FaceRecognition
 import segno
@@ -35,9 +36,21 @@ class PersonnelAdmin(ModelAdmin):
     search_fields = ('id_number', 'first_name', 'last_name', 'rank', 'regiment')
     list_filter = ('rank', 'regiment', 'active_status')
     
+    def get_queryset(self, request):
+        # Face data lives in FaceRecord, only its existence is needed here
+        from face_authentication.models import FaceRecord
+        return super().get_queryset(request).annotate(
+            face_registered=Exists(FaceRecord.objects.filter(
+                personnel_id=OuterRef('id_number'),
+                is_active=True,
+                face_embedding__isnull=False
+            ))
+        )
+    
     def has_face_registered(self, obj):
-        return bool(obj.face_encoding)
+        return obj.face_registered
     has_face_registered.boolean = True
+    has_face_registered.admin_order_field = 'face_registered'
     
     def has_weapon(self, obj):
         try:
@@ -47,20 +60,26 @@ class PersonnelAdmin(ModelAdmin):
     has_weapon.boolean = True
     
     def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        
         if 'face_encoding' in request.session:
-            face_encoding = np.array(request.session['face_encoding'])
-            obj.face_encoding = face_encoding.tobytes()
+            face_encoding = np.array(request.session['face_encoding'], dtype=np.float32)
             del request.session['face_encoding']
             
+            # Store the captured face as a template of the personnel's face record
+            from face_authentication.models import FaceRecord, FaceRegistrationLog
+            face_record, _ = FaceRecord.objects.get_or_create(personnel_id=obj.id_number)
+            if not face_record.is_active:
+                face_record.is_active = True
+                face_record.save(update_fields=['is_active', 'last_updated'])
+            face_record.add_template(face_encoding, source='admin', device_info=request.META.get('HTTP_USER_AGENT', ''))
+            
             # Log the face registration
-            from face_authentication.models import FaceRegistrationLog
             FaceRegistrationLog.objects.create(
                 personnel=obj,
                 registered_by=request.user.username,
                 successful=True
             )
-            
-        super().save_model(request, obj, form, change)
 
 class WeaponAdmin(ModelAdmin):
     list_display = ('serial_number', 'weapon_model', 'status', 'assigned_to', 'display_qr_code')
@@ -102,7 +102,6 @@ class Command(BaseCommand):
                 last_name=last_name,
                 rank=rank,
                 regiment=regiment,
-                face_encoding=embedding_bytes,
                 active_status=random.random() > 0.1,  # 10% chance of being inactive
                 registration_date=timezone.now() - timedelta(days=random.randint(0, 365))
             )
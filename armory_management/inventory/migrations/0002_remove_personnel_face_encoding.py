@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+        # Embeddings are copied to FaceRecord before the column goes away
+        ('face_authentication', '0004_move_personnel_face_encodings'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='personnel',
+            name='face_encoding',
+        ),
+    ]
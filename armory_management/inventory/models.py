@@ -1,5 +1,5 @@
 # inventory/models.py
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 import segno
 import uuid
@@ -31,13 +31,17 @@ class Personnel(models.Model):
                                  on_delete=models.PROTECT,
                                  related_name='personnel',
                                  verbose_name=_("Салбар нэгж"))
-    face_encoding = models.BinaryField(null=True, blank=True, verbose_name=_("Царайны өгөгдөл"))
     active_status = models.BooleanField(default=True, verbose_name=_("Алба хааж байгаа төлөв"))
     registration_date = models.DateTimeField(auto_now_add=True, verbose_name=_("Бүртгэсэн огноо"))
     
     def __str__(self):
         return f"{self.rank} {self.first_name} {self.last_name} ({self.id_number})"
     
+    def save(self, *args, **kwargs):
+        # Dashboard counters are updated by a post_save handler, commit them with the row
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
     class Meta:
         verbose_name = _("Алба хаагч")
         verbose_name_plural = _("Алба хаагчид")
@@ -92,13 +96,15 @@ class Weapon(models.Model):
             self.qr_code = f"WPN-{self.serial_number}-{unique_id[:12]}"
 
         # buund hariutsagch onooson bol 'assigned' bolno
-        if self.assigned_to:
+        if self.assigned_to_id:
             self.status = 'assigned'
         elif self.status == 'assigned':
             # buu ezemshigchgui tohioldold tuluv n 'available' bolnl
             self.status = 'available'
         
-        super().save(*args, **kwargs)
+        # Dashboard counters are updated by a post_save handler, commit them with the row
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def generate_qr_code_image(self):
         if self.qr_code: